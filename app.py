@@ -1,13 +1,18 @@
+import argparse
 from object.logger import logging
 from object.exception import objException
 import sys
 logging.info(" thsi is inside the mesage")
 
-from object.pipeline.training_pipeline import TrainingPipeline
+from object.pipeline.training_pipeline import STAGES, TrainingPipeline
 if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume-from", choices=STAGES, default=None,
+                        help="restore the persisted artifacts of earlier stages and rerun from this stage")
+    args = parser.parse_args()
     try:
         training_pipeline= TrainingPipeline()
-        training_pipeline.run_pipeline()
+        training_pipeline.run_pipeline(resume_from=args.resume_from)
 
     except Exception as e:
         raise objException(e,sys)
\ No newline at end of file
@@ -1,9 +1,10 @@
 import os
 import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from object.logger import logging
 from pathlib import Path
 # from six.moves import urllib
-import zipfile
 import numpy as np
 from object.exception import objException
 from botocore.exceptions import ClientError
@@ -12,6 +13,10 @@ from pandas import DataFrame, read_csv
 from object.configuration.s3_operations import S3Operation
 from object.entity.artifacts_entity import DataIngestionArtifact
 from object.entity.config_entity import DataIngestionConfig
+from object.utils.dataset_manifest import diff_manifests, load_manifest, save_manifest, verify_local_files
+from object.utils.zip_extractor import (
+    EOCD_SEARCH_SIZE, StreamingZipExtractor, locate_central_directory, parse_central_directory, read_member
+)
 
 
 class DataIngestion:
@@ -23,7 +28,7 @@ class DataIngestion:
         except Exception as e:
             raise objException(e, sys)
         
-    def download_data(self)->str:
+    def download_data(self, extractor: StreamingZipExtractor = None)->str:
         try:
             zip_download_dir = self.data_ingestion_config.data_ingestion_dir
             if not os.path.exists(zip_download_dir):
@@ -31,8 +36,21 @@ class DataIngestion:
             os.makedirs(zip_download_dir,exist_ok =True)
             logging.info(f"Downloading data from S3 bucket {self.data_ingestion_config.S3_DATA_BUCKET}")
             zipfilepath : Path = os.path.join(zip_download_dir,self.data_ingestion_config.S3_DATA_NAME)
-            self.s3.download_object(key = self.data_ingestion_config.S3_DATA_NAME,bucket_name=DATA_INGESTION_S3_BUCKET_NAME,filename=zipfilepath)
-            logging.info(f"Dowloading data from s3 bucket is completed" in {zipfilepath})   
+            download_stats = self.s3.download_object_chunked(
+                key=self.data_ingestion_config.S3_DATA_NAME,
+                bucket_name=self.data_ingestion_config.S3_DATA_BUCKET,
+                filename=zipfilepath,
+                max_concurrency=self.data_ingestion_config.download_max_concurrency,
+                chunk_size=self.data_ingestion_config.download_chunk_size,
+                cache_dir=self.data_ingestion_config.download_cache_dir,
+                tail_first=extractor is not None,
+                chunk_callback=extractor.chunk_done if extractor is not None else None,
+                complete_callback=extractor.complete if extractor is not None else None,
+            )
+            logging.info(
+                f"Dowloading data from s3 bucket is completed in {zipfilepath} "
+                f"({download_stats['bytes_per_sec'] / 1E6:.2f} MB/s, cache_hit={download_stats['cache_hit']})"
+            )
             return zipfilepath
         
         except Exception as e:
@@ -41,21 +59,189 @@ class DataIngestion:
     def extract_zip_file(self,zip_file_path: str) ->str:
         try:
             feature_store_path = self.data_ingestion_config.feature_store_file_path
-            with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-                zip_ref.extractall(feature_store_path)
+            extractor = StreamingZipExtractor(
+                feature_store_path, max_workers=self.data_ingestion_config.extract_max_workers
+            )
+            extractor.extract_all(zip_file_path)
 
             return feature_store_path
         
         except Exception as e:
             raise objException(e,sys)
         
+    def sync_objects(self, local_files: dict) -> tuple:
+        """
+        Syncs the per-object S3 layout (one object per image/label under S3_DATA_PREFIX) into the
+        feature store, downloading only objects whose size or ETag differ from the local manifest.
+        """
+        try:
+            prefix = self.data_ingestion_config.S3_DATA_PREFIX
+            bucket_name = self.data_ingestion_config.S3_DATA_BUCKET
+            objects = [
+                obj for obj in self.s3.list_objects(prefix=prefix, bucket_name=bucket_name)
+                if not obj["key"].endswith("/")
+            ]
+            keys = {obj["key"][len(prefix):].lstrip("/"): obj["key"] for obj in objects}
+            remote_files = {
+                obj["key"][len(prefix):].lstrip("/"): {"size": obj["size"], "hash": obj["etag"]} for obj in objects
+            }
+            changed, removed = diff_manifests(local_files, remote_files)
+            logging.info(f"Manifest diff: {len(changed)} changed, {len(removed)} removed of {len(remote_files)} objects")
+
+            def fetch(path: str) -> None:
+                target = self._feature_store_target(path)
+                self.s3.download_object(key=keys[path], bucket_name=bucket_name, filename=target + ".part")
+                os.replace(target + ".part", target)
+
+            with ThreadPoolExecutor(max_workers=self.data_ingestion_config.download_max_concurrency) as executor:
+                list(executor.map(fetch, changed))
+            self._remove_feature_store_files(removed)
+
+            source = {"layout": "objects", "bucket": bucket_name, "prefix": prefix}
+            return source, remote_files
+
+        except Exception as e:
+            raise objException(e, sys)
+
+    def sync_zip(self, manifest: dict, local_files: dict) -> tuple:
+        """
+        Syncs the single-archive layout into the feature store. The archive's central directory is
+        read with ranged GETs and diffed against the local manifest; only changed members are fetched
+        (by byte range) and written. On the first sync, or when most of the archive changed, the whole
+        zip is downloaded and extracted in a streaming fashion instead.
+        """
+        try:
+            key = self.data_ingestion_config.S3_DATA_NAME
+            bucket_name = self.data_ingestion_config.S3_DATA_BUCKET
+            metadata = self.s3.get_object_metadata(key=key, bucket_name=bucket_name)
+            source = {"layout": "zip", "bucket": bucket_name, "key": key, "etag": metadata["etag"]}
+            if manifest["source"] == source and len(local_files) == len(manifest["files"]):
+                logging.info(f"Feature store is up to date with {key} (ETag {metadata['etag']}), nothing to sync")
+                return None, source, manifest["files"]
+
+            entries = self.read_remote_zip_entries(key, bucket_name, metadata["size"])
+            zip_file_path = None
+            if entries is None:  # ZIP64 or unreadable tail: no member table without the whole archive
+                changed = None
+            else:
+                entries = {entry.filename: entry for entry in entries if not entry.filename.endswith("/")}
+                remote_files = {
+                    name: {"size": entry.file_size, "hash": f"{entry.crc:08x}"} for name, entry in entries.items()
+                }
+                changed, removed = diff_manifests(local_files, remote_files)
+                changed_bytes = sum(entries[name].compress_size for name in changed)
+                total_bytes = sum(entry.compress_size for entry in entries.values()) or 1
+                logging.info(
+                    f"Manifest diff: {len(changed)} changed ({changed_bytes / 1E6:.1f} MB), "
+                    f"{len(removed)} removed of {len(remote_files)} members"
+                )
+
+            if changed is None or not local_files or \
+                    changed_bytes / total_bytes > self.data_ingestion_config.incremental_max_fraction:
+                with StreamingZipExtractor(
+                    self.data_ingestion_config.feature_store_file_path,
+                    max_workers=self.data_ingestion_config.extract_max_workers,
+                ) as extractor:  # shut down even when the download fails before it completes
+                    zip_file_path = self.download_data(extractor=extractor)
+                if changed is None:
+                    with zipfile.ZipFile(zip_file_path) as zip_ref:
+                        remote_files = {
+                            info.filename: {"size": info.file_size, "hash": f"{info.CRC:08x}"}
+                            for info in zip_ref.infolist() if not info.is_dir()
+                        }
+                    removed = sorted(path for path in local_files if path not in remote_files)
+            else:
+                self.fetch_zip_members(key, bucket_name, [entries[name] for name in changed])
+            self._remove_feature_store_files(removed)
+
+            return zip_file_path, source, remote_files
+
+        except Exception as e:
+            raise objException(e, sys)
+
+    def read_remote_zip_entries(self, key: str, bucket_name: str, size: int) -> list:
+        """Reads the central directory of the remote archive with at most two ranged GETs."""
+        try:
+            tail_start = max(0, size - EOCD_SEARCH_SIZE)
+            tail = self.s3.download_object_range(key, bucket_name, tail_start, size - 1)
+            location = locate_central_directory(tail, tail_start)
+            if location is None:
+                return None
+            cd_offset, cd_size = location
+            if cd_offset >= tail_start:
+                central_directory = tail[cd_offset - tail_start:cd_offset - tail_start + cd_size]
+            else:
+                central_directory = self.s3.download_object_range(key, bucket_name, cd_offset, cd_offset + cd_size - 1)
+            return parse_central_directory(central_directory, cd_offset)
+
+        except Exception as e:
+            raise objException(e, sys)
+
+    def fetch_zip_members(self, key: str, bucket_name: str, entries: list) -> None:
+        """Fetches the byte ranges of entries (adjacent members in one GET) and writes them to the feature store."""
+        try:
+            groups = []
+            for entry in sorted(entries, key=lambda x: x.header_offset):
+                if groups and groups[-1][-1].end_offset == entry.header_offset and \
+                        entry.end_offset - groups[-1][0].header_offset <= self.data_ingestion_config.download_chunk_size:
+                    groups[-1].append(entry)
+                else:
+                    groups.append([entry])
+
+            def fetch(group: list) -> None:
+                start = group[0].header_offset
+                raw = self.s3.download_object_range(key, bucket_name, start, group[-1].end_offset - 1)
+                for entry in group:
+                    data = read_member(raw[entry.header_offset - start:], entry)
+                    target = self._feature_store_target(entry.filename)
+                    with open(target + ".part", "wb") as f:
+                        f.write(data)
+                    os.replace(target + ".part", target)
+
+            with ThreadPoolExecutor(max_workers=self.data_ingestion_config.download_max_concurrency) as executor:
+                list(executor.map(fetch, groups))
+            logging.info(f"Fetched {len(entries)} changed members in {len(groups)} ranged GETs")
+
+        except Exception as e:
+            raise objException(e, sys)
+
+    def _feature_store_target(self, path: str) -> str:
+        feature_store_path = os.path.abspath(self.data_ingestion_config.feature_store_file_path)
+        target = os.path.abspath(os.path.join(feature_store_path, path))
+        if os.path.commonpath([feature_store_path, target]) != feature_store_path:
+            raise ValueError(f"Refusing to write {path} outside of the feature store")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        return target
+
+    def _remove_feature_store_files(self, paths: list) -> None:
+        for path in paths:
+            target = os.path.join(self.data_ingestion_config.feature_store_file_path, path)
+            if os.path.isfile(target):
+                os.remove(target)
+        if paths:
+            logging.info(f"Removed {len(paths)} files that are no longer in the remote dataset")
+
     def initiate_data_ingestion(self)->DataIngestionArtifact:
         logging.info("started  the data ingestion")
         try:
-            zip_file_path =self.download_data()
-            feature_store_path = self.extract_zip_file(zip_file_path=zip_file_path)
+            # the feature store persists across runs: diff the remote dataset against the local
+            # manifest and only fetch what changed; every later stage reads the dataset from there
+            feature_store_path = self.data_ingestion_config.feature_store_file_path
+            manifest_file_path = self.data_ingestion_config.manifest_file_path
+            os.makedirs(feature_store_path, exist_ok=True)
+            manifest = load_manifest(manifest_file_path)
+            local_files = verify_local_files(feature_store_path, manifest["files"])
+
+            if self.data_ingestion_config.S3_DATA_LAYOUT == "objects":
+                zip_file_path = None
+                source, remote_files = self.sync_objects(local_files)
+            else:
+                zip_file_path, source, remote_files = self.sync_zip(manifest, local_files)
+            save_manifest(manifest_file_path, source, remote_files)
+
             data_ingestion_artifacts = DataIngestionArtifact(
-                data_zip_file_path = zip_file_path,feature_store_path =feature_store_path
+                data_zip_file_path = zip_file_path,feature_store_path =feature_store_path,
+                manifest_file_path = manifest_file_path,
             )
             logging.info("data ingestion is completed")
             return data_ingestion_artifacts
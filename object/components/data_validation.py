@@ -1,11 +1,16 @@
 import os,sys
-import shutil
+import json
+import yaml
+from pandas import DataFrame
 from object.exception import objException
 from object.logger import logger,logging
 from  object.constant import *
 from object.entity.artifacts_entity import *
 from object.entity.config_entity import *
+from object.utils.dataset_validation import validate_split
 
+REPORT_COLUMNS = ["split", "image", "label", "format", "width", "height", "image_error",
+                  "label_status", "boxes", "label_error", "corrupt"]
 
 
 
@@ -21,27 +26,18 @@ class DataValidation:
             self.data_validation_config = data_validation_config
 
         except Exception as e:
-            raise objException(e, sys) 
+            raise objException(e, sys)
+
 
-    
 
     def validate_all_files_exist(self)-> bool:
         try:
-            validation_status = None
-
             all_files = os.listdir(self.data_ingestion_artifact.feature_store_path)
+            validation_status = all(file in self.data_validation_config.required_file_list for file in all_files)
 
-            for file in all_files:
-                if file not in self.data_validation_config.required_file_list:
-                    validation_status = False
-                    os.makedirs(self.data_validation_config.data_validation_dir, exist_ok=True)
-                    with open(self.data_validation_config.valid_status_file_dir, 'w') as f:
-                        f.write(f"Validation status: {validation_status}")
-                else:
-                    validation_status = True
-                    os.makedirs(self.data_validation_config.data_validation_dir, exist_ok=True)
-                    with open(self.data_validation_config.valid_status_file_dir, 'w') as f:
-                        f.write(f"Validation status: {validation_status}")
+            os.makedirs(self.data_validation_config.data_validation_dir, exist_ok=True)
+            with open(self.data_validation_config.valid_status_file_dir, 'w') as f:
+                f.write(f"Validation status: {validation_status}")
 
             return validation_status
 
@@ -49,25 +45,110 @@ class DataValidation:
         except Exception as e:
             raise objException(e, sys)
 
+    def read_num_classes(self) -> int:
+        """nc from the dataset's data.yaml, or None when the dataset does not ship one."""
+        try:
+            dataset_yaml = os.path.join(self.data_ingestion_artifact.feature_store_path, self.data_validation_config.dataset_yaml)
+            if not os.path.isfile(dataset_yaml):
+                return None
+            with open(dataset_yaml) as f:
+                nc = (yaml.safe_load(f) or {}).get("nc")
+            return int(nc) if nc is not None else None
+
+        except Exception as e:
+            raise objException(e, sys)
+
+    def validate_samples(self) -> dict:
+        """
+        Checks every image (header decode, format, EXIF-corrected size) and label (columns, normalized
+        coordinates, class ids) of the feature store, writes the per-sample report, the list of corrupt
+        samples to exclude from training and a pass/fail summary, and returns the summary.
+        """
+        try:
+            feature_store_path = self.data_ingestion_artifact.feature_store_path
+            nc = self.read_num_classes()
+            rows = []
+            for split in self.data_validation_config.splits:
+                split_dir = os.path.join(feature_store_path, split)
+                if os.path.isdir(split_dir):
+                    rows += validate_split(split_dir, nc=nc, workers=self.data_validation_config.max_workers)
+            report = DataFrame(rows, columns=REPORT_COLUMNS)
+
+            os.makedirs(self.data_validation_config.data_validation_dir, exist_ok=True)
+            report_file_path = self.data_validation_config.report_file_path
+            try:
+                report.to_parquet(report_file_path, index=False)
+            except ImportError:  # no pyarrow/fastparquet installed
+                report_file_path = os.path.splitext(report_file_path)[0] + ".csv"
+                report.to_csv(report_file_path, index=False)
+
+            corrupt = report[report["corrupt"]]
+            with open(self.data_validation_config.excluded_file_path, "w") as f:
+                f.writelines(image + "\n" for image in corrupt["image"])
+
+            samples = len(report)
+            corrupt_fraction = len(corrupt) / samples if samples else 1.0
+            errors = corrupt["image_error"].where(corrupt["image_error"] != "", corrupt["label_error"])
+            summary = {
+                "passed": bool(samples) and corrupt_fraction <= self.data_validation_config.max_corrupt_fraction,
+                "samples": samples,
+                "corrupt": len(corrupt),
+                "corrupt_fraction": corrupt_fraction,
+                "max_corrupt_fraction": self.data_validation_config.max_corrupt_fraction,
+                "nc": nc,
+                "splits": {
+                    split: {
+                        "samples": len(group),
+                        "corrupt": int(group["corrupt"].sum()),
+                        "missing_labels": int((group["label_status"] == "missing").sum()),
+                        "empty_labels": int((group["label_status"] == "empty").sum()),
+                        "boxes": int(group["boxes"].sum()),
+                    }
+                    for split, group in report.groupby("split")
+                },
+                "errors": {str(k): int(v) for k, v in errors.value_counts().items()},
+                "report_file_path": report_file_path,
+            }
+            with open(self.data_validation_config.summary_file_path, "w") as f:
+                json.dump(summary, f, indent=1)
+
+            logging.info(
+                f"Sample validation {'passed' if summary['passed'] else 'failed'}: {len(corrupt)} of {samples} "
+                f"samples corrupt ({corrupt_fraction:.1%}), report at {report_file_path}"
+            )
+            for image, error in zip(corrupt["image"], errors):
+                logging.info(f"Excluding corrupt sample {image}: {error}")
+            return summary
+
+        except Exception as e:
+            raise objException(e, sys)
+
+
 
-    
     def initiate_data_validation(self) -> DataValidationArtifact:
-        try: 
-            
+        try:
+
             logging.info("Entered initiate_data_validation method of DataValidation class")
-            status = self.validate_all_files_exist()
+            files_status = self.validate_all_files_exist()
+            summary = self.validate_samples()
+            status = summary["passed"]
+            with open(self.data_validation_config.valid_status_file_dir, 'w') as f:
+                f.write(f"Validation status: {status}\n")
+                f.write(f"Required files status: {files_status}\n")
+                f.write(f"Corrupt samples: {summary['corrupt']} of {summary['samples']}\n")
+
             data_validation_artifact = DataValidationArtifact(
                 validation_status=status,
-                data_ingestion_artifact=self.data_ingestion_artifact  # Add this line
+                data_ingestion_artifact=self.data_ingestion_artifact,  # Add this line
+                report_file_path=summary["report_file_path"],
+                summary_file_path=self.data_validation_config.summary_file_path,
+                excluded_file_path=self.data_validation_config.excluded_file_path,
             )
 
             logging.info("Exited initiate_data_validation method of DataValidation class")
             logging.info(f"Data validation artifact: {data_validation_artifact}")
 
-            if status:
-                shutil.copy(self.data_ingestion_artifact.data_zip_file_path, os.getcwd())
-
             return data_validation_artifact
 
         except Exception as e:
-            raise objException(e, sys)  
\ No newline at end of file
+            raise objException(e, sys)
@@ -1,9 +1,11 @@
+import os
 import sys
 from object.configuration.s3_operations import S3Operation
 from object.entity.artifacts_entity import *
 from object.entity.config_entity import ModelPusherConfig
 from object.exception import objException
 from object.logger import logging
+from object.utils.yolov7_runner import yolov7_workdir
 
 class ModelPusher:
     def __init__(self,model_pusher_config: ModelPusherConfig,model_trainer_artifact: ModelTrainerArtifact):
@@ -13,21 +15,52 @@ class ModelPusher:
             self.s3 = S3Operation()
         except Exception as e:
             raise objException(e,sys)
+
+    def make_fp16_variant(self, model_file_path: str) -> str:
+        """Writes an optimizer-stripped FP16 copy of the checkpoint next to it with yolov7's strip_optimizer."""
+        try:
+            model_file_path = os.path.abspath(model_file_path)
+            fp16_file_path = os.path.splitext(model_file_path)[0] + "_fp16.pt"
+            # unpickling the checkpoint needs yolov7's models package importable
+            with yolov7_workdir("yolov7"):
+                from utils.general import strip_optimizer
+                strip_optimizer(model_file_path, fp16_file_path)
+            return fp16_file_path
+        except Exception as e:
+            raise objException(e,sys)
+
     def initiate_model_pusher(self)->ModelPusherArtifact:
         try:
             logging.info("Entered initiate_model_pusher method of ModelPusher class")
-            upload_model = self.s3.upload_file(
+            uploaded = self.s3.upload_file_if_changed(
                 from_filename=self.model_trainer_artifact.trained_model_file_path,
+                to_filename=self.model_pusher_config.s3_key,
                 bucket_name=self.model_pusher_config.model_bucket_name,
-                to_filename=self.model_pusher_config.s3_key,remove= False
+                chunk_size=self.model_pusher_config.multipart_chunk_size,
+                max_concurrency=self.model_pusher_config.max_concurrency,
             )
-            logging.info("Uploaded best model to s3 bucket")
+            logging.info("Uploaded best model to s3 bucket" if uploaded else "Best model in s3 bucket is up to date")
+
+            fp16_s3_key_path = None
+            if self.model_pusher_config.push_fp16:
+                fp16_file_path = self.make_fp16_variant(self.model_trainer_artifact.trained_model_file_path)
+                self.s3.upload_file_if_changed(
+                    from_filename=fp16_file_path,
+                    to_filename=self.model_pusher_config.fp16_s3_key,
+                    bucket_name=self.model_pusher_config.model_bucket_name,
+                    chunk_size=self.model_pusher_config.multipart_chunk_size,
+                    max_concurrency=self.model_pusher_config.max_concurrency,
+                )
+                fp16_s3_key_path = self.model_pusher_config.fp16_s3_key
+
             model_pusher_artifact = ModelPusherArtifact(
                 model_bucket_name=self.model_pusher_config.model_bucket_name,
                 s3_key_path = self.model_pusher_config.s3_key,
+                uploaded=uploaded,
+                fp16_s3_key_path=fp16_s3_key_path,
             )
-            
+
             logging.info(">>>>>>>>>>>>Exited model_pusher  class<<<<<<<<<<<<<<<<<<")
             return model_pusher_artifact
         except Exception as e:
-            raise objException(e,sys)
\ No newline at end of file
+            raise objException(e,sys)
@@ -1,11 +1,13 @@
 import os, sys
 import shutil
-import urllib.request  # Added missing import
 from object.exception import objException
 from object.logger import logger, logging
 from object.constant import *
 from object.entity.artifacts_entity import *
 from object.entity.config_entity import *
+from object.utils.label_index import build_label_index
+from object.utils.weights_store import WeightsStore
+from object.utils.yolov7_runner import YOLOv7TrainRunner
 
 
 class ModelTrainer:
@@ -16,57 +18,25 @@ class ModelTrainer:
         except Exception as e:
             raise objException(e, sys)
 
-    def initate_model_trainer(self) -> ModelTrainerArtifact:
-        logging.info(f"{'>>'*20} Model Training {'<<'*20}")
+    @staticmethod
+    def log_epoch(metrics: dict) -> None:
+        logging.info(
+            f"Epoch {metrics['epoch'] + 1}/{metrics['epochs']} finished in {metrics['epoch_time']:.1f}s: "
+            f"mAP@.5={metrics['metrics/mAP_0.5']:.4f} mAP@.5:.95={metrics['metrics/mAP_0.5:0.95']:.4f} "
+            f"box_loss={metrics['train/box_loss']:.4f} fitness={metrics['fitness']:.4f}"
+        )
+
+    def write_image_lists(self, feature_store_path: str, excluded_file_path: str = None) -> None:
+        """Writes train.txt/val.txt with the feature store images for yolov7, leaving out samples data validation excluded."""
         try:
-            logging.info("unzipping the data")
-            import zipfile
-            
-            # Get the correct path to the data from data ingestion artifact
-            feature_store_path = self.data_validation_artifact.data_ingestion_artifact.feature_store_path
-            zip_file_path = self.data_validation_artifact.data_ingestion_artifact.data_zip_file_path
-            
-            logging.info(f"Using feature store path: {feature_store_path}")
-            logging.info(f"Using zip file path: {zip_file_path}")
-            
-            extract_dir = os.getcwd()
-            logging.info(f"Extracting to: {extract_dir}")
-            # Check if we need to extract from zip or copy from feature store
-            if os.path.isfile(zip_file_path) and zip_file_path.endswith('.zip'):
-                logging.info(f"Extracting zip file: {zip_file_path} to {extract_dir}")
-                
-                # Extract the zip file
-                with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
-                logging.info("Zip file extracted successfully")
-            else:
-                # If not a zip file, copy the data from feature store to current directory
-                logging.info(f"Copying data from feature store: {feature_store_path} to current directory")
-                
-                # Check if feature store path exists and is a directory
-                if os.path.isdir(feature_store_path):
-                    # Copy all contents from feature store to current directory
-                    for item in os.listdir(feature_store_path):
-                        source = os.path.join(feature_store_path, item)
-                        destination = os.path.join(extract_dir, item)
-                        
-                        if os.path.isdir(source):
-                            if os.path.exists(destination):
-                                shutil.rmtree(destination)
-                            shutil.copytree(source, destination)
-                            logging.info(f"Copied directory: {item}")
-                        else:
-                            shutil.copy2(source, destination)
-                            logging.info(f"Copied file: {item}")
-                else:
-                    logging.error(f"Feature store path is not a directory: {feature_store_path}")
-                    raise Exception(f"Feature store path is not a directory: {feature_store_path}")
-            
-            # Check if the expected directories exist
-            train_img_path = os.path.join(os.getcwd(), "train", "images")
-            val_img_path = os.path.join(os.getcwd(), "valid", "images")
-            train_label_path = os.path.join(os.getcwd(), "train", "labels")
-            
+            excluded = set()
+            if excluded_file_path and os.path.isfile(excluded_file_path):
+                with open(excluded_file_path) as f:
+                    excluded = {line.strip() for line in f if line.strip()}
+                logging.info(f"Leaving out {len(excluded)} corrupt samples listed in {excluded_file_path}")
+
+            train_img_path = os.path.abspath(os.path.join(feature_store_path, "train", "images"))
+            val_img_path = os.path.abspath(os.path.join(feature_store_path, "valid", "images"))
             logging.info(f"Checking if train path exists: {train_img_path}")
             logging.info(f"Checking if validation path exists: {val_img_path}")
             
@@ -79,33 +49,44 @@ class ModelTrainer:
 
             # Training images
             with open('train.txt', "w+") as f:
-                img_list = os.listdir(train_img_path)
+                img_list = [img for img in os.listdir(train_img_path) if f"train/images/{img}" not in excluded]
                 for img in img_list:
                     f.write(os.path.join(train_img_path, img) + '\n')
                 logging.info("Done writing Training images paths")
 
             # Validation Image
             with open('val.txt', "w+") as f:
-                img_list = os.listdir(val_img_path)
+                img_list = [img for img in os.listdir(val_img_path) if f"valid/images/{img}" not in excluded]
                 for img in img_list:
                     f.write(os.path.join(val_img_path, img) + '\n')
                 logging.info("Done writing Validation Image paths")
 
-            # Determine the number of classes by analyzing the label files
-            max_class_id = 0
+        except Exception as e:
+            raise objException(e, sys)
+
+    def index_labels(self, feature_store_path: str) -> int:
+        """Builds the train/valid label indexes and returns the number of classes."""
+        try:
+            train_label_path = os.path.abspath(os.path.join(feature_store_path, "train", "labels"))
+            val_label_path = os.path.abspath(os.path.join(feature_store_path, "valid", "labels"))
+            # Determine the number of classes from the shared label index (persisted next to the
+            # labels directory and reused by data validation and the yolov7 dataset cache)
+            num_classes = 1
             if os.path.exists(train_label_path):
-                for label_file in os.listdir(train_label_path):
-                    if label_file.endswith('.txt'):
-                        with open(os.path.join(train_label_path, label_file), 'r') as lf:
-                            for line in lf:
-                                if line.strip():
-                                    class_id = int(line.strip().split()[0])
-                                    max_class_id = max(max_class_id, class_id)
-            
-            # Number of classes is max_class_id + 1 (since class IDs start from 0)
-            num_classes = max_class_id + 1
+                label_index = build_label_index(train_label_path)
+                num_classes = label_index.nc
+                logging.info(f"Label box statistics: {label_index.box_stats()}")
+            if os.path.exists(val_label_path):
+                build_label_index(val_label_path)
             logging.info(f"Detected {num_classes} classes from label files")
+            return num_classes
 
+        except Exception as e:
+            raise objException(e, sys)
+
+    def write_yolov7_configs(self, num_classes: int) -> None:
+        """Writes yolov7/data/custom.yaml and cfg/training/custom_yolov7.yaml for num_classes classes."""
+        try:
             # Create custom.yaml file for YOLOv7
             os.makedirs(os.path.join("yolov7", "data"), exist_ok=True)
             custom_yaml_path = os.path.join("yolov7", "data", "custom.yaml")
@@ -188,22 +169,37 @@ class ModelTrainer:
             """)
                 logging.info(f"Created basic custom_yolov7.yaml with {num_classes} classes")
 
+        except Exception as e:
+            raise objException(e, sys)
+
+    def prepare_weights(self) -> str:
+        """Materializes the pretrained weights into yolov7/ and returns their path."""
+        try:
             url = self.model_trainer_config.model_weights_url
             file_name = os.path.basename(url)
             
             # Create yolov7 directory if it doesn't exist
             os.makedirs("yolov7", exist_ok=True)
             
-            # Download the weights
-            urllib.request.urlretrieve(url, os.path.join("yolov7", file_name))
-            logging.info(f"Downloaded weights from {url}")
+            # Get the weights from the shared weights store (downloaded only on a cache miss);
+            # exporting it lets yolov7's attempt_download resolve weights from the same store
+            weights_store = WeightsStore(
+                self.model_trainer_config.weights_store_dir, mirror=self.model_trainer_config.weights_mirror
+            )
+            weights_store.export_env()
+            weights_path = os.path.join("yolov7", file_name)
+            weights_store.fetch(url, weights_path, sha256=self.model_trainer_config.model_weights_sha256)
+            logging.info(f"Weights from {url} are ready at {weights_path}")
+            return weights_path
 
-            # Training - use subprocess for Windows compatibility
-            import subprocess
-            
-            # Change directory to yolov7 and run the training command
-            train_cmd = [
-                "python", "train.py",
+        except Exception as e:
+            raise objException(e, sys)
+
+    def train_model(self) -> ModelTrainerArtifact:
+        """Trains on the prepared image lists, dataset configs and weights and returns the artifact."""
+        try:
+            # Training - run yolov7's train() through the runner (in-process or in a managed worker)
+            train_args = [
                 "--batch", str(max(2, self.model_trainer_config.model_batch_size // 4)),  # Adjusted for CPU
                 "--cfg", "cfg/training/custom_yolov7.yaml",
                 "--epochs", str(min(50, self.model_trainer_config.model_epochs)),         # Reduced for CPU
@@ -211,35 +207,17 @@ class ModelTrainer:
                 "--weights", "yolov7.pt",
                 "--device", "cpu"  # Ensures CPU usage
             ]
-            
-            logging.info(f"Running training command: {' '.join(train_cmd)}")
-            subprocess.run(train_cmd, cwd="yolov7", check=True)
+            runner = YOLOv7TrainRunner(yolov7_dir="yolov7", mode=self.model_trainer_config.model_run_mode)
+            train_result = runner.run(train_args, epoch_callback=self.log_epoch)
 
-            # Copy the best model
+            # Copy the exact checkpoint written by this run
             os.makedirs(self.model_trainer_config.model_trainer_dir, exist_ok=True)
-            
-            # Get the latest experiment directory (could be exp, exp1, exp2, etc.)
-            runs_dir = os.path.join("yolov7", "runs", "train")
-            if os.path.exists(runs_dir):
-                exp_dirs = [d for d in os.listdir(runs_dir) if d.startswith("exp")]
-                if exp_dirs:
-                    # Sort to get the latest experiment directory
-                    latest_exp = sorted(exp_dirs)[-1]
-                    best_model_path = os.path.join(runs_dir, latest_exp, "weights", "best.pt")
-                    
-                    logging.info(f"Looking for best model at: {best_model_path}")
-                    
-                    if os.path.exists(best_model_path):
-                        # Copy the model to yolov7 directory and model_trainer_dir
-                        shutil.copy(best_model_path, "yolov7/")
-                        shutil.copy(best_model_path, self.model_trainer_config.model_trainer_dir)
-                        logging.info(f"Copied best model to {self.model_trainer_config.model_trainer_dir}")
-                    else:
-                        logging.error(f"Best model not found at {best_model_path}")
-                else:
-                    logging.error("No experiment directories found in runs/train")
-            else:
-                logging.error(f"Runs directory not found at {runs_dir}")
+            best_model_path = train_result["checkpoint"]
+            if not os.path.exists(best_model_path):
+                raise Exception(f"Training finished without writing a checkpoint at {best_model_path}")
+            shutil.copy(best_model_path, os.path.join("yolov7", "best.pt"))
+            shutil.copy(best_model_path, os.path.join(self.model_trainer_config.model_trainer_dir, "best.pt"))
+            logging.info(f"Copied {best_model_path} to {self.model_trainer_config.model_trainer_dir}")
 
             # Clean up - use shutil and os for Windows compatibility
             # IMPORTANT: Only clean up AFTER copying the model files
@@ -256,13 +234,32 @@ class ModelTrainer:
 
             model_trainer_artifact = ModelTrainerArtifact(
                 trained_model_file_path="yolov7/best.pt",
+                epoch_metrics=train_result["epochs"],
             )
-
-            logging.info("Exited initiate_model_trainer method of ModelTrainer class")
             logging.info(f"Model trainer artifact: {model_trainer_artifact}")
 
             return model_trainer_artifact
 
         except Exception as e:
             logging.error(f"Error in model training: {str(e)}")
-            raise objException(e, sys)
\ No newline at end of file
+            raise objException(e, sys)
+
+    def initate_model_trainer(self) -> ModelTrainerArtifact:
+        logging.info(f"{'>>'*20} Model Training {'<<'*20}")
+        try:
+            # The dataset is extracted once into the feature store during ingestion; read it in place
+            feature_store_path = self.data_validation_artifact.data_ingestion_artifact.feature_store_path
+            logging.info(f"Using feature store path: {feature_store_path}")
+
+            self.write_image_lists(feature_store_path, self.data_validation_artifact.excluded_file_path)
+            num_classes = self.index_labels(feature_store_path)
+            self.write_yolov7_configs(num_classes)
+            self.prepare_weights()
+            model_trainer_artifact = self.train_model()
+
+            logging.info("Exited initiate_model_trainer method of ModelTrainer class")
+            return model_trainer_artifact
+
+        except Exception as e:
+            logging.error(f"Error in model training: {str(e)}")
+            raise objException(e, sys)
@@ -1,28 +1,338 @@
 import os
 import sys
+import re
+import asyncio
+import json
+import math
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import StringIO
-from typing import List, Union
+from typing import Callable, Dict, List, Union
 from object.constant import *
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 import pickle
 from object.exception import objException
 from botocore.exceptions import ClientError
 from mypy_boto3_s3.service_resource import Bucket
-from pandas import DataFrame, read_csv
+from pandas import DataFrame, concat, read_csv
 from object.logger import logging
+from object.utils.main_utils import file_sha256
 
 
+_s3_lock = threading.Lock()
+_s3_session = None
+_s3_client = None
+_s3_local = threading.local()  # resources are not thread-safe: one per thread
+
+
+def _s3_endpoint_url() -> str:
+    # point at a local S3 stand-in (moto server, MinIO, ...) for tests
+    return os.environ.get("S3_ENDPOINT_URL") or S3_ENDPOINT_URL
+
+
+def _s3_config() -> Config:
+    return Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": S3_RETRY_MODE},
+    )
+
+
+def get_s3_client():
+    """The process-wide S3 client, created on first use. Clients are thread-safe and pool their connections."""
+    global _s3_session, _s3_client
+    if _s3_client is None:
+        with _s3_lock:
+            if _s3_client is None:
+                _s3_session = boto3.session.Session()
+                _s3_client = _s3_session.client("s3", endpoint_url=_s3_endpoint_url(), config=_s3_config())
+    return _s3_client
+
+
+def get_s3_resource():
+    """An S3 resource from the shared session for the calling thread."""
+    resource = getattr(_s3_local, "resource", None)
+    if resource is None:
+        get_s3_client()
+        with _s3_lock:  # sessions are not thread-safe while creating clients/resources
+            resource = _s3_session.resource("s3", endpoint_url=_s3_endpoint_url(), config=_s3_config())
+        _s3_local.resource = resource
+    return resource
+
 
 class S3Operation:
-    def __init__(self):
-        self.s3_client = boto3.client("s3")
-        self.s3_resource = boto3.resource("s3")
+    # every instance shares one lazily created, pooled client, so constructing S3Operation is cheap
+    @property
+    def s3_client(self):
+        return get_s3_client()
+
+    @property
+    def s3_resource(self):
+        return get_s3_resource()
 
     
     def download_object(self,key, bucket_name, filename):
-        bucket = self.s3_resource.Bucket(bucket_name)
-        bucket.download_file(Key = key, Filename = filename)
+        # the client (unlike resources) is thread-safe, so this can be called from worker threads
+        self.s3_client.download_file(Bucket = bucket_name, Key = key, Filename = filename)
+
+
+    def get_object_metadata(self, key: str, bucket_name: str) -> dict:
+
+        """
+        Method Name :   get_object_metadata
+
+        Description :   This method fetches the size and ETag of the key object without downloading it
+
+        Output      :   dict with size (bytes) and etag (without quotes)
+        """
+        logging.info("Entered the get_object_metadata method of S3Operations class")
+        try:
+            response = self.s3_client.head_object(Bucket=bucket_name, Key=key)
+            metadata = {
+                "size": int(response["ContentLength"]),
+                "etag": response["ETag"].strip('"'),
+            }
+            logging.info("Exited the get_object_metadata method of S3Operations class")
+            return metadata
+
+        except Exception as e:
+            raise objException(e, sys) from e
+
+    def list_objects(self, prefix: str, bucket_name: str) -> List[dict]:
+
+        """
+        Method Name :   list_objects
+
+        Description :   This method lists every object under prefix in bucket_name, following pagination
+
+        Output      :   list of dicts with key, size and etag (without quotes)
+        """
+        logging.info("Entered the list_objects method of S3Operations class")
+        try:
+            objects = []
+            paginator = self.s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+                for obj in page.get("Contents", []):
+                    objects.append(
+                        {"key": obj["Key"], "size": int(obj["Size"]), "etag": obj["ETag"].strip('"')}
+                    )
+            logging.info("Exited the list_objects method of S3Operations class")
+            return objects
+
+        except Exception as e:
+            raise objException(e, sys) from e
+
+    def download_object_range(self, key: str, bucket_name: str, start: int, end: int) -> bytes:
+
+        """
+        Method Name :   download_object_range
+
+        Description :   This method downloads the inclusive byte range start-end of the key object
+
+        Output      :   raw bytes of the requested range
+        """
+        response = self.s3_client.get_object(
+            Bucket=bucket_name, Key=key, Range=f"bytes={start}-{end}"
+        )
+        return response["Body"].read()
+
+    def download_object_chunked(
+        self,
+        key: str,
+        bucket_name: str,
+        filename: str,
+        max_concurrency: int = 8,
+        chunk_size: int = 8 * 1024 * 1024,
+        cache_dir: str = None,
+        tail_first: bool = False,
+        chunk_callback: Callable[[str, int, int, int], None] = None,
+        complete_callback: Callable[[str], None] = None,
+    ) -> dict:
+
+        """
+        Method Name :   download_object_chunked
+
+        Description :   This method downloads the key object with max_concurrency parallel ranged GETs of
+                        chunk_size bytes. Progress is tracked in a <filename>.part.json sidecar so an
+                        interrupted download resumes from the chunks already on disk. When cache_dir is
+                        given, the finished object is kept under cache_dir/<etag>/ and later calls for the
+                        same ETag are served from there without touching S3.
+                        chunk_callback(path, start, end, size) is called whenever bytes [start, end)
+                        are on disk and complete_callback(path) once the whole object is, which lets a
+                        consumer (e.g. StreamingZipExtractor) work while the download is in flight.
+                        tail_first fetches the chunks back to front, so formats with a trailing index
+                        (zip central directory) become readable first.
+
+        Output      :   dict with etag, size, downloaded bytes, elapsed seconds, bytes_per_sec and cache_hit
+        """
+        logging.info("Entered the download_object_chunked method of S3Operations class")
+        try:
+            start_time = time.time()
+            metadata = self.get_object_metadata(key, bucket_name)
+            size, etag = metadata["size"], metadata["etag"]
+            stats = {"etag": etag, "size": size, "downloaded": 0, "cache_hit": False}
+
+            cache_path = None
+            if cache_dir is not None:
+                cache_path = os.path.join(cache_dir, re.sub(r"[^0-9A-Za-z_-]", "_", etag), os.path.basename(key))
+                if os.path.isfile(cache_path) and os.path.getsize(cache_path) == size:
+                    self._link_or_copy(cache_path, filename)
+                    stats["cache_hit"] = True
+                    if complete_callback is not None:
+                        complete_callback(filename)
+                    logging.info(f"Cache hit for {key} (ETag {etag}), served from {cache_path}")
+
+            if not stats["cache_hit"]:
+                part_path = filename + ".part"
+                state_path = part_path + ".json"
+                done = set()
+                if os.path.isfile(part_path) and os.path.isfile(state_path):
+                    with open(state_path) as f:
+                        state = json.load(f)
+                    if state.get("etag") == etag and state.get("chunk_size") == chunk_size:
+                        done = set(state["done"])
+                        logging.info(f"Resuming {key}: {len(done)} chunks already on disk")
+                if not done:
+                    with open(part_path, "wb") as f:
+                        f.truncate(size)
+
+                n_chunks = max(1, math.ceil(size / chunk_size))
+                pending = [i for i in range(n_chunks) if i not in done]
+                if tail_first:
+                    pending.reverse()
+                lock = threading.Lock()
+                if chunk_callback is not None:
+                    for index in sorted(done):
+                        chunk_callback(part_path, index * chunk_size, min((index + 1) * chunk_size, size), size)
+
+                def fetch(index: int) -> None:
+                    start = index * chunk_size
+                    end = min(start + chunk_size, size) - 1
+                    data = self.download_object_range(key, bucket_name, start, end) if size else b""
+                    with open(part_path, "r+b") as f:
+                        f.seek(start)
+                        f.write(data)
+                    with lock:
+                        done.add(index)
+                        stats["downloaded"] += len(data)
+                        self._write_json_atomic(
+                            state_path, {"etag": etag, "chunk_size": chunk_size, "done": sorted(done)}
+                        )
+                    if chunk_callback is not None:
+                        chunk_callback(part_path, start, end + 1, size)
+
+                with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+                    for future in as_completed([executor.submit(fetch, i) for i in pending]):
+                        future.result()  # re-raise the first failed chunk
+
+                if complete_callback is not None:
+                    complete_callback(part_path)
+                os.remove(state_path)
+                if cache_path is not None:
+                    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                    os.replace(part_path, cache_path)
+                    self._link_or_copy(cache_path, filename)
+                else:
+                    os.replace(part_path, filename)
+
+            elapsed = max(time.time() - start_time, 1e-9)
+            stats["seconds"] = elapsed
+            stats["bytes_per_sec"] = stats["downloaded"] / elapsed
+            logging.info(
+                f"Downloaded {stats['downloaded']} of {size} bytes for {key} in {elapsed:.2f}s "
+                f"({stats['bytes_per_sec'] / 1E6:.2f} MB/s, cache_hit={stats['cache_hit']})"
+            )
+            logging.info("Exited the download_object_chunked method of S3Operations class")
+            return stats
+
+        except Exception as e:
+            raise objException(e, sys) from e
+
+    @staticmethod
+    def _link_or_copy(src: str, dst: str) -> None:
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
 
+    @staticmethod
+    def _write_json_atomic(path: str, data: dict) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+    async def _run_batch(self, fn: Callable, items: list, max_concurrency: int = None) -> list:
+        """Runs the blocking fn(item) for every item on a thread pool, at most max_concurrency at once."""
+        max_concurrency = max(1, min(max_concurrency or S3_MAX_POOL_CONNECTIONS, len(items) or 1))
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            return await asyncio.gather(*(loop.run_in_executor(executor, fn, item) for item in items))
+
+    async def get_objects_async(self, keys: List[str], bucket_name: str, max_concurrency: int = None) -> Dict[str, bytes]:
+
+        """
+        Method Name :   get_objects_async
+
+        Description :   This method downloads the keys objects from bucket_name bucket concurrently
+
+        Output      :   dict of key to object bytes
+        """
+        fetch = lambda key: self.s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+        return dict(zip(keys, await self._run_batch(fetch, list(keys), max_concurrency)))
+
+    async def put_objects_async(
+        self, objects: Dict[str, Union[bytes, str]], bucket_name: str, max_concurrency: int = None
+    ) -> None:
+
+        """
+        Method Name :   put_objects_async
+
+        Description :   This method uploads the objects (key to bytes, or key to local file path) to bucket_name
+                        bucket concurrently
+
+        Output      :   Objects are uploaded to the s3 bucket
+        """
+        def put(item: tuple) -> None:
+            key, body = item
+            if isinstance(body, (bytes, bytearray)):
+                self.s3_client.put_object(Bucket=bucket_name, Key=key, Body=body)
+            else:
+                self.s3_client.upload_file(body, bucket_name, key)
+
+        await self._run_batch(put, list(objects.items()), max_concurrency)
+
+    async def list_objects_async(self, prefixes: List[str], bucket_name: str) -> Dict[str, List[dict]]:
+
+        """
+        Method Name :   list_objects_async
+
+        Description :   This method lists the objects under every prefix in bucket_name bucket concurrently
+
+        Output      :   dict of prefix to the list_objects result for that prefix
+        """
+        listing = lambda prefix: self.list_objects(prefix=prefix, bucket_name=bucket_name)
+        return dict(zip(prefixes, await self._run_batch(listing, list(prefixes))))
+
+    def get_objects(self, keys: List[str], bucket_name: str, max_concurrency: int = None) -> Dict[str, bytes]:
+        """Blocking wrapper around get_objects_async."""
+        try:
+            return asyncio.run(self.get_objects_async(keys, bucket_name, max_concurrency))
+        except Exception as e:
+            raise objException(e, sys) from e
+
+    def put_objects(self, objects: Dict[str, Union[bytes, str]], bucket_name: str, max_concurrency: int = None) -> None:
+        """Blocking wrapper around put_objects_async."""
+        try:
+            asyncio.run(self.put_objects_async(objects, bucket_name, max_concurrency))
+        except Exception as e:
+            raise objException(e, sys) from e
 
     @staticmethod
     def read_object(
@@ -208,6 +518,58 @@ class S3Operation:
         except Exception as e:
             raise objException(e, sys) from e
 
+    def upload_file_if_changed(
+        self,
+        from_filename: str,
+        to_filename: str,
+        bucket_name: str,
+        chunk_size: int = 8 * 1024 * 1024,
+        max_concurrency: int = 8,
+    ) -> bool:
+
+        """
+        Method Name :   upload_file_if_changed
+
+        Description :   This method uploads the from_filename file to bucket_name bucket as a multipart upload with
+                        parts sent in parallel, unless the object already stored at to_filename has the same sha256
+                        (kept in the object metadata)
+
+        Output      :   True if the file was uploaded, False if the stored object was already identical
+        """
+        logging.info("Entered the upload_file_if_changed method of S3Operations class")
+        try:
+            sha256 = file_sha256(from_filename)
+            try:
+                stored_metadata = self.s3_client.head_object(Bucket=bucket_name, Key=to_filename).get("Metadata", {})
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                    raise
+                stored_metadata = {}
+            if stored_metadata.get("sha256") == sha256:
+                logging.info(f"{to_filename} in {bucket_name} bucket already has sha256 {sha256}, skipping upload")
+                return False
+
+            start = time.time()
+            size = os.path.getsize(from_filename)
+            self.s3_client.upload_file(
+                from_filename, bucket_name, to_filename,
+                ExtraArgs={"Metadata": {"sha256": sha256}},
+                Config=TransferConfig(
+                    multipart_threshold=chunk_size, multipart_chunksize=chunk_size,
+                    max_concurrency=max_concurrency, use_threads=True,
+                ),
+            )
+            seconds = time.time() - start
+            logging.info(
+                f"Uploaded {from_filename} ({size / 1E6:.1f} MB) to {to_filename} in {bucket_name} bucket "
+                f"in {seconds:.1f}s ({size / 1E6 / max(seconds, 1E-6):.2f} MB/s)"
+            )
+            logging.info("Exited the upload_file_if_changed method of S3Operations class")
+            return True
+
+        except Exception as e:
+            raise objException(e, sys) from e
+
     def upload_folder(self, folder_name: str, bucket_name: str) -> None:
 
         """
@@ -220,10 +582,9 @@ class S3Operation:
         logging.info("Entered the upload_folder method of S3Operations class")
         try:
             lst = os.listdir(folder_name)
-            for f in lst:
-                local_f = os.path.join(folder_name, f)
-                dest_f = f
-                self.upload_file(local_f, dest_f, bucket_name, remove=False)
+            objects = {f: os.path.join(folder_name, f) for f in lst if os.path.isfile(os.path.join(folder_name, f))}
+            self.put_objects(objects, bucket_name)
+            logging.info(f"Uploaded {len(objects)} files from {folder_name} to {bucket_name} bucket")
             logging.info("Exited the upload_folder method of S3Operations class")
 
         except Exception as e:
@@ -286,7 +647,14 @@ class S3Operation:
         logging.info("Entered the read_csv method of S3Operations class")
         try:
             csv_obj = self.get_file_object(filename, bucket_name)
-            df = self.get_df_from_object(csv_obj)
+            if isinstance(csv_obj, list):  # filename is a prefix of several csv files: fetch them concurrently
+                contents = self.get_objects([obj.key for obj in csv_obj], bucket_name)
+                df = concat(
+                    [read_csv(StringIO(content.decode()), na_values="na") for content in contents.values()],
+                    ignore_index=True,
+                )
+            else:
+                df = self.get_df_from_object(csv_obj)
             logging.info("Exited the read_csv method of S3Operations class")
             return df
 
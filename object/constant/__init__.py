@@ -1,4 +1,12 @@
 ARTIFACTS_DIR: str = "artifacts"
+PIPELINE_STAGE_CACHE_DIR_NAME: str = "stage_cache"  # persisted stage artifacts + fingerprints, shared by runs
+PIPELINE_MAX_WORKERS: int = 4  # pipeline steps that may run at the same time
+
+"""S3 CLIENT RELATED CONSTANTS"""
+S3_MAX_POOL_CONNECTIONS: int = 32  # connections of the shared client, >= the largest transfer concurrency
+S3_MAX_ATTEMPTS: int = 10
+S3_RETRY_MODE: str = "adaptive"  # client-side rate limiting on throttling errors
+S3_ENDPOINT_URL: str = None  # e.g. a local S3 stand-in for tests; the S3_ENDPOINT_URL env var overrides it
 
 """DATA INGESTION RELEATED CONSTANTS"""
 
@@ -6,18 +14,41 @@ DATA_INGESTION_DIR_NAME: str = "data_ingestion"
 DATA_INGESTION_FEATURE_STORE_DIR: str = "feature_store"
 DATA_INGESTION_S3_DATA_NAME: str = "RoboflowImages.zip"
 DATA_INGESTION_S3_BUCKET_NAME: str = "mlops-object-data"
+DATA_INGESTION_S3_DATA_LAYOUT: str = "zip"  # "zip": one archive at S3_DATA_NAME, "objects": one object per file
+DATA_INGESTION_S3_DATA_PREFIX: str = "RoboflowImages/"  # key prefix of the "objects" layout
+DATA_INGESTION_MANIFEST_FILE: str = "feature_store_manifest.json"
+DATA_INGESTION_INCREMENTAL_MAX_FRACTION: float = 0.5  # above this share of changed bytes, pull the whole zip
+DATA_INGESTION_CACHE_DIR_NAME: str = "download_cache"
+DATA_INGESTION_DOWNLOAD_MAX_CONCURRENCY: int = 8
+DATA_INGESTION_DOWNLOAD_CHUNK_SIZE: int = 8 * 1024 * 1024  # 8 MB per ranged GET
+DATA_INGESTION_EXTRACT_MAX_WORKERS: int = 8
 
 """DATA validation realated Constants"""
 DATA_VALIDATION_DIR_NAME = "data_validation"
 DATA_VALIDATION_STATUS_FILE = "status.txt"
 DATA_VALIDATION_REQUIRED_FILES = ["images", "labels",  "train.txt", "val.txt"]
+DATA_VALIDATION_SPLITS = ["train", "valid"]  # feature store splits whose samples are validated
+DATA_VALIDATION_DATASET_YAML = "data.yaml"  # dataset description with nc, if the dataset ships one
+DATA_VALIDATION_REPORT_FILE = "sample_report.parquet"  # written as .csv when no parquet engine is installed
+DATA_VALIDATION_SUMMARY_FILE = "summary.json"
+DATA_VALIDATION_EXCLUDED_FILE = "excluded_samples.txt"
+DATA_VALIDATION_MAX_WORKERS: int = 8
+DATA_VALIDATION_MAX_CORRUPT_FRACTION: float = 0.05  # validation fails above this share of corrupt samples
 
 """MODEL TRAINER RELATED CONSTANTS"""
 MODEL_TRAINER_DIR:str = "model_trainer"  
 MODEL_TRAINER_PRETRAINED_WEIGHTS_URL:str = "https://github.com/WongKinYiu/yolov7/releases/download/v0.1/yolov7.pt"
 MODEL_TRAINER_EPOCHS: int = 1
 MODEL_TRAINER_BATCH_SIZE: int = 8
+MODEL_TRAINER_RUN_MODE: str = "in_process"  # or "process" to train in a managed worker process
+MODEL_TRAINER_WEIGHTS_STORE_DIR_NAME: str = "weights_store"  # shared by all runs, under ARTIFACTS_DIR
+MODEL_TRAINER_PRETRAINED_WEIGHTS_SHA256: str = None  # expected hash of the weights; None trusts the first download
+MODEL_TRAINER_WEIGHTS_MIRROR: str = None  # local directory or file:// URL to fetch weights from offline
 
 """MODEL PUSHER RELATED CONSTANTS"""
 MODEL_S3_BUCKET_NAME :str = "mlops-object-data"
-S3_MODEL_NAME: str ="best.pt"
\ No newline at end of file
+S3_MODEL_NAME: str ="best.pt"
+MODEL_PUSHER_MULTIPART_CHUNK_SIZE: int = 8 * 1024 * 1024  # part size of the multipart upload
+MODEL_PUSHER_MAX_CONCURRENCY: int = 8  # parts uploaded in parallel
+MODEL_PUSHER_PUSH_FP16: bool = False  # also push an optimizer-stripped FP16 copy of the checkpoint
+S3_FP16_MODEL_NAME: str = "best_fp16.pt"
@@ -2,20 +2,27 @@ from dataclasses import dataclass
 
 @dataclass
 class DataIngestionArtifact:
-    data_zip_file_path: str
+    data_zip_file_path: str  # None when the sync did not need the whole archive
     feature_store_path: str
+    manifest_file_path: str = None
 
 
 @dataclass
 class DataValidationArtifact:
     validation_status: bool
     data_ingestion_artifact: DataIngestionArtifact  # Add this line
+    report_file_path: str = None  # per-sample checks (parquet or csv)
+    summary_file_path: str = None
+    excluded_file_path: str = None  # corrupt samples (feature store relative paths) left out of training
 
 @dataclass
 class ModelTrainerArtifact:
     trained_model_file_path: str
+    epoch_metrics: list = None  # per-epoch metrics and timings reported by the training run
 
 @dataclass
 class ModelPusherArtifact:
     model_bucket_name:str 
-    s3_key_path:str 
\ No newline at end of file
+    s3_key_path:str 
+    uploaded: bool = True  # False when the stored model already had the same content hash
+    fp16_s3_key_path: str = None  # set when the FP16 variant was pushed too
@@ -9,6 +9,8 @@ TIMESTAMP: str = datetime.now().strftime("%m_%d_%Y_%H_%M_%S")
 @dataclass
 class TrainingPipelineConfig: 
     artifacts_dir: str = os.path.join(ARTIFACTS_DIR,TIMESTAMP)
+    stage_cache_dir: str = os.path.join(ARTIFACTS_DIR,PIPELINE_STAGE_CACHE_DIR_NAME)
+    max_workers: int = PIPELINE_MAX_WORKERS
 
 
 training_pipeline_config : TrainingPipelineConfig = TrainingPipelineConfig()
@@ -18,11 +20,21 @@ training_pipeline_config : TrainingPipelineConfig = TrainingPipelineConfig()
 class DataIngestionConfig:
     data_ingestion_dir : str = os.path.join(
         training_pipeline_config.artifacts_dir,DATA_INGESTION_DIR_NAME    )
+    # the feature store and its manifest persist across runs so ingestion only syncs what changed
     feature_store_file_path: str = os.path.join(
-        data_ingestion_dir,DATA_INGESTION_FEATURE_STORE_DIR
+        ARTIFACTS_DIR,DATA_INGESTION_FEATURE_STORE_DIR
     )
+    manifest_file_path: str = os.path.join(ARTIFACTS_DIR, DATA_INGESTION_MANIFEST_FILE)
     S3_DATA_NAME = DATA_INGESTION_S3_DATA_NAME
     S3_DATA_BUCKET = DATA_INGESTION_S3_BUCKET_NAME
+    S3_DATA_LAYOUT = DATA_INGESTION_S3_DATA_LAYOUT
+    S3_DATA_PREFIX = DATA_INGESTION_S3_DATA_PREFIX
+    incremental_max_fraction: float = DATA_INGESTION_INCREMENTAL_MAX_FRACTION
+    # shared across runs so an unchanged dataset (same ETag) is never downloaded twice
+    download_cache_dir: str = os.path.join(ARTIFACTS_DIR, DATA_INGESTION_CACHE_DIR_NAME)
+    download_max_concurrency: int = DATA_INGESTION_DOWNLOAD_MAX_CONCURRENCY
+    download_chunk_size: int = DATA_INGESTION_DOWNLOAD_CHUNK_SIZE
+    extract_max_workers: int = DATA_INGESTION_EXTRACT_MAX_WORKERS
 
 
 
@@ -33,6 +45,13 @@ class DataValidationConfig:
     )
     valid_status_file_dir: str = os.path.join(data_validation_dir, DATA_VALIDATION_STATUS_FILE)
     required_file_list = DATA_VALIDATION_REQUIRED_FILES
+    splits = DATA_VALIDATION_SPLITS
+    dataset_yaml = DATA_VALIDATION_DATASET_YAML
+    report_file_path: str = os.path.join(data_validation_dir, DATA_VALIDATION_REPORT_FILE)
+    summary_file_path: str = os.path.join(data_validation_dir, DATA_VALIDATION_SUMMARY_FILE)
+    excluded_file_path: str = os.path.join(data_validation_dir, DATA_VALIDATION_EXCLUDED_FILE)
+    max_workers: int = DATA_VALIDATION_MAX_WORKERS
+    max_corrupt_fraction: float = DATA_VALIDATION_MAX_CORRUPT_FRACTION
 
 @dataclass
 class ModelTrainerConfig:
@@ -41,8 +60,16 @@ class ModelTrainerConfig:
     model_weights_url :str =MODEL_TRAINER_PRETRAINED_WEIGHTS_URL
     model_epochs :str = MODEL_TRAINER_EPOCHS
     model_batch_size :str = MODEL_TRAINER_BATCH_SIZE
+    model_run_mode :str = MODEL_TRAINER_RUN_MODE
+    weights_store_dir :str = os.path.join(ARTIFACTS_DIR, MODEL_TRAINER_WEIGHTS_STORE_DIR_NAME)
+    model_weights_sha256 :str = MODEL_TRAINER_PRETRAINED_WEIGHTS_SHA256
+    weights_mirror :str = MODEL_TRAINER_WEIGHTS_MIRROR
 
 @dataclass
 class ModelPusherConfig:
     model_bucket_name:str = MODEL_S3_BUCKET_NAME
-    s3_key:str = S3_MODEL_NAME
\ No newline at end of file
+    s3_key:str = S3_MODEL_NAME
+    multipart_chunk_size:int = MODEL_PUSHER_MULTIPART_CHUNK_SIZE
+    max_concurrency:int = MODEL_PUSHER_MAX_CONCURRENCY
+    push_fp16:bool = MODEL_PUSHER_PUSH_FP16
+    fp16_s3_key:str = S3_FP16_MODEL_NAME
@@ -0,0 +1,113 @@
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+from object.exception import objException
+from object.logger import logging
+
+
+@dataclass
+class DAGNode:
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]  # called with the results of its dependencies, by name
+    deps: List[str] = field(default_factory=list)
+    start: float = None
+    end: float = None
+
+    @property
+    def seconds(self) -> float:
+        return (self.end - self.start) if self.start is not None and self.end is not None else 0.0
+
+
+class DAGExecutor:
+    """
+    Runs pipeline steps as a dependency graph on a thread pool.
+
+    A node is submitted as soon as all of its dependencies have finished, so independent steps
+    (e.g. downloading the pretrained weights and syncing the dataset) overlap. The first failing
+    node stops new submissions; nodes already running are allowed to finish and the error is
+    re-raised. After a run, ``report`` logs per-node timings and the critical path, i.e. the
+    chain of dependencies that determined the end-to-end wall clock time.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.nodes: Dict[str, DAGNode] = {}
+        self.results: Dict[str, Any] = {}
+        self.start: float = None
+        self.end: float = None
+
+    def add(self, name: str, fn: Callable[[Dict[str, Any]], Any], deps: List[str] = None) -> None:
+        for dep in deps or []:
+            if dep not in self.nodes:
+                raise ValueError(f"Node {name} depends on unknown node {dep}")  # also rules out cycles
+        self.nodes[name] = DAGNode(name, fn, list(deps or []))
+
+    def _run_node(self, node: DAGNode) -> Any:
+        node.start = time.time()
+        try:
+            return node.fn({dep: self.results[dep] for dep in node.deps})
+        finally:
+            node.end = time.time()
+
+    def run(self) -> Dict[str, Any]:
+        try:
+            self.start = time.time()
+            pending = dict(self.nodes)
+            running = {}
+            error = None
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while pending or running:
+                    if error is None:
+                        for name, node in list(pending.items()):
+                            if all(dep in self.results for dep in node.deps):
+                                logging.info(f"Starting pipeline step {name}")
+                                running[executor.submit(self._run_node, node)] = name
+                                del pending[name]
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        if future.exception() is not None:
+                            error = error or future.exception()
+                            logging.error(f"Pipeline step {name} failed after {self.nodes[name].seconds:.1f}s")
+                        else:
+                            self.results[name] = future.result()
+                            logging.info(f"Finished pipeline step {name} in {self.nodes[name].seconds:.1f}s")
+            self.end = time.time()
+            if error is not None:
+                raise error
+            return self.results
+
+        except Exception as e:
+            raise objException(e, sys) from e
+
+    def critical_path(self) -> List[str]:
+        """Walks back from the last node to finish through the dependency that finished last."""
+        finished = [node for node in self.nodes.values() if node.end is not None]
+        if not finished:
+            return []
+        node = max(finished, key=lambda x: x.end)
+        path = [node.name]
+        while node.deps:
+            node = max((self.nodes[dep] for dep in node.deps), key=lambda x: x.end or 0.0)
+            path.append(node.name)
+        return path[::-1]
+
+    def report(self) -> None:
+        wall = (self.end or time.time()) - self.start
+        busy = sum(node.seconds for node in self.nodes.values())
+        for node in sorted(self.nodes.values(), key=lambda x: x.start or float("inf")):
+            if node.start is not None:
+                logging.info(
+                    f"  {node.name:<20} start +{node.start - self.start:7.1f}s  took {node.seconds:7.1f}s"
+                )
+        path = self.critical_path()
+        logging.info(
+            f"Pipeline wall clock {wall:.1f}s for {busy:.1f}s of step time "
+            f"(x{busy / wall if wall else 0:.2f} overlap); critical path: "
+            + " -> ".join(f"{name} ({self.nodes[name].seconds:.1f}s)" for name in path)
+        )
@@ -8,6 +8,10 @@ from object.components.model_trainer import ModelTrainer
 from object.components.model_pusher import ModelPusher
 from object.entity.config_entity import *
 from object.entity.artifacts_entity import *
+from object.pipeline.dag_executor import DAGExecutor
+from object.utils.stage_cache import StageCache
+
+STAGES = ["data_ingestion", "data_validation", "model_trainer", "model_pusher"]
 
 class TrainingPipeline:
     def __init__(self):
@@ -15,6 +19,10 @@ class TrainingPipeline:
         self.data_validation_config = DataValidationConfig()
         self.model_trainer_config = ModelTrainerConfig()
         self.model_pusher_config = ModelPusherConfig()
+        self.stage_cache = StageCache(
+            cache_dir=training_pipeline_config.stage_cache_dir,
+            run_artifacts_dir=training_pipeline_config.artifacts_dir,
+        )
 
     def start_data_ingestion( self)->DataIngestionArtifact:
         try:
@@ -48,11 +56,14 @@ class TrainingPipeline:
         except Exception as e:
             raise objException(e, sys)
 
-    def initate_model_trainer(self,data_validation_artifacts:DataValidationArtifact):
+    def initate_model_trainer(self,data_validation_artifacts:DataValidationArtifact, inputs_prepared: bool = False):
         try:
             logging.info("Entered the initate_model_trainer method of TrainPipeline class")
             model_trainer = ModelTrainer(model_trainer_config=self.model_trainer_config,data_validation_artifacts=data_validation_artifacts)
-            model_trainer_artifact = model_trainer.initate_model_trainer()
+            if inputs_prepared:  # weights, image lists and yolov7 configs were prepared by earlier pipeline steps
+                model_trainer_artifact = model_trainer.train_model()
+            else:
+                model_trainer_artifact = model_trainer.initate_model_trainer()
             return model_trainer_artifact
         except Exception as e:
             raise objException(e,sys)
@@ -65,26 +76,139 @@ class TrainingPipeline:
             return model_pusher_artifact
         except Exception as e:
             raise objException(e,sys)
-    def run_pipeline(self)->None:
+    def run_stage(self, stage: str, artifact_cls: type, config, stage_fn, *upstream, resume_from: str = None,
+                  cacheable: bool = True):
+        """
+        Runs stage_fn(*upstream) unless the persisted artifact of the stage can be reused.
+
+        Stages before resume_from are always restored from their persisted artifact; resume_from
+        and later stages always run. Without resume_from a stage is skipped when the fingerprint of
+        its config and upstream artifacts matches the persisted one.
+        """
         try:
-            data_ingestion_artifact = self.start_data_ingestion()
-            data_validation_artifacts = self.start_data_validation(
-                data_ingestion_artifacts=data_ingestion_artifact,
-            )
-            
+            if resume_from is not None and STAGES.index(stage) < STAGES.index(resume_from):
+                artifact = self.stage_cache.load(stage, artifact_cls)
+                if artifact is None:
+                    raise Exception(f"Cannot resume from {resume_from}: no usable persisted artifact for stage {stage}")
+                logging.info(f"Restored {stage} artifact to resume from {resume_from}: {artifact}")
+                return artifact
+
+            fingerprint = self.stage_cache.fingerprint(stage, config, *upstream)
+            if cacheable and resume_from is None:
+                artifact = self.stage_cache.load(stage, artifact_cls, fingerprint)
+                if artifact is not None:
+                    logging.info(f"Skipping stage {stage}: inputs match the persisted artifact ({fingerprint[:12]})")
+                    return artifact
+
+            artifact = stage_fn(*upstream)
+            if artifact is not None:
+                self.stage_cache.save(stage, fingerprint, artifact)
+            return artifact
+        except Exception as e:
+            raise objException(e, sys)
+
+    def cached_artifact(self, stage: str, artifact_cls: type, config, *upstream, resume_from: str = None):
+        """
+        The persisted artifact run_stage would return for these inputs without running the stage, or
+        None when the stage would run.
+        """
+        try:
+            if resume_from is not None:
+                if STAGES.index(stage) < STAGES.index(resume_from):
+                    return self.stage_cache.load(stage, artifact_cls)
+                return None
+            fingerprint = self.stage_cache.fingerprint(stage, config, *upstream)
+            return self.stage_cache.load(stage, artifact_cls, fingerprint)
+        except Exception as e:
+            raise objException(e, sys)
+
+    def run_pipeline(self, resume_from: str = None)->None:
+        try:
+            if resume_from is not None and resume_from not in STAGES:
+                raise ValueError(f"Unknown stage {resume_from}, expected one of {STAGES}")
+
+            # the pipeline is a dependency graph: steps that don't depend on each other (weights
+            # download, dataset validation, image lists, yolov7 config generation) run concurrently
+            dag = DAGExecutor(max_workers=training_pipeline_config.max_workers)
+
+            # ingestion always runs: its incremental sync is a no-op when the remote dataset is
+            # unchanged, and its manifest is what fingerprints every downstream stage
+            dag.add("data_ingestion", lambda results: self.run_stage(
+                "data_ingestion", DataIngestionArtifact, self.data_ingestion_config,
+                self.start_data_ingestion, resume_from=resume_from, cacheable=False,
+            ))
+            dag.add("data_validation", lambda results: self.run_stage(
+                "data_validation", DataValidationArtifact, self.data_validation_config,
+                self.start_data_validation, results["data_ingestion"], resume_from=resume_from,
+            ), deps=["data_ingestion"])
+
             # Only proceed with model training if validation is successful
             # if data_validation_artifacts.validation_status:
-            logging.info("Data validation successful, proceeding with model training")
-            model_trainer_artifact = self.initate_model_trainer(data_validation_artifacts=data_validation_artifacts)
-            # else:
-            #     logging.warning("Data validation failed, skipping model training")
-                
+            train_deps = ["data_validation"]
+            if resume_from != "model_pusher":  # training inputs are only needed when training may run
+                model_trainer = ModelTrainer(data_validation_artifacts=None, model_trainer_config=self.model_trainer_config)
+
+                def unless_trainer_cached(step, fn):
+                    # the preparation steps are skipped when model_trainer will reuse its persisted artifact
+                    def run(results):
+                        data_validation = results.get("data_validation")
+                        if data_validation is None:  # the weights don't wait for validation: use its persisted artifact
+                            data_validation = self.cached_artifact(
+                                "data_validation", DataValidationArtifact, self.data_validation_config,
+                                results["data_ingestion"], resume_from=resume_from,
+                            )
+                        if data_validation is not None and self.cached_artifact(
+                            "model_trainer", ModelTrainerArtifact, self.model_trainer_config, data_validation,
+                            resume_from=resume_from,
+                        ) is not None:
+                            logging.info(f"Skipping pipeline step {step}: model_trainer is a stage cache hit")
+                            return None
+                        return fn(results)
+                    return run
+
+                dag.add("pretrained_weights", unless_trainer_cached(
+                    "pretrained_weights", lambda results: model_trainer.prepare_weights()
+                ), deps=["data_ingestion"])
+                # both need validation: the image lists leave out the corrupt samples it found, and
+                # the label index it built is reused instead of being built twice
+                dag.add("image_lists", unless_trainer_cached(
+                    "image_lists", lambda results: model_trainer.write_image_lists(
+                        results["data_ingestion"].feature_store_path, results["data_validation"].excluded_file_path
+                    )
+                ), deps=["data_ingestion", "data_validation"])
+                dag.add("label_index", unless_trainer_cached(
+                    "label_index",
+                    lambda results: model_trainer.index_labels(results["data_ingestion"].feature_store_path),
+                ), deps=["data_ingestion", "data_validation"])
+                dag.add("yolov7_configs", unless_trainer_cached(
+                    "yolov7_configs", lambda results: model_trainer.write_yolov7_configs(results["label_index"])
+                ), deps=["data_validation", "label_index"])
+                train_deps += ["pretrained_weights", "image_lists", "yolov7_configs"]
+
+            dag.add("model_trainer", lambda results: self.run_stage(
+                "model_trainer", ModelTrainerArtifact, self.model_trainer_config,
+                lambda data_validation_artifacts: self.initate_model_trainer(
+                    data_validation_artifacts, inputs_prepared=resume_from != "model_pusher"
+                ),
+                results["data_validation"], resume_from=resume_from,
+            ), deps=train_deps)
+
             # Only proceed with model pusher if model training is successful
-            if model_trainer_artifact:
+            def push_model(results):
+                if not results["model_trainer"]:
+                    logging.warning("Model training failed, skipping model pusher")
+                    return None
                 logging.info("Model training successful, proceeding with model pusher")
-                model_pusher_artifact = self.initate_model_pusher(model_trainer_artifact=model_trainer_artifact)
-            else:
-                logging.warning("Model training failed, skipping model pusher")
+                return self.run_stage(
+                    "model_pusher", ModelPusherArtifact, self.model_pusher_config,
+                    self.initate_model_pusher, results["model_trainer"], resume_from=resume_from,
+                )
+            dag.add("model_pusher", push_model, deps=["model_trainer"])
+
+            try:
+                dag.run()
+            finally:
+                dag.report()
         except Exception as e:
             raise objException(e,sys)
-        
\ No newline at end of file
+        
@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+from typing import Dict, List, Tuple
+
+from object.exception import objException
+from object.logger import logging
+
+MANIFEST_VERSION = 1
+IMAGE_FORMATS = ['bmp', 'jpg', 'jpeg', 'png', 'tif', 'tiff', 'dng', 'webp', 'mpo']
+
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Reads the dataset manifest at manifest_path.
+
+    A manifest maps every file of the feature store (path relative to the feature store) to its
+    size, content hash and, for images, the hash of the matching label file. An empty manifest
+    is returned when none exists yet or when it was written by an incompatible version.
+    """
+    try:
+        if not os.path.isfile(manifest_path):
+            return {"version": MANIFEST_VERSION, "source": {}, "files": {}}
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            logging.info(f"Ignoring manifest {manifest_path} with version {manifest.get('version')}")
+            return {"version": MANIFEST_VERSION, "source": {}, "files": {}}
+        return manifest
+
+    except Exception as e:
+        raise objException(e, sys) from e
+
+
+def save_manifest(manifest_path: str, source: dict, files: Dict[str, dict]) -> None:
+    try:
+        os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+        manifest = {"version": MANIFEST_VERSION, "source": source, "files": attach_label_hashes(files)}
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+        logging.info(f"Saved manifest with {len(files)} files to {manifest_path}")
+
+    except Exception as e:
+        raise objException(e, sys) from e
+
+
+def is_image(path: str) -> bool:
+    return path.split('.')[-1].lower() in IMAGE_FORMATS
+
+
+def label_path_for(image_path: str) -> str:
+    # same convention as yolov7 utils.datasets.img2label_paths, on '/'-separated relative paths
+    path = ('/' + image_path).replace('/images/', '/labels/', 1)[1:]
+    return path.rsplit('.', 1)[0] + '.txt'
+
+
+def attach_label_hashes(files: Dict[str, dict]) -> Dict[str, dict]:
+    """Sets label_hash on every image entry to the hash of its label file (None when unlabeled)."""
+    for path, entry in files.items():
+        if is_image(path):
+            label = files.get(label_path_for(path))
+            entry["label_hash"] = label["hash"] if label else None
+    return files
+
+
+def verify_local_files(root: str, files: Dict[str, dict]) -> Dict[str, dict]:
+    """Keeps only the manifest entries whose file is still on disk under root with the recorded size."""
+    present = {}
+    for path, entry in files.items():
+        try:
+            if os.path.getsize(os.path.join(root, path)) == entry["size"]:
+                present[path] = entry
+        except OSError:
+            pass
+    if len(present) != len(files):
+        logging.info(f"{len(files) - len(present)} manifest entries are missing or modified on disk")
+    return present
+
+
+def diff_manifests(local_files: Dict[str, dict], remote_files: Dict[str, dict]) -> Tuple[List[str], List[str]]:
+    """Returns (changed, removed): paths to fetch from the remote and paths to delete locally."""
+    changed = sorted(
+        path for path, entry in remote_files.items()
+        if path not in local_files
+        or (local_files[path]["size"], local_files[path]["hash"]) != (entry["size"], entry["hash"])
+    )
+    removed = sorted(path for path in local_files if path not in remote_files)
+    return changed, removed
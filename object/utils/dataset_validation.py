@@ -0,0 +1,135 @@
+import os
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import ExifTags, Image
+
+from object.exception import objException
+from object.logger import logging
+from object.utils.dataset_manifest import IMAGE_FORMATS, is_image
+from object.utils.label_index import LABEL_SEGMENTS, LABEL_UNPARSEABLE, MAX_CLASS_ID, build_label_index
+
+EXIF_ORIENTATION = next(k for k, v in ExifTags.TAGS.items() if v == "Orientation")
+MIN_IMAGE_SIZE = 10  # pixels, as required by yolov7's dataset checks
+
+
+def exif_size(img: Image.Image) -> tuple:
+    """(width, height) of img after EXIF orientation, same rule as yolov7 utils.datasets.exif_size."""
+    size = img.size
+    try:
+        rotation = dict(img._getexif().items())[EXIF_ORIENTATION]
+        if rotation in (6, 8):  # rotation 270 / 90
+            size = (size[1], size[0])
+    except Exception:
+        pass
+    return size
+
+
+def _check_images(paths: List[str]) -> List[dict]:
+    """Decodes the header of every image and returns its format and EXIF-corrected size (or the error)."""
+    results = []
+    for path in paths:
+        result = {"format": None, "width": 0, "height": 0, "image_error": ""}
+        try:
+            with Image.open(path) as img:
+                img.verify()
+                result["format"] = (img.format or "").lower()
+                result["width"], result["height"] = exif_size(img)
+            if result["format"] not in IMAGE_FORMATS:
+                result["image_error"] = f"invalid image format {result['format']}"
+            elif min(result["width"], result["height"]) < MIN_IMAGE_SIZE:
+                result["image_error"] = f"image size {(result['width'], result['height'])} <{MIN_IMAGE_SIZE} pixels"
+        except Exception as e:
+            result["image_error"] = f"{type(e).__name__}: {e}"
+        results.append(result)
+    return results
+
+
+def _label_errors(index, nc: Optional[int]) -> Dict[str, str]:
+    """Validates every row of the label index at once and returns {label file name: first error}."""
+    labels = index.labels
+    file_of_row = np.repeat(np.arange(len(index)), np.diff(index.offsets))
+    classes, coords = labels[:, 0], labels[:, 1:]
+    checks = [
+        ("non-integer class id", classes != np.floor(classes)),
+        ("negative class id", classes < 0),
+        ("negative labels", (coords < 0).any(1)),
+        ("non-normalized or out of bounds coordinate labels", (coords > 1).any(1)),
+    ]
+    if nc is not None:
+        checks.append((f"class id >= nc ({nc})", classes >= nc))
+    else:
+        checks.append((f"class id > {MAX_CLASS_ID}", classes > MAX_CLASS_ID))
+
+    errors = {}
+    for message, bad_rows in checks:
+        for i in np.unique(file_of_row[bad_rows]):
+            errors.setdefault(index.files[i], message)
+    if len(labels):  # duplicate rows within one file
+        keyed = np.concatenate((file_of_row[:, None].astype(np.float64), labels.astype(np.float64)), 1)
+        _, first, counts = np.unique(keyed, axis=0, return_index=True, return_counts=True)
+        for i in np.unique(file_of_row[first[counts > 1]]):
+            errors.setdefault(index.files[i], "duplicate labels")
+    for i in np.flatnonzero(index.flags == LABEL_UNPARSEABLE):
+        errors[index.files[i]] = "labels require 5 columns each (or a polygon) of numbers"
+    return errors
+
+
+def validate_split(split_dir: str, nc: Optional[int] = None, workers: int = None,
+                   chunk_size: int = 256) -> List[dict]:
+    """
+    Validates every image of <split_dir>/images and its label in <split_dir>/labels.
+
+    Image headers are decoded by a process pool; labels are checked vectorized on the shared label
+    index (column count, normalized coordinates, integer class ids below nc, duplicates). Returns one
+    report row per image; a row is corrupt when either its image or its label failed a check,
+    matching the samples yolov7's LoadImagesAndLabels would otherwise drop during training.
+    """
+    try:
+        image_dir, label_dir = os.path.join(split_dir, "images"), os.path.join(split_dir, "labels")
+        images = sorted(f for f in os.listdir(image_dir) if is_image(f)) if os.path.isdir(image_dir) else []
+        chunks = [images[k:k + chunk_size] for k in range(0, len(images), chunk_size)]
+        paths = [[os.path.join(image_dir, f) for f in chunk] for chunk in chunks]
+        if len(chunks) > 1 and workers != 1:
+            # spawned, not forked: validation runs in a pipeline thread next to the weights download
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                image_results = [r for results in executor.map(_check_images, paths) for r in results]
+        else:
+            image_results = [r for p in paths for r in _check_images(p)]
+
+        index = build_label_index(label_dir) if os.path.isdir(label_dir) else None
+        positions = {name: i for i, name in enumerate(index.files)} if index is not None else {}
+        label_errors = _label_errors(index, nc) if index is not None else {}
+
+        split = os.path.basename(os.path.normpath(split_dir))
+        rows = []
+        for image, image_result in zip(images, image_results):
+            label = os.path.splitext(image)[0] + ".txt"
+            i = positions.get(label)
+            if i is None:
+                label_status, boxes = "missing", 0
+            else:
+                boxes = int(index.offsets[i + 1] - index.offsets[i])
+                label_status = "segments" if index.flags[i] == LABEL_SEGMENTS else ("ok" if boxes else "empty")
+            label_error = label_errors.get(label, "")
+            rows.append({
+                "split": split,
+                "image": f"{split}/images/{image}",
+                "label": f"{split}/labels/{label}" if i is not None else None,
+                **image_result,
+                "label_status": "invalid" if label_error else label_status,
+                "boxes": boxes,
+                "label_error": label_error,
+                "corrupt": bool(image_result["image_error"] or label_error),
+            })
+        logging.info(
+            f"Validated {len(rows)} samples of {split}: {sum(r['corrupt'] for r in rows)} corrupt, "
+            f"{sum(r['label_status'] == 'missing' for r in rows)} without labels"
+        )
+        return rows
+
+    except Exception as e:
+        raise objException(e, sys) from e
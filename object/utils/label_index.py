@@ -0,0 +1,225 @@
+import os
+import sys
+import multiprocessing
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from object.exception import objException
+from object.logger import logging
+
+LABEL_INDEX_SUFFIX = ".index.npz"  # train/labels -> train/labels.index.npz
+LABEL_INDEX_VERSION = 1
+LABEL_OK, LABEL_SEGMENTS, LABEL_UNPARSEABLE = 0, 1, 2
+MAX_CLASS_ID = 2 ** 16 - 1  # rows with a larger class id are label errors, not classes to size nc by
+
+
+def label_index_path(label_dir: str) -> str:
+    return str(label_dir).rstrip("/\\") + LABEL_INDEX_SUFFIX
+
+
+def _parse_label_files(paths: List[str]) -> Tuple[List[int], List[int], np.ndarray]:
+    """
+    Parses YOLO label files into one (n, 5) float32 array of (class, x, y, w, h) rows.
+
+    Files where every line has five columns are joined and parsed in a single np.fromstring call;
+    polygon (segment) labels are converted to their bounding boxes line by line, and any other
+    column count marks the file unparseable. Returns per-file flags, per-file row counts and the
+    concatenated rows.
+    """
+    flags, rows, blocks = [0] * len(paths), [0] * len(paths), [None] * len(paths)
+    fast_texts, fast_slots = [], []
+    for i, path in enumerate(paths):
+        with open(path, "r") as f:
+            text = f.read().strip()
+        if not text:
+            blocks[i] = np.zeros((0, 5), dtype=np.float32)
+            continue
+        lines = [x.split() for x in text.splitlines() if x.strip()]
+        if all(len(x) == 5 for x in lines):
+            fast_texts.append(text)
+            fast_slots.append((i, len(lines)))
+            continue
+        try:
+            if any(len(x) > 8 for x in lines):  # segments: (cls, xy1, xy2, ...)
+                classes = np.array([x[0] for x in lines], dtype=np.float32).reshape(-1, 1)
+                boxes = []
+                for x in lines:
+                    xy = np.array(x[1:], dtype=np.float32).reshape(-1, 2)
+                    (x1, y1), (x2, y2) = xy.min(0), xy.max(0)
+                    boxes.append([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+                blocks[i] = np.concatenate((classes, np.array(boxes, dtype=np.float32)), 1)
+                flags[i] = LABEL_SEGMENTS
+            else:
+                raise ValueError("labels require 5 columns each")
+        except ValueError:
+            blocks[i] = np.zeros((0, 5), dtype=np.float32)
+            flags[i] = LABEL_UNPARSEABLE
+
+    if fast_texts:
+        expected = 5 * sum(n for _, n in fast_slots)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)  # raised by fromstring on a non-numeric token
+            values = np.fromstring(" ".join(fast_texts), dtype=np.float32, sep=" ")
+        if values.size == expected:
+            values, start = values.reshape(-1, 5), 0
+            for i, n in fast_slots:
+                blocks[i] = values[start:start + n]
+                start += n
+        else:  # some file has a non-numeric value: parse file by file to find it
+            for (i, _), text in zip(fast_slots, fast_texts):
+                try:
+                    blocks[i] = np.array(text.split(), dtype=np.float32).reshape(-1, 5)
+                except ValueError:
+                    blocks[i] = np.zeros((0, 5), dtype=np.float32)
+                    flags[i] = LABEL_UNPARSEABLE
+
+    for i, block in enumerate(blocks):
+        rows[i] = len(block)
+    return flags, rows, np.concatenate(blocks, 0) if blocks else np.zeros((0, 5), dtype=np.float32)
+
+
+class LabelIndex:
+    """
+    Parsed labels of one YOLO labels directory, stored as a flat (n, 5) float32 array plus per-file
+    offsets. The index is persisted as <label_dir>.index.npz together with each file's size and
+    mtime so the trainer, data validation and the yolov7 dataset cache can reuse it instead of
+    re-reading every label file.
+    """
+
+    def __init__(self, label_dir: str, files: List[str], sizes: np.ndarray, mtimes: np.ndarray,
+                 flags: np.ndarray, offsets: np.ndarray, labels: np.ndarray):
+        self.label_dir = label_dir
+        self.files = list(files)
+        self.sizes = sizes
+        self.mtimes = mtimes
+        self.flags = flags
+        self.offsets = offsets
+        self.labels = labels
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def labels_for(self, i: int) -> np.ndarray:
+        return self.labels[self.offsets[i]:self.offsets[i + 1]]
+
+    @property
+    def valid_rows(self) -> np.ndarray:
+        """
+        Mask of the rows whose class id is an integer in [0, MAX_CLASS_ID]. Only these count towards
+        nc, class_counts and box_stats; the other rows stay in labels for data validation to report.
+        """
+        c = self.labels[:, 0]
+        return (c >= 0) & (c <= MAX_CLASS_ID) & (c == np.floor(c))
+
+    @property
+    def classes(self) -> np.ndarray:
+        # class ids of the valid rows
+        return self.labels[self.valid_rows, 0].astype(np.int64)
+
+    @property
+    def nc(self) -> int:
+        # number of classes is max class id + 1 (class ids start from 0)
+        classes = self.classes
+        return int(classes.max()) + 1 if len(classes) else 1
+
+    @property
+    def class_counts(self) -> np.ndarray:
+        return np.bincount(self.classes, minlength=self.nc)
+
+    def box_stats(self) -> Dict[int, dict]:
+        """Per-class instance count and mean/min/max of the normalized box width and height."""
+        c, wh = self.classes, self.labels[self.valid_rows, 3:5].astype(np.float64)
+        nc, counts = self.nc, self.class_counts
+        mean = np.stack([np.bincount(c, weights=wh[:, j], minlength=nc) for j in range(2)], 1) / \
+            np.maximum(counts, 1)[:, None]
+        lo, hi = np.full((nc, 2), np.inf), np.full((nc, 2), -np.inf)
+        np.minimum.at(lo, c, wh)
+        np.maximum.at(hi, c, wh)
+        return {
+            k: {"count": int(counts[k]), "mean_w": float(mean[k, 0]), "mean_h": float(mean[k, 1]),
+                "min_w": float(lo[k, 0]), "min_h": float(lo[k, 1]),
+                "max_w": float(hi[k, 0]), "max_h": float(hi[k, 1])}
+            for k in range(nc) if counts[k]
+        }
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"  # concurrent builders never share it
+        np.savez(tmp_path, version=LABEL_INDEX_VERSION, files=np.array(self.files, dtype=str), sizes=self.sizes,
+                 mtimes=self.mtimes, flags=self.flags, offsets=self.offsets, labels=self.labels)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, label_dir: str) -> "LabelIndex":
+        """Loads the persisted index of label_dir, or returns None when there is none (or it is outdated)."""
+        path = label_index_path(label_dir)
+        if not os.path.isfile(path):
+            return None
+        with np.load(path, allow_pickle=False) as x:
+            if int(x["version"]) != LABEL_INDEX_VERSION:
+                return None
+            return cls(label_dir, x["files"].tolist(), x["sizes"], x["mtimes"], x["flags"], x["offsets"], x["labels"])
+
+
+def build_label_index(label_dir: str, workers: int = None, chunk_size: int = 256) -> LabelIndex:
+    """
+    Builds (or incrementally refreshes) the label index of label_dir and persists it.
+
+    Files whose size and mtime match the previously persisted index are reused as-is; the rest are
+    parsed in chunks of chunk_size files by a process pool of workers processes.
+    """
+    logging.info(f"Building label index for {label_dir}")
+    try:
+        names = sorted(f for f in os.listdir(label_dir) if f.endswith(".txt"))
+        stats = [os.stat(os.path.join(label_dir, f)) for f in names]
+        sizes = np.array([s.st_size for s in stats], dtype=np.int64)
+        mtimes = np.array([s.st_mtime_ns for s in stats], dtype=np.int64)
+
+        previous = LabelIndex.load(label_dir)
+        reuse = {}
+        if previous is not None:
+            for j, name in enumerate(previous.files):
+                reuse[name] = (previous.sizes[j], previous.mtimes[j], previous.flags[j], previous.labels_for(j))
+
+        flags = np.zeros(len(names), dtype=np.int8)
+        blocks = [None] * len(names)
+        to_parse = []
+        for i, name in enumerate(names):
+            cached = reuse.get(name)
+            if cached is not None and cached[0] == sizes[i] and cached[1] == mtimes[i]:
+                flags[i], blocks[i] = cached[2], cached[3]
+            else:
+                to_parse.append(i)
+
+        chunks = [to_parse[k:k + chunk_size] for k in range(0, len(to_parse), chunk_size)]
+        paths = [[os.path.join(label_dir, names[i]) for i in chunk] for chunk in chunks]
+        if len(chunks) > 1 and workers != 1:
+            # spawned, not forked: the index may be built from a pipeline thread while other threads hold locks
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = list(executor.map(_parse_label_files, paths))
+        else:
+            results = [_parse_label_files(p) for p in paths]
+
+        for chunk, (chunk_flags, chunk_rows, chunk_labels) in zip(chunks, results):
+            split = np.split(chunk_labels, np.cumsum(chunk_rows)[:-1]) if chunk else []
+            for i, flag, block in zip(chunk, chunk_flags, split):
+                flags[i], blocks[i] = flag, block
+
+        rows = np.array([len(b) for b in blocks], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(rows))).astype(np.int64)
+        labels = np.concatenate(blocks, 0).astype(np.float32) if blocks else np.zeros((0, 5), dtype=np.float32)
+        index = LabelIndex(label_dir, names, sizes, mtimes, flags, offsets, labels)
+        index.save(label_index_path(label_dir))
+
+        logging.info(
+            f"Label index for {label_dir}: {len(names)} files ({len(to_parse)} parsed, "
+            f"{len(names) - len(to_parse)} reused), {len(labels)} boxes, nc={index.nc}, "
+            f"class counts={index.class_counts.tolist()}"
+        )
+        return index
+
+    except Exception as e:
+        raise objException(e, sys) from e
@@ -5,6 +5,9 @@ import os.path
 import sys
 import yaml
 import base64
+import hashlib
+
+HASH_BLOCK_SIZE = 1024 * 1024
 
 def read_yaml_file(file_path: str) -> dict:
     try:
@@ -16,6 +19,14 @@ def read_yaml_file(file_path: str) -> dict:
         raise objException(e, sys) from e
 
 
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def decodeImage(imgstring, fileName):
     imgdata = base64.b64decode(imgstring)
     with open("./data/" + fileName, 'wb') as f:
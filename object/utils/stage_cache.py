@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import hashlib
+import dataclasses
+from typing import Any, Optional
+
+from object.exception import objException
+from object.logger import logging
+from object.utils.main_utils import file_sha256
+
+STAGE_CACHE_VERSION = 1
+
+
+def _artifact_files(value: Any) -> list:
+    """Every existing file path referenced (at any depth) by an artifact dataclass."""
+    if dataclasses.is_dataclass(value):
+        value = dataclasses.asdict(value)
+    if isinstance(value, dict):
+        return [path for v in value.values() for path in _artifact_files(v)]
+    if isinstance(value, (list, tuple)):
+        return [path for v in value for path in _artifact_files(v)]
+    if isinstance(value, str) and os.path.isfile(value):
+        return [value]
+    return []
+
+
+def artifact_from_dict(artifact_cls: type, data: dict):
+    """Rebuilds an artifact dataclass (including nested artifacts) from its asdict() form."""
+    kwargs = {}
+    for field in dataclasses.fields(artifact_cls):
+        if field.name not in data:
+            continue
+        value = data[field.name]
+        if dataclasses.is_dataclass(field.type) and isinstance(value, dict):
+            value = artifact_from_dict(field.type, value)
+        kwargs[field.name] = value
+    return artifact_cls(**kwargs)
+
+
+class StageCache:
+    """
+    Persists the artifact of every pipeline stage together with the fingerprint of its inputs.
+
+    A stage's fingerprint covers its config dataclass (with the per-run artifacts directory
+    normalized away) and the upstream artifacts, including the content hash of every file they
+    reference, so a stage is only skipped when it would be given exactly the same inputs. The
+    record also keeps the hashes of the files the stage produced; a record whose outputs are gone
+    or were modified on disk is treated as a miss.
+    """
+
+    def __init__(self, cache_dir: str, run_artifacts_dir: str):
+        self.cache_dir = cache_dir
+        self.run_artifacts_dir = run_artifacts_dir
+        self._hashes = {}  # (path, size, mtime) -> sha256, so a file is hashed once per run
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _hash_file(self, path: str) -> str:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if key not in self._hashes:
+            self._hashes[key] = file_sha256(path)
+        return self._hashes[key]
+
+    def _normalize(self, value: Any) -> Any:
+        if isinstance(value, str):
+            return value.replace(self.run_artifacts_dir, "<run_artifacts_dir>")
+        if isinstance(value, dict):
+            return {k: self._normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._normalize(v) for v in value]
+        return value
+
+    def fingerprint(self, stage: str, config: Any, *upstream: Any) -> str:
+        config_dict = {f.name: getattr(config, f.name) for f in dataclasses.fields(config)}
+        config_dict.update({k: v for k, v in vars(type(config)).items() if k.isupper()})  # class-level settings
+        payload = {
+            "version": STAGE_CACHE_VERSION,
+            "stage": stage,
+            "config": self._normalize(config_dict),
+            "upstream": [
+                {
+                    "artifact": self._normalize(dataclasses.asdict(artifact)),
+                    "files": {self._normalize(path): self._hash_file(path) for path in _artifact_files(artifact)},
+                }
+                for artifact in upstream
+            ],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _record_path(self, stage: str) -> str:
+        return os.path.join(self.cache_dir, f"{stage}.json")
+
+    def load(self, stage: str, artifact_cls: type, fingerprint: Optional[str] = None):
+        """
+        Returns the persisted artifact of stage, or None when there is none, its fingerprint differs
+        from fingerprint (when given) or the files it produced are missing or changed.
+        """
+        try:
+            path = self._record_path(stage)
+            if not os.path.isfile(path):
+                return None
+            with open(path) as f:
+                record = json.load(f)
+            if record.get("version") != STAGE_CACHE_VERSION:
+                return None
+            if fingerprint is not None and record["fingerprint"] != fingerprint:
+                logging.info(f"Stage {stage} inputs changed since the last run")
+                return None
+            for output_path, sha256 in record["outputs"].items():
+                if not os.path.isfile(output_path) or self._hash_file(output_path) != sha256:
+                    logging.info(f"Stage {stage} output {output_path} is missing or modified")
+                    return None
+            return artifact_from_dict(artifact_cls, record["artifact"])
+
+        except Exception as e:
+            raise objException(e, sys) from e
+
+    def save(self, stage: str, fingerprint: str, artifact: Any) -> None:
+        try:
+            record = {
+                "version": STAGE_CACHE_VERSION,
+                "stage": stage,
+                "fingerprint": fingerprint,
+                "artifact": dataclasses.asdict(artifact),
+                "outputs": {path: self._hash_file(path) for path in _artifact_files(artifact)},
+            }
+            path = self._record_path(stage)
+            with open(path + ".tmp", "w") as f:
+                json.dump(record, f, indent=1, default=str)
+            os.replace(path + ".tmp", path)
+            logging.info(f"Persisted {type(artifact).__name__} of stage {stage}")
+
+        except Exception as e:
+            raise objException(e, sys) from e
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import contextlib
+import urllib.parse
+import urllib.request
+from typing import Optional
+
+from object.exception import objException
+from object.logger import logging
+from object.utils.main_utils import HASH_BLOCK_SIZE, file_sha256
+
+# the store root and mirror can also be given through the environment so that yolov7's
+# attempt_download (which has no pipeline config) resolves weights from the same store
+WEIGHTS_STORE_DIR_ENV = "WEIGHTS_STORE_DIR"
+WEIGHTS_MIRROR_ENV = "WEIGHTS_MIRROR"
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """Exclusive inter-process lock on path, held for the duration of the block."""
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ~10s
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class WeightsStore:
+    """
+    Content-addressed store for pretrained weights, shared by every pipeline run on the host.
+
+    Layout under root:
+        blobs/<sha256>      the weight files, named by their content hash
+        refs/<key>.json     url -> {url, name, sha256, size}, key being the hash of the url
+        locks/<key>.lock    per-url lock so concurrent runs download a file only once
+
+    Blobs and refs are written to a temporary file and renamed into place, so readers never see
+    a partial file. When a mirror (a local directory or a file:// URL) is set, weights are taken
+    from <mirror>/<file name> instead of the network, which makes the store usable offline.
+    """
+
+    def __init__(self, root: str, mirror: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.mirror = mirror
+        for sub_dir in ("blobs", "refs", "locks", "tmp"):
+            os.makedirs(os.path.join(self.root, sub_dir), exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["WeightsStore"]:
+        root = os.environ.get(WEIGHTS_STORE_DIR_ENV)
+        return cls(root, mirror=os.environ.get(WEIGHTS_MIRROR_ENV) or None) if root else None
+
+    def export_env(self) -> None:
+        """Exposes this store to yolov7's attempt_download (and to spawned training workers)."""
+        os.environ[WEIGHTS_STORE_DIR_ENV] = self.root
+        if self.mirror:
+            os.environ[WEIGHTS_MIRROR_ENV] = self.mirror
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256)
+
+    def _read_ref(self, path: str) -> Optional[dict]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _valid_blob(self, ref: Optional[dict], sha256: Optional[str] = None) -> Optional[str]:
+        if ref is None or (sha256 and ref["sha256"] != sha256):
+            return None
+        blob_path = self._blob_path(ref["sha256"])
+        if not os.path.isfile(blob_path) or os.path.getsize(blob_path) != ref["size"]:
+            return None
+        if file_sha256(blob_path) != ref["sha256"]:
+            logging.info(f"Removing corrupt weights blob {blob_path}")
+            os.remove(blob_path)
+            return None
+        return blob_path
+
+    def find(self, name: str) -> Optional[str]:
+        """Returns the verified blob of the most recently stored weights called name, if any."""
+        refs = [self._read_ref(os.path.join(self.root, "refs", f)) for f in os.listdir(os.path.join(self.root, "refs"))]
+        refs = sorted((r for r in refs if r and r["name"] == name), key=lambda r: r["stored_at"], reverse=True)
+        for ref in refs:
+            blob_path = self._valid_blob(ref)
+            if blob_path is not None:
+                return blob_path
+        return None
+
+    def fetch(self, url: str, dest: str, sha256: Optional[str] = None) -> str:
+        """
+        Materializes the weights at url into dest, downloading them only when the store has no
+        verified copy. sha256, when given, is the expected content hash of the file.
+        """
+        try:
+            key = self._key(url)
+            ref_path = os.path.join(self.root, "refs", key + ".json")
+            with _file_lock(os.path.join(self.root, "locks", key + ".lock")):
+                blob_path = self._valid_blob(self._read_ref(ref_path), sha256)
+                if blob_path is not None:
+                    logging.info(f"Weights store hit for {url} ({blob_path})")
+                else:
+                    blob_path = self._store(url, ref_path, sha256)
+            self.materialize(blob_path, dest)
+            return dest
+
+        except Exception as e:
+            raise objException(e, sys) from e
+
+    def materialize(self, blob_path: str, dest: str) -> None:
+        """Hardlinks (or copies) blob_path to dest, replacing dest atomically."""
+        dest = os.path.abspath(dest)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp_path = f"{dest}.{os.getpid()}.tmp"
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, dest)
+
+    def _source_url(self, url: str) -> str:
+        if not self.mirror:
+            return url
+        name = os.path.basename(urllib.parse.urlparse(url).path)
+        if self.mirror.startswith("file://"):
+            return self.mirror.rstrip("/") + "/" + urllib.parse.quote(name)
+        return urllib.parse.urljoin("file:", urllib.request.pathname2url(os.path.abspath(os.path.join(self.mirror, name))))
+
+    def _store(self, url: str, ref_path: str, sha256: Optional[str]) -> str:
+        source = self._source_url(url)
+        logging.info(f"Weights store miss for {url}, fetching {source}")
+        start = time.time()
+        digest, size = hashlib.sha256(), 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as f, urllib.request.urlopen(source) as response:
+                for block in iter(lambda: response.read(HASH_BLOCK_SIZE), b""):
+                    digest.update(block)
+                    f.write(block)
+                    size += len(block)
+            if sha256 and digest.hexdigest() != sha256:
+                raise ValueError(f"Checksum mismatch for {url}: expected {sha256}, got {digest.hexdigest()}")
+            blob_path = self._blob_path(digest.hexdigest())
+            os.replace(tmp_path, blob_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        ref = {"url": url, "name": os.path.basename(urllib.parse.urlparse(url).path),
+               "sha256": digest.hexdigest(), "size": size, "stored_at": time.time()}
+        with open(ref_path + ".tmp", "w") as f:
+            json.dump(ref, f)
+        os.replace(ref_path + ".tmp", ref_path)
+        logging.info(f"Stored {size / 1E6:.1f} MB of weights from {source} in {time.time() - start:.1f}s")
+        return blob_path
@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import queue
+import traceback
+import contextlib
+import multiprocessing
+from typing import Callable, List
+
+from object.exception import objException
+from object.logger import logging
+
+RUN_MODE_IN_PROCESS = "in_process"
+RUN_MODE_PROCESS = "process"
+
+
+@contextlib.contextmanager
+def yolov7_workdir(yolov7_dir: str):
+    """Makes the vendored yolov7 code importable (it imports utils/models/test as top-level modules) and chdirs into it."""
+    yolov7_dir = os.path.abspath(yolov7_dir)
+    cwd = os.getcwd()
+    sys.path.insert(0, yolov7_dir)
+    os.chdir(yolov7_dir)
+    try:
+        yield yolov7_dir
+    finally:
+        os.chdir(cwd)
+        if yolov7_dir in sys.path:
+            sys.path.remove(yolov7_dir)
+
+
+def _train(train_args: List[str], epoch_callback: Callable = None) -> dict:
+    """
+    Single-process equivalent of running ``python train.py <train_args>`` from the yolov7 directory.
+    Must be called inside ``yolov7_workdir``. Returns the exact checkpoint written by this run.
+    """
+    from pathlib import Path
+
+    import yaml
+    import train as yolov7_train
+    from torch.utils.tensorboard import SummaryWriter
+    from utils.general import check_file, colorstr, increment_path, set_logging
+    from utils.torch_utils import select_device
+
+    opt = yolov7_train.parse_opt(train_args)
+    opt.world_size, opt.global_rank = 1, -1
+    set_logging(opt.global_rank)
+    opt.data, opt.cfg, opt.hyp = check_file(opt.data), check_file(opt.cfg), check_file(opt.hyp)
+    opt.img_size.extend([opt.img_size[-1]] * (2 - len(opt.img_size)))
+    opt.save_dir = increment_path(Path(opt.project) / opt.name, exist_ok=opt.exist_ok)
+    opt.total_batch_size = opt.batch_size
+    device = select_device(opt.device, batch_size=opt.batch_size)
+    with open(opt.hyp) as f:
+        hyp = yaml.load(f, Loader=yaml.SafeLoader)
+
+    tb_writer = None  # init loggers, as train.py's __main__ does
+    if opt.global_rank in [-1, 0]:
+        prefix = colorstr('tensorboard: ')
+        yolov7_train.logger.info(
+            f"{prefix}Start with 'tensorboard --logdir {opt.project}', view at http://localhost:6006/")
+        tb_writer = SummaryWriter(opt.save_dir)  # Tensorboard
+    try:
+        results = yolov7_train.train(hyp, opt, device, tb_writer, epoch_callback=epoch_callback)
+    finally:
+        if tb_writer is not None:
+            tb_writer.close()  # flush the event file: this interpreter may keep running after training
+
+    # same choice train.py makes for the final (stripped) checkpoint
+    weights_dir = Path(opt.save_dir) / "weights"
+    best, last = weights_dir / "best.pt", weights_dir / "last.pt"
+    checkpoint = best if best.exists() else last
+    return {
+        "checkpoint": os.path.abspath(checkpoint),
+        "save_dir": os.path.abspath(opt.save_dir),
+        "results": [float(x) for x in results],
+    }
+
+
+def _train_worker(yolov7_dir: str, train_args: List[str], events) -> None:
+    try:
+        with yolov7_workdir(yolov7_dir):
+            result = _train(train_args, epoch_callback=lambda metrics: events.put(("epoch", metrics)))
+        events.put(("done", result))
+    except BaseException:
+        events.put(("error", traceback.format_exc()))
+
+
+class YOLOv7TrainRunner:
+    """
+    Runs yolov7 training through ``train.train()`` instead of a ``python train.py`` subprocess.
+
+    In ``in_process`` mode training runs in the calling interpreter; in ``process`` mode it runs in
+    a managed (spawned) worker so CUDA and dataloader state is released when it exits. Either way
+    every finished epoch is reported to ``epoch_callback`` with its metrics and timing, and ``run``
+    returns the path of the checkpoint this run wrote rather than scanning runs/train/exp*.
+    """
+
+    def __init__(self, yolov7_dir: str = "yolov7", mode: str = RUN_MODE_IN_PROCESS):
+        if mode not in (RUN_MODE_IN_PROCESS, RUN_MODE_PROCESS):
+            raise ValueError(f"Unknown training run mode {mode}")
+        self.yolov7_dir = yolov7_dir
+        self.mode = mode
+
+    def run(self, train_args: List[str], epoch_callback: Callable = None) -> dict:
+        logging.info(f"Entered run method of YOLOv7TrainRunner class ({self.mode}): train.py {' '.join(train_args)}")
+        try:
+            start = time.time()
+            epochs = []
+
+            def on_epoch(metrics: dict) -> None:
+                metrics["elapsed"] = time.time() - start
+                epochs.append(metrics)
+                if epoch_callback is not None:
+                    epoch_callback(metrics)
+
+            if self.mode == RUN_MODE_IN_PROCESS:
+                with yolov7_workdir(self.yolov7_dir):
+                    result = _train(train_args, epoch_callback=on_epoch)
+            else:
+                result = self._run_worker(train_args, on_epoch)
+
+            result["epochs"] = epochs
+            result["seconds"] = time.time() - start
+            logging.info(
+                f"Exited run method of YOLOv7TrainRunner class: {len(epochs)} epochs in "
+                f"{result['seconds']:.1f}s, checkpoint {result['checkpoint']}"
+            )
+            return result
+
+        except Exception as e:
+            raise objException(e, sys) from e
+
+    def _run_worker(self, train_args: List[str], on_epoch: Callable) -> dict:
+        context = multiprocessing.get_context("spawn")
+        events = context.Queue()
+        # not a daemon: the worker starts its own dataloader processes
+        worker = context.Process(target=_train_worker, args=(self.yolov7_dir, train_args, events))
+        worker.start()
+        try:
+            while True:
+                try:
+                    kind, payload = events.get(timeout=5)
+                except queue.Empty:
+                    if not worker.is_alive():
+                        raise RuntimeError(f"Training worker exited with code {worker.exitcode} without a result")
+                    continue
+                if kind == "epoch":
+                    on_epoch(payload)
+                elif kind == "done":
+                    return payload
+                else:
+                    raise RuntimeError(f"Training worker failed:\n{payload}")
+        finally:
+            worker.join(timeout=60)
+            if worker.is_alive():
+                worker.terminate()
@@ -0,0 +1,226 @@
+import os
+import sys
+import zlib
+import struct
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from object.exception import objException
+from object.logger import logging
+
+# End of central directory record: signature, disk numbers, entry counts, cd size, cd offset, comment length
+EOCD_SIGNATURE = b"PK\x05\x06"
+EOCD_STRUCT = "<4s4H2LH"
+EOCD_SIZE = struct.calcsize(EOCD_STRUCT)
+EOCD_SEARCH_SIZE = EOCD_SIZE + 0xFFFF  # record plus the longest possible archive comment
+# Central directory file header and local file header, as laid out in zipfile
+CD_SIGNATURE = b"PK\x01\x02"
+CD_STRUCT = "<4s4B4HL2L5H2L"
+CD_SIZE = struct.calcsize(CD_STRUCT)
+LOCAL_HEADER_STRUCT = "<4s2B4HL2L2H"
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_STRUCT)
+
+
+class ZipEntry(NamedTuple):
+    filename: str
+    header_offset: int
+    end_offset: int  # first byte after the member (next header or central directory)
+    compress_type: int
+    compress_size: int
+    file_size: int
+    crc: int
+
+
+def locate_central_directory(tail: bytes, tail_offset: int) -> Optional[Tuple[int, int]]:
+    """
+    Find the end of central directory record in tail (the last bytes of an archive that start at
+    absolute offset tail_offset) and return (cd_offset, cd_size), or None when the record is not
+    in tail or the archive is ZIP64.
+    """
+    index = tail.rfind(EOCD_SIGNATURE)
+    if index < 0 or len(tail) - index < EOCD_SIZE:
+        return None
+    endrec = struct.unpack(EOCD_STRUCT, tail[index:index + EOCD_SIZE])
+    cd_size, cd_offset = endrec[5], endrec[6]
+    if cd_offset == 0xFFFFFFFF or cd_size == 0xFFFFFFFF:
+        return None
+    # an archive with prepended data (e.g. self-extracting) shifts every offset
+    concat = tail_offset + index - cd_size - cd_offset
+    return cd_offset + concat, cd_size
+
+
+def parse_central_directory(data: bytes, cd_offset: int) -> List[ZipEntry]:
+    """Parse the raw central directory bytes that start at absolute offset cd_offset."""
+    records, pos = [], 0
+    while pos + CD_SIZE <= len(data) and data[pos:pos + 4] == CD_SIGNATURE:
+        centdir = struct.unpack(CD_STRUCT, data[pos:pos + CD_SIZE])
+        name_len, extra_len, comment_len = centdir[12], centdir[13], centdir[14]
+        raw_name = data[pos + CD_SIZE:pos + CD_SIZE + name_len]
+        filename = raw_name.decode("utf-8" if centdir[5] & 0x800 else "cp437")
+        records.append((filename, centdir[18], centdir[6], centdir[10], centdir[11], centdir[9]))
+        pos += CD_SIZE + name_len + extra_len + comment_len
+
+    records.sort(key=lambda x: x[1])
+    ends = [x[1] for x in records[1:]] + [cd_offset]
+    return [
+        ZipEntry(name, offset, end, compress_type, compress_size, file_size, crc)
+        for (name, offset, compress_type, compress_size, file_size, crc), end in zip(records, ends)
+    ]
+
+
+def read_member(raw: bytes, entry: ZipEntry) -> bytes:
+    """Decompress entry from raw, the archive bytes starting at entry.header_offset."""
+    header = struct.unpack(LOCAL_HEADER_STRUCT, raw[:LOCAL_HEADER_SIZE])
+    data_start = LOCAL_HEADER_SIZE + header[10] + header[11]
+    compressed = raw[data_start:data_start + entry.compress_size]
+    if entry.compress_type == zipfile.ZIP_STORED:
+        data = compressed
+    elif entry.compress_type == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(compressed, -15)
+    else:
+        raise NotImplementedError(f"Unsupported compression method {entry.compress_type} for {entry.filename}")
+    if zlib.crc32(data) != entry.crc:
+        raise zipfile.BadZipFile(f"Bad CRC-32 for member {entry.filename}")
+    return data
+
+
+class StreamingZipExtractor:
+    """
+    Extracts members of a zip archive while the archive itself is still being downloaded.
+
+    The download engine reports every byte range that lands on disk through ``chunk_done``.
+    Once the central directory at the tail of the archive is available the member table is
+    read, and every member whose bytes are complete is handed to a thread pool that
+    decompresses and writes it into ``target_dir``. ``complete`` is called when the whole
+    archive is on disk; it extracts whatever is left and waits for the pool to drain. Use the
+    extractor as a context manager so the pool and the archive are released when the download
+    fails before ``complete`` runs.
+    """
+
+    def __init__(self, target_dir: str, max_workers: int = 8):
+        self.target_dir = target_dir
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._ranges: List[List[int]] = []  # sorted, merged [start, end) ranges on disk
+        self._zip_file: zipfile.ZipFile = None
+        self._size: int = None
+        self._cd_offset: int = None
+        self._members: List[zipfile.ZipInfo] = []
+        self._member_ranges: Dict[str, tuple] = {}
+        self._pending: Set[str] = set()
+        self._futures = []
+        self._executor: ThreadPoolExecutor = None
+        self._closed = False
+        self.extracted = 0
+
+    def __enter__(self) -> "StreamingZipExtractor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def chunk_done(self, path: str, start: int, end: int, size: int) -> None:
+        """Record that bytes [start, end) of the archive at path are on disk."""
+        with self._lock:
+            if self._closed:
+                return
+            self._add_range(start, end)
+            self._size = size
+            if self._zip_file is None and not self._open_if_ready(path):
+                return
+            self._submit_ready()
+
+    def complete(self, path: str) -> int:
+        """Extract everything still pending once the full archive is on disk at path."""
+        try:
+            with self._lock:
+                self._size = os.path.getsize(path)
+                self._ranges = [[0, self._size]]
+                if self._zip_file is None:
+                    self._open(path)
+                self._submit_ready()
+            for future in self._futures:
+                future.result()  # re-raise the first failed member
+            logging.info(f"Extracted {self.extracted} members into {self.target_dir}")
+            return self.extracted
+
+        except Exception as e:
+            raise objException(e, sys) from e
+
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Cancel the members not started yet, wait for the running ones and close the archive."""
+        with self._lock:
+            self._closed = True
+        for future in self._futures:
+            future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self._zip_file is not None:
+            self._zip_file.close()
+
+    def extract_all(self, zip_file_path: str) -> int:
+        """Extract an archive that is already fully on disk using the same worker pool."""
+        return self.complete(zip_file_path)
+
+    def _add_range(self, start: int, end: int) -> None:
+        merged = []
+        for s, e in sorted(self._ranges + [[start, end]]):
+            if merged and s <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        self._ranges = merged
+
+    def _is_available(self, start: int, end: int) -> bool:
+        return any(s <= start and end <= e for s, e in self._ranges)
+
+    def _open_if_ready(self, path: str) -> bool:
+        tail_start = max(0, self._size - EOCD_SEARCH_SIZE)
+        if self._cd_offset is None:
+            if not self._is_available(tail_start, self._size):
+                return False
+            with open(path, "rb") as f:
+                f.seek(tail_start)
+                tail = f.read()
+            location = locate_central_directory(tail, tail_start)
+            # ZIP64 archives store the real offset elsewhere; wait for the whole file instead
+            self._cd_offset = location[0] if location is not None else 0
+        if not self._is_available(self._cd_offset, self._size):
+            return False
+        self._open(path)
+        return True
+
+    def _open(self, path: str) -> None:
+        self._zip_file = zipfile.ZipFile(path, "r")
+        self._members = sorted(self._zip_file.infolist(), key=lambda x: x.header_offset)
+        boundaries = [m.header_offset for m in self._members[1:]]
+        boundaries.append(self._cd_offset if self._cd_offset else self._size)
+        for member, end in zip(self._members, boundaries):
+            self._member_ranges[member.filename] = (member.header_offset, end)
+        self._pending = {m.filename for m in self._members}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.max_workers))
+        logging.info(f"Read zip central directory: {len(self._members)} members")
+
+    def _submit_ready(self) -> None:
+        for member in self._members:
+            if member.filename not in self._pending:
+                continue
+            if not self._is_available(*self._member_ranges[member.filename]):
+                continue
+            self._pending.discard(member.filename)
+            if member.is_dir():
+                os.makedirs(os.path.join(self.target_dir, member.filename), exist_ok=True)
+                continue
+            # directories are created up front so pool workers never race on makedirs
+            os.makedirs(os.path.dirname(os.path.join(self.target_dir, member.filename)), exist_ok=True)
+            self._futures.append(self._executor.submit(self._extract_member, member))
+
+    def _extract_member(self, member: zipfile.ZipInfo) -> None:
+        self._zip_file.extract(member, self.target_dir)
+        with self._lock:
+            self.extracted += 1
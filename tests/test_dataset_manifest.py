@@ -0,0 +1,23 @@
+from object.utils.dataset_manifest import attach_label_hashes, diff_manifests, label_path_for, verify_local_files
+
+
+def test_manifest_diff(tmp_path):
+    files = {
+        "train/images/a.jpg": {"size": 10, "hash": "ia"},
+        "train/labels/a.txt": {"size": 5, "hash": "la"},
+        "train/images/b.png": {"size": 12, "hash": "ib"},
+    }
+    attach_label_hashes(files)
+    assert files["train/images/a.jpg"]["label_hash"] == "la" and files["train/images/b.png"]["label_hash"] is None
+    assert label_path_for("train/images/x.y.jpg") == "train/labels/x.y.txt"
+
+    remote = dict(files)
+    remote["train/labels/a.txt"] = {"size": 5, "hash": "changed"}
+    remote["valid/images/c.jpg"] = {"size": 1, "hash": "ic"}
+    del remote["train/images/b.png"]
+    assert diff_manifests(files, remote) == (["train/labels/a.txt", "valid/images/c.jpg"], ["train/images/b.png"])
+
+    (tmp_path / "train" / "images").mkdir(parents=True)
+    (tmp_path / "train" / "images" / "a.jpg").write_bytes(b"0" * 10)
+    (tmp_path / "train" / "images" / "b.png").write_bytes(b"0" * 11)  # size differs from the manifest
+    assert list(verify_local_files(str(tmp_path), files)) == ["train/images/a.jpg"]
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+Image = pytest.importorskip("PIL.Image")
+
+from object.components.data_validation import DataValidation
+from object.entity.artifacts_entity import DataIngestionArtifact
+from object.entity.config_entity import DataValidationConfig
+from object.utils.dataset_validation import validate_split
+
+LABELS = {
+    "ok": "0 0.5 0.5 0.2 0.2\n1 0.3 0.3 0.1 0.1\n",
+    "negative": "0 0.5 0.5 0.2 0.2\n-1 0.5 0.5 0.1 0.1\n",
+    "too_large": "7 0.5 0.5 0.2 0.2\n",
+    "out_of_bounds": "0 0.5 0.5 1.2 0.2\n",
+    "duplicate": "0 0.5 0.5 0.2 0.2\n0 0.5 0.5 0.2 0.2\n",
+    "columns": "0 0.5 0.5 0.2\n",
+    "empty": "",
+}
+
+
+def make_split(split_dir, labels=LABELS, missing=("unlabeled",), tiny=("tiny",)):
+    (split_dir / "images").mkdir(parents=True)
+    (split_dir / "labels").mkdir()
+    for name in [*labels, *missing, *tiny]:
+        size = (4, 4) if name in tiny else (32, 24)
+        Image.new("RGB", size).save(split_dir / "images" / f"{name}.jpg")
+    for name, text in labels.items():
+        (split_dir / "labels" / f"{name}.txt").write_text(text)
+
+
+def test_validate_split(tmp_path):
+    make_split(tmp_path / "train")
+    rows = {r["image"]: r for r in validate_split(str(tmp_path / "train"), nc=3, workers=1)}
+
+    assert {k: v["label_error"] for k, v in rows.items() if v["corrupt"]} == {
+        "train/images/negative.jpg": "negative class id",
+        "train/images/too_large.jpg": "class id >= nc (3)",
+        "train/images/out_of_bounds.jpg": "non-normalized or out of bounds coordinate labels",
+        "train/images/duplicate.jpg": "duplicate labels",
+        "train/images/columns.jpg": "labels require 5 columns each (or a polygon) of numbers",
+        "train/images/tiny.jpg": "",
+    }
+    assert rows["train/images/tiny.jpg"]["image_error"] == "image size (4, 4) <10 pixels"
+    assert rows["train/images/ok.jpg"]["label_status"] == "ok" and rows["train/images/ok.jpg"]["boxes"] == 2
+    assert rows["train/images/ok.jpg"]["format"] == "jpeg" and rows["train/images/ok.jpg"]["width"] == 32
+    assert rows["train/images/empty.jpg"]["label_status"] == "empty" and not rows["train/images/empty.jpg"]["corrupt"]
+    assert rows["train/images/unlabeled.jpg"]["label_status"] == "missing"
+    assert not rows["train/images/unlabeled.jpg"]["corrupt"]
+
+
+def test_validate_split_without_nc(tmp_path):
+    labels = {"ok": LABELS["ok"], "huge": "100000 0.5 0.5 0.2 0.2\n"}
+    make_split(tmp_path / "train", labels=labels, missing=(), tiny=())
+    rows = {r["image"]: r for r in validate_split(str(tmp_path / "train"), workers=1)}
+    assert rows["train/images/huge.jpg"]["label_error"] == "class id > 65535"
+    assert not rows["train/images/ok.jpg"]["corrupt"]
+
+
+def test_data_validation_excludes_negative_class(tmp_path):
+    # a -1 class row is reported and excluded instead of aborting the stage
+    feature_store = tmp_path / "feature_store"
+    labels = {"ok": LABELS["ok"], "negative": LABELS["negative"]}
+    make_split(feature_store / "train", labels=labels, missing=(), tiny=())
+    make_split(feature_store / "valid", labels={"ok": LABELS["ok"]}, missing=(), tiny=())
+    out = tmp_path / "data_validation"
+    config = DataValidationConfig(
+        data_validation_dir=str(out), valid_status_file_dir=str(out / "status.txt"),
+        report_file_path=str(out / "report.parquet"), summary_file_path=str(out / "summary.json"),
+        excluded_file_path=str(out / "excluded_samples.txt"), max_workers=1, max_corrupt_fraction=0.5,
+    )
+    artifact = DataValidation(DataIngestionArtifact(None, str(feature_store)), config).initiate_data_validation()
+
+    assert (out / "excluded_samples.txt").read_text() == "train/images/negative.jpg\n"
+    summary = json.loads((out / "summary.json").read_text())
+    assert summary["samples"] == 3 and summary["corrupt"] == 1 and summary["passed"]
+    assert summary["errors"] == {"negative class id": 1}
+    assert artifact.validation_status and artifact.excluded_file_path == str(out / "excluded_samples.txt")
@@ -0,0 +1,44 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from object.utils.label_index import LABEL_OK, LABEL_UNPARSEABLE, LabelIndex, build_label_index
+
+
+def write_labels(label_dir, labels):
+    label_dir.mkdir(parents=True, exist_ok=True)
+    for name, text in labels.items():
+        (label_dir / name).write_text(text)
+    return str(label_dir)
+
+
+def test_build_label_index(tmp_path):
+    label_dir = write_labels(tmp_path / "labels", {
+        "a.txt": "0 0.5 0.5 0.2 0.4\n2 0.5 0.5 0.1 0.1\n",
+        "b.txt": "",
+        "c.txt": "1 0.5 0.5 0.1\n",
+        "d.txt": "2 0.5 0.5 0.3 0.3\n",
+    })
+    index = build_label_index(label_dir, workers=1, chunk_size=2)
+    assert index.files == ["a.txt", "b.txt", "c.txt", "d.txt"]
+    assert index.flags.tolist() == [LABEL_OK, LABEL_OK, LABEL_UNPARSEABLE, LABEL_OK]
+    assert index.offsets.tolist() == [0, 2, 2, 2, 3]
+    assert index.nc == 3 and index.class_counts.tolist() == [1, 0, 2]
+    assert index.box_stats()[2] == pytest.approx(
+        {"count": 2, "mean_w": 0.2, "mean_h": 0.2, "min_w": 0.1, "min_h": 0.1, "max_w": 0.3, "max_h": 0.3})
+
+    loaded = LabelIndex.load(label_dir)
+    assert loaded.files == index.files and np.array_equal(loaded.labels, index.labels)
+
+
+@pytest.mark.parametrize("bad_class", ["-1", "1.5", "1e9", "nan"])
+def test_invalid_class_ids(tmp_path, bad_class):
+    # a single bad row must not crash the index, nor size nc and the statistics by its class id
+    label_dir = write_labels(tmp_path / "labels", {
+        "a.txt": "0 0.5 0.5 0.1 0.1\n",
+        "b.txt": f"{bad_class} 0.5 0.5 0.1 0.1\n",
+    })
+    index = build_label_index(label_dir, workers=1)
+    assert len(index.labels) == 2 and index.valid_rows.tolist() == [True, False]  # the bad row is kept
+    assert index.nc == 1 and index.class_counts.tolist() == [1]
+    assert list(index.box_stats()) == [0] and index.box_stats()[0]["count"] == 1
@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "yolov7"))
+import utils.general  # noqa: E402, F401  (utils.metrics and utils.general import each other)
+from utils.metrics import ap_per_class, compute_ap  # noqa: E402
+
+
+def compute_ap_reference(recall, precision, v5_metric=False):
+    # compute_ap() of a single curve before it took all IoU columns at once
+    if v5_metric:
+        mrec = np.concatenate(([0.], recall, [1.0]))
+    else:
+        mrec = np.concatenate(([0.], recall, [recall[-1] + 0.01]))
+    mpre = np.concatenate(([1.], precision, [0.]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return np.trapz(np.interp(x, mrec, mpre), x), mpre, mrec
+
+
+def curves(rng, n, niou=10):
+    tp = np.logical_and.accumulate(rng.random((n, niou)) < np.linspace(0.9, 0.3, niou), 1)
+    tpc, fpc = tp.cumsum(0), (1 - tp).cumsum(0)
+    return tpc / (tpc[-1].max() + rng.integers(0, 10)), tpc / (tpc + fpc)
+
+
+@pytest.mark.parametrize("v5_metric", [False, True])
+def test_compute_ap_columns(v5_metric):
+    rng = np.random.default_rng(0)
+    for n in (1, 2, 10, 500, 5000):
+        recall, precision = curves(rng, n)
+        ap, mpre, mrec = compute_ap(recall, precision, v5_metric=v5_metric)
+        assert ap.shape == (10,) and mpre.shape == mrec.shape == (n + 2, 10)
+        for j in range(10):
+            ap_j, mpre_j, mrec_j = compute_ap_reference(recall[:, j], precision[:, j], v5_metric=v5_metric)
+            assert ap[j] == ap_j
+            assert np.array_equal(mpre[:, j], mpre_j) and np.array_equal(mrec[:, j], mrec_j)
+
+        ap_1d, mpre_1d, mrec_1d = compute_ap(recall[:, 0], precision[:, 0], v5_metric=v5_metric)  # a single curve
+        assert ap_1d == ap[0] and np.array_equal(mpre_1d, mpre[:, 0]) and np.array_equal(mrec_1d, mrec[:, 0])
+
+
+def test_ap_per_class():
+    rng = np.random.default_rng(1)
+    n, nc = 3000, 4
+    conf = np.round(rng.random(n), 3)  # with ties
+    pred_cls = rng.integers(0, nc + 1, n).astype(np.float64)  # class nc has no labels
+    tp = np.logical_and.accumulate((rng.random((n, 1)) < conf[:, None]) & (rng.random((n, 10)) < 0.8), 1)
+    target_cls = np.concatenate((pred_cls[tp[:, 0]], rng.integers(0, nc, 200))).astype(np.float64)
+
+    ap = ap_per_class(tp, conf, pred_cls, target_cls)[2]
+    i = np.argsort(-conf)
+    tp, conf, pred_cls = tp[i], conf[i], pred_cls[i]
+    for ci, c in enumerate(np.unique(target_cls)):
+        k = pred_cls == c
+        tpc, fpc = tp[k].cumsum(0), (1 - tp[k]).cumsum(0)
+        recall, precision = tpc / ((target_cls == c).sum() + 1e-16), tpc / (tpc + fpc)
+        for j in range(10):
+            assert ap[ci, j] == compute_ap_reference(recall[:, j], precision[:, j])[0]
@@ -0,0 +1,118 @@
+import json
+import os
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+from object.configuration import s3_operations
+from object.configuration.s3_operations import S3Operation
+
+BUCKET = "test-bucket"
+CHUNK_SIZE = 1024
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    # a fresh shared client inside moto's in-process S3 stand-in
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.delenv("S3_ENDPOINT_URL", raising=False)
+    with moto.mock_aws():
+        monkeypatch.setattr(s3_operations, "_s3_session", None)
+        monkeypatch.setattr(s3_operations, "_s3_client", None)
+        monkeypatch.setattr(s3_operations, "_s3_local", s3_operations.threading.local())
+        s3 = S3Operation()
+        s3.s3_client.create_bucket(Bucket=BUCKET)
+        yield s3
+
+
+def put(s3, key, data):
+    s3.s3_client.put_object(Bucket=BUCKET, Key=key, Body=data)
+    return s3.get_object_metadata(key, BUCKET)["etag"]
+
+
+def test_download_object_chunked(s3, tmp_path):
+    data = os.urandom(5 * CHUNK_SIZE + 123)
+    put(s3, "data.zip", data)
+    filename = str(tmp_path / "data.zip")
+
+    stats = s3.download_object_chunked("data.zip", BUCKET, filename, max_concurrency=4, chunk_size=CHUNK_SIZE)
+    assert open(filename, "rb").read() == data
+    assert stats["downloaded"] == len(data) and not stats["cache_hit"]
+    assert not os.path.exists(filename + ".part") and not os.path.exists(filename + ".part.json")
+
+
+def test_download_object_chunked_resume(s3, tmp_path):
+    data = os.urandom(4 * CHUNK_SIZE)
+    etag = put(s3, "data.zip", data)
+    filename = str(tmp_path / "data.zip")
+
+    # an interrupted download with chunks 0 and 2 on disk
+    part = bytearray(len(data))
+    for i in (0, 2):
+        part[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE] = data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE]
+    with open(filename + ".part", "wb") as f:
+        f.write(part)
+    with open(filename + ".part.json", "w") as f:
+        json.dump({"etag": etag, "chunk_size": CHUNK_SIZE, "done": [0, 2]}, f)
+
+    stats = s3.download_object_chunked("data.zip", BUCKET, filename, chunk_size=CHUNK_SIZE)
+    assert open(filename, "rb").read() == data
+    assert stats["downloaded"] == 2 * CHUNK_SIZE
+
+
+def test_download_object_chunked_stale_sidecar(s3, tmp_path):
+    data = os.urandom(2 * CHUNK_SIZE)
+    put(s3, "data.zip", data)
+    filename = str(tmp_path / "data.zip")
+    with open(filename + ".part", "wb") as f:
+        f.write(bytes(len(data)))
+    with open(filename + ".part.json", "w") as f:
+        json.dump({"etag": "outdated", "chunk_size": CHUNK_SIZE, "done": [0]}, f)
+
+    stats = s3.download_object_chunked("data.zip", BUCKET, filename, chunk_size=CHUNK_SIZE)
+    assert open(filename, "rb").read() == data
+    assert stats["downloaded"] == len(data)
+
+
+def test_download_object_chunked_etag_cache(s3, tmp_path):
+    data = os.urandom(3 * CHUNK_SIZE)
+    put(s3, "data.zip", data)
+    cache_dir = str(tmp_path / "cache")
+
+    first = s3.download_object_chunked("data.zip", BUCKET, str(tmp_path / "a.zip"), chunk_size=CHUNK_SIZE,
+                                       cache_dir=cache_dir)
+    second = s3.download_object_chunked("data.zip", BUCKET, str(tmp_path / "b.zip"), chunk_size=CHUNK_SIZE,
+                                        cache_dir=cache_dir)
+    assert not first["cache_hit"] and second["cache_hit"] and second["downloaded"] == 0
+    assert open(tmp_path / "b.zip", "rb").read() == data
+
+    put(s3, "data.zip", data[::-1])  # new ETag: not served from the cache
+    third = s3.download_object_chunked("data.zip", BUCKET, str(tmp_path / "c.zip"), chunk_size=CHUNK_SIZE,
+                                       cache_dir=cache_dir)
+    assert not third["cache_hit"] and open(tmp_path / "c.zip", "rb").read() == data[::-1]
+
+
+def test_get_and_put_objects(s3, tmp_path):
+    path = tmp_path / "c.txt"
+    path.write_bytes(b"from a file")
+    s3.put_objects({"a.txt": b"a", "b.txt": b"b" * 100, "c.txt": str(path)}, BUCKET, max_concurrency=2)
+
+    objects = s3.get_objects(["a.txt", "b.txt", "c.txt"], BUCKET)
+    assert objects == {"a.txt": b"a", "b.txt": b"b" * 100, "c.txt": b"from a file"}
+    assert S3Operation().s3_client is s3.s3_client  # every instance shares the pooled client
+
+
+def test_upload_file_if_changed(s3, tmp_path):
+    path = tmp_path / "best.pt"
+    path.write_bytes(os.urandom(3 * CHUNK_SIZE))
+
+    assert s3.upload_file_if_changed(str(path), "model/best.pt", BUCKET)
+    assert not s3.upload_file_if_changed(str(path), "model/best.pt", BUCKET)  # same sha256: skipped
+
+    path.write_bytes(os.urandom(3 * CHUNK_SIZE))
+    assert s3.upload_file_if_changed(str(path), "model/best.pt", BUCKET)
+    body = s3.s3_client.get_object(Bucket=BUCKET, Key="model/best.pt")["Body"].read()
+    assert body == path.read_bytes()
@@ -0,0 +1,47 @@
+import os
+import zipfile
+
+import pytest
+
+from object.utils.zip_extractor import StreamingZipExtractor
+
+CHUNK_SIZE = 1 << 16  # the central directory lookup needs the last 64 kB
+
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return os.path.getsize(path)
+
+
+def feed(extractor, path, size, chunks):
+    # report chunks the way the download engine does, tail first
+    for i in chunks:
+        extractor.chunk_done(str(path), i * CHUNK_SIZE, min(size, (i + 1) * CHUNK_SIZE), size)
+
+
+def test_streaming_extract(tmp_path):
+    members = {f"train/images/{i}.jpg": os.urandom(30000) for i in range(16)}
+    size = make_zip(tmp_path / "data.zip", members)
+    n = -(-size // CHUNK_SIZE)
+
+    extractor = StreamingZipExtractor(str(tmp_path / "out"), max_workers=2)
+    feed(extractor, tmp_path / "data.zip", size, [n - 2, n - 1, *range(n - 2)])
+    assert extractor.complete(str(tmp_path / "data.zip")) == len(members)
+    for name, data in members.items():
+        assert (tmp_path / "out" / name).read_bytes() == data
+
+
+def test_close_on_failed_download(tmp_path):
+    members = {f"train/images/{i}.jpg": os.urandom(30000) for i in range(16)}
+    size = make_zip(tmp_path / "data.zip", members)
+    n = -(-size // CHUNK_SIZE)
+
+    with pytest.raises(ConnectionError), StreamingZipExtractor(str(tmp_path / "out"), max_workers=2) as extractor:
+        feed(extractor, tmp_path / "data.zip", size, [n - 2, n - 1, 0, 1])
+        raise ConnectionError("download failed")
+    assert extractor._executor._shutdown and extractor._zip_file.fp is None
+    extracted = extractor.extracted
+    feed(extractor, tmp_path / "data.zip", size, range(2, n - 2))  # late chunks are ignored
+    assert extractor.extracted == extracted < len(members)
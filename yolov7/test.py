@@ -13,16 +13,39 @@ from models.experimental import attempt_load
 from utils.datasets import create_dataloader
 from utils.general import coco80_to_coco91_class, check_dataset, check_file, check_img_size, check_requirements, \
     box_iou, non_max_suppression, scale_coords, xyxy2xywh, xywh2xyxy, set_logging, increment_path, colorstr
-from utils.metrics import ap_per_class, ConfusionMatrix
+from utils.metrics import ap_per_class, APHistogram, ConfusionMatrix
 from utils.plots import plot_images, output_to_target, plot_study_txt
 from utils.torch_utils import select_device, time_synchronized, TracedModel
 
 
+def match_predictions(detections, labels, iouv):
+    """Matches predictions to targets of one image: every prediction is compared to the target of its class it has the
+    highest IoU with, and each target is detected by the first (highest confidence) prediction doing so above iouv[0]
+
+    Arguments:
+        detections (Array[N, 6]), x1, y1, x2, y2, conf, class
+        labels (Array[M, 5]), class, x1, y1, x2, y2
+    Returns:
+        correct (Array[N, len(iouv)]), True where a prediction detects its target above each IoU threshold
+    """
+    n = detections.shape[0]
+    iou = box_iou(detections[:, :4], labels[:, 1:]) * (detections[:, 5:6] == labels[:, 0])  # same class ious only
+    ious, i = iou.max(1)  # best ious, target indices
+    pi = (ious > iouv[0]).nonzero(as_tuple=False).view(-1)  # prediction indices
+    key = (i[pi] * n + pi).sort()[0]  # by target, then by prediction
+    first = torch.ones_like(key, dtype=torch.bool)
+    first[1:] = key[1:] // n != key[:-1] // n  # first prediction of every detected target
+    pi = key[first] % n
+    correct = torch.zeros(n, iouv.numel(), dtype=torch.bool, device=iouv.device)
+    correct[pi] = ious[pi, None] > iouv  # iou_thres is 1xn
+    return correct
+
+
 def test(data,
          weights=None,
          batch_size=32,
          imgsz=640,
-         conf_thres=0.001,
+         conf_thres=0.001,  # or per-class thresholds
          iou_thres=0.6,  # for NMS
          save_json=False,
          single_cls=False,
@@ -40,7 +63,10 @@ def test(data,
          half_precision=True,
          trace=False,
          is_coco=False,
-         v5_metric=False):
+         v5_metric=False,
+         max_candidates=0,  # candidates per image kept before NMS, 0 all
+         max_class_candidates=0,  # candidates per image and class kept before NMS, 0 all
+         ap_bins=0):  # confidence bins of streaming AP evaluation, 0 exact ap_per_class()
     # Initialize/load model and set device
     training = model is not None
     if training:  # called by train.py
@@ -75,6 +101,8 @@ def test(data,
             data = yaml.load(f, Loader=yaml.SafeLoader)
     check_dataset(data)  # check
     nc = 1 if single_cls else int(data['nc'])  # number of classes
+    assert not isinstance(conf_thres, (list, tuple)) or len(conf_thres) == nc, \
+        f'{len(conf_thres)} per-class confidence thresholds for {nc} classes'
     iouv = torch.linspace(0.5, 0.95, 10).to(device)  # iou vector for mAP@0.5:0.95
     niou = iouv.numel()
 
@@ -101,6 +129,8 @@ def test(data,
     p, r, f1, mp, mr, map50, map, t0, t1 = 0., 0., 0., 0., 0., 0., 0., 0., 0.
     loss = torch.zeros(3, device=device)
     jdict, stats, ap, ap_class, wandb_images = [], [], [], [], []
+    ap_hist = APHistogram(nc, niou, ap_bins) if ap_bins else None  # streaming evaluation
+    record = stats.append if ap_hist is None else lambda x: ap_hist.update(*x)  # image statistics
     for batch_i, (img, targets, paths, shapes) in enumerate(tqdm(dataloader, desc=s)):
         img = img.to(device, non_blocking=True)
         img = img.half() if half else img.float()  # uint8 to fp16/32
@@ -122,7 +152,9 @@ def test(data,
             targets[:, 2:] *= torch.Tensor([width, height, width, height]).to(device)  # to pixels
             lb = [targets[targets[:, 0] == i, 1:] for i in range(nb)] if save_hybrid else []  # for autolabelling
             t = time_synchronized()
-            out = non_max_suppression(out, conf_thres=conf_thres, iou_thres=iou_thres, labels=lb, multi_label=True)
+            out = non_max_suppression(out, conf_thres=conf_thres, iou_thres=iou_thres, labels=lb, multi_label=True,
+                                      batched=True, max_candidates=max_candidates,
+                                      max_class_candidates=max_class_candidates)
             t1 += time_synchronized() - t
 
         # Statistics per image
@@ -135,7 +167,7 @@ def test(data,
 
             if len(pred) == 0:
                 if nl:
-                    stats.append((torch.zeros(0, niou, dtype=torch.bool), torch.Tensor(), torch.Tensor(), tcls))
+                    record((torch.zeros(0, niou, dtype=torch.bool), torch.Tensor(), torch.Tensor(), tcls))
                 continue
 
             # Predictions
@@ -178,38 +210,16 @@ def test(data,
             # Assign all predictions as incorrect
             correct = torch.zeros(pred.shape[0], niou, dtype=torch.bool, device=device)
             if nl:
-                detected = []  # target indices
-                tcls_tensor = labels[:, 0]
-
                 # target boxes
                 tbox = xywh2xyxy(labels[:, 1:5])
                 scale_coords(img[si].shape[1:], tbox, shapes[si][0], shapes[si][1])  # native-space labels
+                labelsn = torch.cat((labels[:, 0:1], tbox), 1)  # native-space labels
                 if plots:
-                    confusion_matrix.process_batch(predn, torch.cat((labels[:, 0:1], tbox), 1))
-
-                # Per target class
-                for cls in torch.unique(tcls_tensor):
-                    ti = (cls == tcls_tensor).nonzero(as_tuple=False).view(-1)  # prediction indices
-                    pi = (cls == pred[:, 5]).nonzero(as_tuple=False).view(-1)  # target indices
-
-                    # Search for detections
-                    if pi.shape[0]:
-                        # Prediction to target ious
-                        ious, i = box_iou(predn[pi, :4], tbox[ti]).max(1)  # best ious, indices
-
-                        # Append detections
-                        detected_set = set()
-                        for j in (ious > iouv[0]).nonzero(as_tuple=False):
-                            d = ti[i[j]]  # detected target
-                            if d.item() not in detected_set:
-                                detected_set.add(d.item())
-                                detected.append(d)
-                                correct[pi[j]] = ious[j] > iouv  # iou_thres is 1xn
-                                if len(detected) == nl:  # all targets already located in image
-                                    break
+                    confusion_matrix.process_batch(predn, labelsn)
+                correct = match_predictions(predn, labelsn, iouv)
 
             # Append statistics (correct, conf, pcls, tcls)
-            stats.append((correct.cpu(), pred[:, 4].cpu(), pred[:, 5].cpu(), tcls))
+            record((correct.cpu(), pred[:, 4].cpu(), pred[:, 5].cpu(), tcls))
 
         # Plot images
         if plots and batch_i < 3:
@@ -220,20 +230,24 @@ def test(data,
 
     # Compute statistics
     stats = [np.concatenate(x, 0) for x in zip(*stats)]  # to numpy
-    if len(stats) and stats[0].any():
+    if ap_hist is not None and ap_hist.tp.any():  # from the confidence histograms
+        p, r, ap, f1, ap_class = ap_hist.ap_per_class(plot=plots, v5_metric=v5_metric, save_dir=save_dir, names=names)
+        nt = ap_hist.nt  # number of targets per class
+    elif len(stats) and stats[0].any():
         p, r, ap, f1, ap_class = ap_per_class(*stats, plot=plots, v5_metric=v5_metric, save_dir=save_dir, names=names)
-        ap50, ap = ap[:, 0], ap.mean(1)  # AP@0.5, AP@0.5:0.95
-        mp, mr, map50, map = p.mean(), r.mean(), ap50.mean(), ap.mean()
         nt = np.bincount(stats[3].astype(np.int64), minlength=nc)  # number of targets per class
     else:
         nt = torch.zeros(1)
+    if len(ap_class):
+        ap50, ap = ap[:, 0], ap.mean(1)  # AP@0.5, AP@0.5:0.95
+        mp, mr, map50, map = p.mean(), r.mean(), ap50.mean(), ap.mean()
 
     # Print results
     pf = '%20s' + '%12i' * 2 + '%12.3g' * 4  # print format
     print(pf % ('all', seen, nt.sum(), mp, mr, map50, map))
 
     # Print results per class
-    if (verbose or (nc < 50 and not training)) and nc > 1 and len(stats):
+    if (verbose or (nc < 50 and not training)) and nc > 1 and len(ap_class):
         for i, c in enumerate(ap_class):
             print(pf % (names[c], seen, nt[c], p[i], r[i], ap50[i], ap[i]))
 
@@ -295,6 +309,9 @@ if __name__ == '__main__':
     parser.add_argument('--img-size', type=int, default=640, help='inference size (pixels)')
     parser.add_argument('--conf-thres', type=float, default=0.001, help='object confidence threshold')
     parser.add_argument('--iou-thres', type=float, default=0.65, help='IOU threshold for NMS')
+    parser.add_argument('--class-conf-thres', nargs='+', type=float, help='per-class confidence thresholds')
+    parser.add_argument('--max-candidates', type=int, default=0, help='top candidates per image pre-NMS, 0 all')
+    parser.add_argument('--max-class-candidates', type=int, default=0, help='top candidates per class pre-NMS, 0 all')
     parser.add_argument('--task', default='val', help='train, val, test, speed or study')
     parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--single-cls', action='store_true', help='treat as single-class dataset')
@@ -309,6 +326,7 @@ if __name__ == '__main__':
     parser.add_argument('--exist-ok', action='store_true', help='existing project/name ok, do not increment')
     parser.add_argument('--no-trace', action='store_true', help='don`t trace model')
     parser.add_argument('--v5-metric', action='store_true', help='assume maximum recall as 1.0 in AP calculation')
+    parser.add_argument('--ap-bins', type=int, default=0, help='confidence bins of streaming AP evaluation, 0 exact')
     opt = parser.parse_args()
     opt.save_json |= opt.data.endswith('coco.yaml')
     opt.data = check_file(opt.data)  # check file
@@ -320,7 +338,7 @@ if __name__ == '__main__':
              opt.weights,
              opt.batch_size,
              opt.img_size,
-             opt.conf_thres,
+             opt.class_conf_thres or opt.conf_thres,
              opt.iou_thres,
              opt.save_json,
              opt.single_cls,
@@ -330,7 +348,10 @@ if __name__ == '__main__':
              save_hybrid=opt.save_hybrid,
              save_conf=opt.save_conf,
              trace=not opt.no_trace,
-             v5_metric=opt.v5_metric
+             v5_metric=opt.v5_metric,
+             max_candidates=opt.max_candidates,
+             max_class_candidates=opt.max_class_candidates,
+             ap_bins=opt.ap_bins
              )
 
     elif opt.task == 'speed':  # speed benchmarks
@@ -345,8 +366,8 @@ if __name__ == '__main__':
             y = []  # y axis
             for i in x:  # img-size
                 print(f'\nRunning {f} point {i}...')
-                r, _, t = test(opt.data, w, opt.batch_size, i, opt.conf_thres, opt.iou_thres, opt.save_json,
-                               plots=False, v5_metric=opt.v5_metric)
+                r, _, t = test(opt.data, w, opt.batch_size, i, opt.class_conf_thres or opt.conf_thres, opt.iou_thres,
+                               opt.save_json, plots=False, v5_metric=opt.v5_metric)
                 y.append(r + t)  # results and times
             np.savetxt(f, y, fmt='%10.4g')  # save
         os.system('zip -r study.zip study_*.txt')
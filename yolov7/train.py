@@ -25,7 +25,7 @@ import test  # import test.py to get mAP after each epoch
 from models.experimental import attempt_load
 from models.yolo import Model
 from utils.autoanchor import check_anchors
-from utils.datasets import create_dataloader
+from utils.datasets import BatchAugment, PrefetchLoader, create_dataloader
 from utils.general import labels_to_class_weights, increment_path, labels_to_image_weights, init_seeds, \
     fitness, strip_optimizer, get_latest_run, check_dataset, check_file, check_git_status, check_img_size, \
     check_requirements, print_mutation, set_logging, one_cycle, colorstr
@@ -38,7 +38,7 @@ from utils.wandb_logging.wandb_utils import WandbLogger, check_wandb_resume
 logger = logging.getLogger(__name__)
 
 
-def train(hyp, opt, device, tb_writer=None):
+def train(hyp, opt, device, tb_writer=None, epoch_callback=None):
     logger.info(colorstr('hyperparameters: ') + ', '.join(f'{k}={v}' for k, v in hyp.items()))
     save_dir, epochs, batch_size, total_batch_size, weights, rank, freeze = \
         Path(opt.save_dir), opt.epochs, opt.batch_size, opt.total_batch_size, opt.weights, opt.global_rank, opt.freeze
@@ -245,7 +245,10 @@ def train(hyp, opt, device, tb_writer=None):
     dataloader, dataset = create_dataloader(train_path, imgsz, batch_size, gs, opt,
                                             hyp=hyp, augment=True, cache=opt.cache_images, rect=opt.rect, rank=rank,
                                             world_size=opt.world_size, workers=opt.workers,
-                                            image_weights=opt.image_weights, quad=opt.quad, prefix=colorstr('train: '))
+                                            image_weights=opt.image_weights, quad=opt.quad, prefix=colorstr('train: '),
+                                            epoch=start_epoch)
+    batch_augment = BatchAugment(hyp) if dataset.batch_augment else None  # HSV, cutout and flips per batch on device
+    dataloader = PrefetchLoader(dataloader, device, opt.prefetch, augment=batch_augment)  # float images on device
     mlc = np.concatenate(dataset.labels, 0)[:, 0].max()  # max label class
     nb = len(dataloader)  # number of batches
     assert mlc < nc, 'Label class %g exceeds nc=%g in %s. Possible class labels are 0-%g' % (mlc, nc, opt.data, nc - 1)
@@ -306,6 +309,7 @@ def train(hyp, opt, device, tb_writer=None):
     torch.save(model, wdir / 'init.pt')
     for epoch in range(start_epoch, epochs):  # epoch ------------------------------------------------------------------
         model.train()
+        t_epoch = time.time()
 
         # Update image weights (optional)
         if opt.image_weights:
@@ -326,7 +330,7 @@ def train(hyp, opt, device, tb_writer=None):
         # dataset.mosaic_border = [b - imgsz, -b]  # height, width borders
 
         mloss = torch.zeros(4, device=device)  # mean losses
-        if rank != -1:
+        if rank != -1 and hasattr(dataloader.sampler, 'set_epoch'):  # BucketBatchSampler: seeded, advances itself
             dataloader.sampler.set_epoch(epoch)
         pbar = enumerate(dataloader)
         logger.info(('\n' + '%10s' * 8) % ('Epoch', 'gpu_mem', 'box', 'obj', 'cls', 'total', 'labels', 'img_size'))
@@ -334,8 +338,7 @@ def train(hyp, opt, device, tb_writer=None):
             pbar = tqdm(pbar, total=nb)  # progress bar
         optimizer.zero_grad()
         for i, (imgs, targets, paths, _) in pbar:  # batch -------------------------------------------------------------
-            ni = i + nb * epoch  # number integrated batches (since train start)
-            imgs = imgs.to(device, non_blocking=True).float() / 255.0  # uint8 to float32, 0-255 to 0.0-1.0
+            ni = i + nb * epoch  # number integrated batches (since train start), imgs float32 0.0-1.0 on device
 
             # Warmup
             if ni <= nw:
@@ -431,6 +434,15 @@ def train(hyp, opt, device, tb_writer=None):
                 f.write(s + '%10.4g' * 7 % results + '\n')  # append metrics, val_loss
             if len(opt.name) and opt.bucket:
                 os.system('gsutil cp %s gs://%s/results/results%s.txt' % (results_file, opt.bucket, opt.name))
+            d = dataloader.stats()  # data-bound when the loop waits for batches, compute-bound when they queue up
+            logger.info(f"Data loading: waited {d['wait']:.1f}s ({d['stall']:.1%} of the epoch) for {d['batches']} "
+                        f"batches, {d['queue_depth']:.1f}/{d['depth']} batches ready on average")
+            if tb_writer:
+                tb_writer.add_scalar('x/data_stall', d['stall'], epoch)
+            c = dataset.image_cache.stats() if dataset.image_cache is not None else {}
+            if 'hit_rate' in c:  # shared RAM cache, hits and misses of all workers and ranks on this node
+                logger.info(f"Image cache: {c['cached']}/{c['images']} images in {c['bytes'] / 1E9:.2f}GB, "
+                            f"{c['hits']} hits, {c['misses']} misses ({c['hit_rate']:.1%} hit rate)")
 
             # Log
             tags = ['train/box_loss', 'train/obj_loss', 'train/cls_loss',  # train loss
@@ -448,6 +460,10 @@ def train(hyp, opt, device, tb_writer=None):
             if fi > best_fitness:
                 best_fitness = fi
             wandb_logger.end_epoch(best_result=best_fitness == fi)
+            if epoch_callback:  # report per-epoch metrics to an in-process caller
+                epoch_callback({'epoch': epoch, 'epochs': epochs, 'epoch_time': time.time() - t_epoch,
+                                'fitness': float(fi), 'best_fitness': float(best_fitness),
+                                **{tag: float(x) for x, tag in zip(list(mloss[:-1]) + list(results) + lr, tags)}})
 
             # Save model
             if (not opt.nosave) or (final_epoch and not opt.evolve):  # if save
@@ -524,7 +540,7 @@ def train(hyp, opt, device, tb_writer=None):
     return results
 
 
-if __name__ == '__main__':
+def parse_opt(args=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--weights', type=str, default='yolo7.pt', help='initial weights path')
     parser.add_argument('--cfg', type=str, default='', help='model.yaml path')
@@ -534,13 +550,19 @@ if __name__ == '__main__':
     parser.add_argument('--batch-size', type=int, default=16, help='total batch size for all GPUs')
     parser.add_argument('--img-size', nargs='+', type=int, default=[640, 640], help='[train, test] image sizes')
     parser.add_argument('--rect', action='store_true', help='rectangular training')
+    parser.add_argument('--rect-bucket', type=int, default=4, help='batches per --rect aspect ratio bucket, 0 fixed')
     parser.add_argument('--resume', nargs='?', const=True, default=False, help='resume most recent training')
     parser.add_argument('--nosave', action='store_true', help='only save final checkpoint')
     parser.add_argument('--notest', action='store_true', help='only test final epoch')
     parser.add_argument('--noautoanchor', action='store_true', help='disable autoanchor check')
     parser.add_argument('--evolve', action='store_true', help='evolve hyperparameters')
     parser.add_argument('--bucket', type=str, default='', help='gsutil bucket')
-    parser.add_argument('--cache-images', action='store_true', help='cache images for faster training')
+    parser.add_argument('--cache-images', nargs='?', const='ram', default=False, choices=['ram', 'disk'],
+                        help='cache images for faster training, in shared memory (ram) or in memory-mapped shards (disk)')
+    parser.add_argument('--cache-codec', default='none', help='disk image cache codec: none, zlib or lz4')
+    parser.add_argument('--decoder', default='cv2', help='image decoder: cv2, cv2-reduced or pil-draft')
+    parser.add_argument('--decode-threads', type=int, default=0, help='threads decoding the images of a mosaic')
+    parser.add_argument('--prefetch', type=int, default=2, help='batches prepared ahead in the background, 0 for none')
     parser.add_argument('--image-weights', action='store_true', help='use weighted image selection for training')
     parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--multi-scale', action='store_true', help='vary img-size +/- 50%%')
@@ -562,7 +584,11 @@ if __name__ == '__main__':
     parser.add_argument('--artifact_alias', type=str, default="latest", help='version of dataset artifact to be used')
     parser.add_argument('--freeze', nargs='+', type=int, default=[0], help='Freeze layers: backbone of yolov7=50, first3=0 1 2')
     parser.add_argument('--v5-metric', action='store_true', help='assume maximum recall as 1.0 in AP calculation')
-    opt = parser.parse_args()
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
 
     # Set DDP variables
     opt.world_size = int(os.environ['WORLD_SIZE']) if 'WORLD_SIZE' in os.environ else 1
@@ -0,0 +1,271 @@
+# CPU microbenchmarks of data loading and evaluation hot paths
+# Usage (from the yolov7 directory): python -m utils.benchmarks mosaic|warp|decode|batch-augment|nms --img-size 640
+
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+import utils.datasets as datasets
+from utils.datasets import BatchAugment, augment_hsv, copy_paste, letterbox, load_image, load_mosaic, load_mosaic9, \
+    load_warped
+from utils.general import non_max_suppression, xyn2xy, xywhn2xyxy
+from utils.image_cache import resized_shapes
+from utils.image_decode import DECODERS, decode_pool
+
+HYP = {'degrees': 0.0, 'translate': 0.2, 'scale': 0.9, 'shear': 0.0, 'perspective': 0.0, 'copy_paste': 0.0}
+
+
+class SyntheticDataset:
+    # Minimal stand-in for LoadImagesAndLabels with random images and labels; images are kept in memory (cached) or
+    # written as JPEGs to a temporary directory (uncached, decoded on every access). With image_wh all images have
+    # that (w, h) and are smooth with fine grain, compressing and downscaling like photos rather than noise
+    def __init__(self, n=64, img_size=640, boxes=8, cached=True, fused_resize=False, fused_warp=False, image_wh=None,
+                 seed=0):
+        rng = np.random.default_rng(seed)
+        self.img_size, self.augment, self.hyp = img_size, True, HYP
+        self.fused_resize, self.fused_warp = fused_resize, fused_warp
+        self.decoder, self.decode_threads = 'cv2', 0
+        self.mosaic_border = [-img_size // 2, -img_size // 2]
+        self.indices = range(n)
+        wh = rng.integers(img_size // 2, img_size * 2, size=(n, 2)) if image_wh is None else np.tile(image_wh, (n, 1))
+        self.shapes = wh.astype(np.float64)
+        xywh = np.concatenate((rng.uniform(0.2, 0.8, (n * boxes, 2)), rng.uniform(0.05, 0.3, (n * boxes, 2))), 1)
+        cls = rng.integers(0, 5, (n * boxes, 1))
+        labels = np.concatenate((cls, xywh), 1).astype(np.float32)
+        self.labels = np.split(labels, n)
+        self.segments = [[] for _ in range(n)]
+        self.image_cache = None
+        self.tmp = None
+        if image_wh is None:
+            images = [rng.integers(0, 255, (h, w, 3), dtype=np.uint8) for w, h in wh]
+        else:
+            w, h = image_wh
+            grain = rng.normal(0, 4, (h, w, 1))
+            images = [(cv2.resize(rng.uniform(0, 255, (h // 64, w // 64, 3)), (w, h), interpolation=cv2.INTER_CUBIC) +
+                       grain).clip(0, 255).astype(np.uint8) for _ in range(n)]
+        self.imgs = [None] * n
+        if cached:
+            hw0, hw = resized_shapes(self.shapes, img_size)
+            self.imgs = [cv2.resize(im, (int(w), int(h))) for im, (h, w) in zip(images, hw)]
+            self.img_hw0, self.img_hw = [tuple(x) for x in hw0], [tuple(x) for x in hw]
+        else:
+            self.tmp = tempfile.mkdtemp()
+            self.img_files = [str(Path(self.tmp) / f'{i}.jpg') for i in range(n)]
+            for f, im in zip(self.img_files, images):
+                cv2.imwrite(f, im)
+
+    def close(self):
+        if self.tmp:
+            shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def load_mosaic_reference(self, index):
+    # load_mosaic as it was before canvas reuse and batched label transforms, the benchmark baseline
+    labels4, segments4 = [], []
+    s = self.img_size
+    yc, xc = [int(random.uniform(-x, 2 * s + x)) for x in self.mosaic_border]  # mosaic center x, y
+    indices = [index] + random.choices(self.indices, k=3)  # 3 additional image indices
+    for i, index in enumerate(indices):
+        img, _, (h, w) = load_image(self, index)
+        if i == 0:  # top left
+            img4 = np.full((s * 2, s * 2, img.shape[2]), 114, dtype=np.uint8)  # base image with 4 tiles
+            x1a, y1a, x2a, y2a = max(xc - w, 0), max(yc - h, 0), xc, yc
+            x1b, y1b, x2b, y2b = w - (x2a - x1a), h - (y2a - y1a), w, h
+        elif i == 1:  # top right
+            x1a, y1a, x2a, y2a = xc, max(yc - h, 0), min(xc + w, s * 2), yc
+            x1b, y1b, x2b, y2b = 0, h - (y2a - y1a), min(w, x2a - x1a), h
+        elif i == 2:  # bottom left
+            x1a, y1a, x2a, y2a = max(xc - w, 0), yc, xc, min(s * 2, yc + h)
+            x1b, y1b, x2b, y2b = w - (x2a - x1a), 0, w, min(y2a - y1a, h)
+        elif i == 3:  # bottom right
+            x1a, y1a, x2a, y2a = xc, yc, min(xc + w, s * 2), min(s * 2, yc + h)
+            x1b, y1b, x2b, y2b = 0, 0, min(w, x2a - x1a), min(y2a - y1a, h)
+        img4[y1a:y2a, x1a:x2a] = img[y1b:y2b, x1b:x2b]
+        padw, padh = x1a - x1b, y1a - y1b
+        labels, segments = self.labels[index].copy(), self.segments[index].copy()
+        if labels.size:
+            labels[:, 1:] = xywhn2xyxy(labels[:, 1:], w, h, padw, padh)
+            segments = [xyn2xy(x, w, h, padw, padh) for x in segments]
+        labels4.append(labels)
+        segments4.extend(segments)
+    labels4 = np.concatenate(labels4, 0)
+    for x in (labels4[:, 1:], *segments4):
+        np.clip(x, 0, 2 * s, out=x)
+    img4, labels4, segments4 = copy_paste(img4, labels4, segments4, probability=self.hyp['copy_paste'])
+    return datasets.random_perspective(img4, labels4, segments4, degrees=self.hyp['degrees'],
+                              translate=self.hyp['translate'], scale=self.hyp['scale'], shear=self.hyp['shear'],
+                              perspective=self.hyp['perspective'], border=self.mosaic_border)
+
+
+def load_letterboxed(self, index):
+    # Non-mosaic augment path of LoadImagesAndLabels.__getitem__: load_image, letterbox and random_perspective
+    img, _, (h, w) = load_image(self, index)
+    img, ratio, pad = letterbox(img, self.img_size, auto=False, scaleup=self.augment)
+    labels = self.labels[index].copy()
+    labels[:, 1:] = xywhn2xyxy(labels[:, 1:], ratio[0] * w, ratio[1] * h, padw=pad[0], padh=pad[1])
+    return datasets.random_perspective(img, labels, degrees=self.hyp['degrees'], translate=self.hyp['translate'],
+                                       scale=self.hyp['scale'], shear=self.hyp['shear'],
+                                       perspective=self.hyp['perspective'])
+
+
+def samples_per_second(fn, dataset, samples, seed=0):
+    random.seed(seed)
+    fn(dataset, 0)  # warmup
+    t = time.perf_counter()
+    for i in range(samples):
+        fn(dataset, i % len(dataset.indices))
+    return samples / (time.perf_counter() - t)
+
+
+def benchmark_mosaic(img_size=640, samples=200, n=64):
+    # Prints samples/s of the reference and current mosaic loaders, with cached and uncached (JPEG) images
+    results = []
+    dataset = SyntheticDataset(n, img_size, cached=True)
+    random_perspective = datasets.random_perspective
+    try:  # mosaic assembly alone, without the final warp
+        datasets.random_perspective = lambda img, targets=(), *args, **kwargs: (img[:1, :1].copy(), targets)
+        results.append(('assembly (reference), cached', samples_per_second(load_mosaic_reference, dataset, samples)))
+        results.append(('assembly, cached', samples_per_second(load_mosaic, dataset, samples)))
+    finally:
+        datasets.random_perspective = random_perspective
+    results.append(('load_mosaic (reference), cached', samples_per_second(load_mosaic_reference, dataset, samples)))
+    results.append(('load_mosaic, cached', samples_per_second(load_mosaic, dataset, samples)))
+    results.append(('load_mosaic9, cached', samples_per_second(load_mosaic9, dataset, samples)))
+    for fused in False, True:
+        dataset = SyntheticDataset(n, img_size, cached=False, fused_resize=fused)
+        if not fused:
+            results.append(('load_mosaic (reference), jpg',
+                            samples_per_second(load_mosaic_reference, dataset, samples // 4)))
+        results.append((f'load_mosaic{", fused resize" if fused else ""}, jpg',
+                        samples_per_second(load_mosaic, dataset, samples // 4)))
+        dataset.close()
+    return print_results(results)
+
+
+def benchmark_warp(img_size=640, samples=200, n=64):
+    # Prints samples/s of resize + letterbox/mosaic + random_perspective() against the fused single warp (fused_warp)
+    results = []
+    for cached in True, False:
+        suffix, k = ('cached', samples) if cached else ('jpg', samples // 4)
+        for fused in False, True:
+            dataset = SyntheticDataset(n, img_size, cached=cached, fused_warp=fused)
+            warped = (lambda self, index: load_warped(self, index, self.img_size)) if fused else load_letterboxed
+            name = ', fused warp' if fused else ''
+            results.append((f'letterbox{name}, {suffix}', samples_per_second(warped, dataset, k)))
+            results.append((f'load_mosaic{name}, {suffix}', samples_per_second(load_mosaic, dataset, k)))
+            results.append((f'load_mosaic9{name}, {suffix}', samples_per_second(load_mosaic9, dataset, k)))
+            dataset.close()
+    return print_results(results)
+
+
+def benchmark_decode(img_size=640, samples=200, n=16, image_wh=(3840, 2160), threads=4):
+    # Prints images/s of decode_image() (decode and resize to img_size) of 4K JPEGs per decoder, one by one and on a
+    # thread pool, and the difference of the resized images to the full resolution cv2 decode (mean abs, PSNR)
+    dataset = SyntheticDataset(n, img_size, cached=False, image_wh=image_wh)
+    reference = [datasets.decode_image(dataset, i)[0].astype(np.float32) for i in range(n)]
+    load = lambda i: datasets.decode_image(dataset, i % n)[0]
+    rows = []
+    for decoder in DECODERS:
+        dataset.decoder = decoder
+        x = timed(lambda: [load(i) for i in range(n)], max(samples // n, 1)) * n
+        xt = timed(lambda: decode_pool(threads).map(load, range(n)), max(samples // n, 1)) * n
+        e = np.concatenate([(load(i) - r).ravel() for i, r in enumerate(reference)])
+        mse = (e ** 2).mean()
+        rows.append((decoder, x, xt, np.abs(e).mean(), 10 * np.log10(255 ** 2 / mse) if mse else float('inf')))
+    dataset.close()
+    print(f"{'decoder':<16}{'images/s':>12}{f'{threads} threads':>12}{'mean abs':>12}{'PSNR dB':>12}")
+    for name, x, xt, mae, psnr in rows:
+        print(f'{name:<16}{x:>12.1f}{xt:>12.1f}{mae:>12.2f}{psnr:>12.1f}')
+    return rows
+
+
+def benchmark_batch_augment(img_size=640, samples=200, batch_size=16):
+    # Prints samples/s of the per-sample HSV and flip augmentation of __getitem__ against BatchAugment on CPU and CUDA
+    hyp = {'hsv_h': 0.015, 'hsv_s': 0.7, 'hsv_v': 0.4, 'flipud': 0.0, 'fliplr': 0.5}
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 255, (img_size, img_size, 3), dtype=np.uint8) for _ in range(batch_size)]
+    batches = max(samples // batch_size, 1)
+
+    def per_sample():
+        for img in images:
+            augment_hsv(img, hgain=hyp['hsv_h'], sgain=hyp['hsv_s'], vgain=hyp['hsv_v'])
+            if random.random() < hyp['fliplr']:
+                img = np.fliplr(img)
+            np.ascontiguousarray(img[:, :, ::-1].transpose(2, 0, 1))
+
+    results = [('per sample (augment_hsv, flips)', timed(per_sample, batches) * batch_size)]
+    batch_augment = BatchAugment(hyp)
+    targets = torch.zeros((0, 6))
+    for device in ['cpu'] + (['cuda'] if torch.cuda.is_available() else []):
+        img = torch.from_numpy(np.stack(images)[..., ::-1].transpose(0, 3, 1, 2).copy()).to(device)
+        sync = torch.cuda.synchronize if device == 'cuda' else lambda: None
+        results.append((f'BatchAugment, {device}',
+                        timed(lambda: (batch_augment(img, targets), sync()), batches) * batch_size))
+    return print_results(results)
+
+
+def benchmark_nms(img_size=640, samples=200, batch_sizes=(1, 8, 32), candidates=(100, 300, 1000), nc=5, topk=300):
+    # Prints images/s of the per-image and batched non_max_suppression() with test.py settings (conf_thres 0.001,
+    # multi_label) for batches of random predictions with the given number of candidates per image, and of the batched
+    # one keeping the topk candidates of each image
+    rng = torch.Generator().manual_seed(0)
+    anchors = 3 * sum((img_size // s) ** 2 for s in (8, 16, 32))  # P3-P5 outputs
+    print(f"{'batch size':>12}{'candidates':>12}{'per image':>12}{'batched':>12}{f'top-{topk}':>12}")
+    rows = []
+    for bs in batch_sizes:
+        for n in candidates:
+            xy = torch.rand(bs, anchors, 2, generator=rng) * img_size
+            wh = torch.rand(bs, anchors, 2, generator=rng) * img_size / 4 + 2
+            obj = torch.rand(bs, anchors, 1, generator=rng) * (torch.rand(bs, anchors, 1, generator=rng) < n / anchors)
+            prediction = torch.cat((xy, wh, obj, torch.rand(bs, anchors, nc, generator=rng)), 2)
+            batches = max(samples // bs, 1)
+            x = [timed(lambda: non_max_suppression(prediction, 0.001, 0.65, multi_label=True, batched=batched,
+                                                   max_candidates=k), batches) * bs
+                 for batched, k in ((False, 0), (True, 0), (True, topk))]
+            rows.append((bs, n, *x))
+            print(f'{bs:>12}{n:>12}' + ''.join(f'{xi:>12.1f}' for xi in x))
+    return rows
+
+
+def timed(fn, n):
+    # Returns calls/s of fn()
+    fn()  # warmup
+    t = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return n / (time.perf_counter() - t)
+
+
+def print_results(results):
+    print(f"{'benchmark':<40}{'samples/s':>12}")
+    for name, x in results:
+        print(f'{name:<40}{x:>12.1f}')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', choices=['mosaic', 'warp', 'decode', 'batch-augment', 'nms'],
+                        help='benchmark to run')
+    parser.add_argument('--img-size', type=int, default=640, help='image size')
+    parser.add_argument('--samples', type=int, default=200, help='number of samples to time')
+    opt = parser.parse_args()
+    cv2.setNumThreads(0)  # single-threaded, like a DataLoader worker
+    torch.set_num_threads(1)
+    if opt.benchmark == 'mosaic':
+        benchmark_mosaic(opt.img_size, opt.samples)
+    elif opt.benchmark == 'warp':
+        benchmark_warp(opt.img_size, opt.samples)
+    elif opt.benchmark == 'decode':
+        benchmark_decode(opt.img_size, opt.samples)
+    elif opt.benchmark == 'batch-augment':
+        benchmark_batch_augment(opt.img_size, opt.samples)
+    elif opt.benchmark == 'nms':
+        benchmark_nms(opt.img_size, opt.samples)
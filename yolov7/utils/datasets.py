@@ -1,6 +1,8 @@
 # Dataset utils and dataloaders
 
 import glob
+import hashlib
+import json
 import logging
 import math
 import os
@@ -10,7 +12,9 @@ import time
 from itertools import repeat
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
-from threading import Thread
+from contextlib import nullcontext
+from queue import Empty, Full, Queue
+from threading import Event, Thread
 
 import cv2
 import numpy as np
@@ -28,6 +32,8 @@ from torchvision.ops import roi_pool, roi_align, ps_roi_pool, ps_roi_align
 
 from utils.general import check_requirements, xyxy2xywh, xywh2xyxy, xywhn2xyxy, xyn2xy, segment2box, segments2boxes, \
     resample_segments, clean_str
+from utils.image_cache import DiskImageCache, SharedImageCache, image_cache_key, resized_shapes
+from utils.image_decode import DECODERS, decode_pool, reduction
 from utils.torch_utils import torch_distributed_zero_first
 
 # Parameters
@@ -47,6 +53,144 @@ def get_hash(files):
     return sum(os.path.getsize(f) for f in files if os.path.isfile(f))
 
 
+# '<labels dir>.cache' layout: magic, uint64 header length, JSON header, then every array at a 64-byte aligned offset
+LABEL_CACHE_MAGIC = b'Y7LABELS'
+LABEL_CACHE_VERSION = 0.2
+LABEL_CACHE_ALIGN = 64
+LABEL_FOUND, LABEL_EMPTY, LABEL_MISSING, LABEL_CORRUPT = 0, 1, 2, 3  # per image label status
+
+
+def file_stats(files):
+    # Returns an int64 (n, 2) array of (size, mtime_ns) per file, (-1, -1) for missing files
+    stats = np.full((len(files), 2), -1, dtype=np.int64)
+    for i, f in enumerate(files):
+        try:
+            st = os.stat(f)
+            stats[i] = st.st_size, st.st_mtime_ns
+        except OSError:
+            pass
+    return stats
+
+
+def stats_hash(files, stats):
+    # Returns a hash of file paths and their (size, mtime) stats, which changes whenever any file is touched
+    h = hashlib.sha1('\n'.join(files).encode('utf-8'))
+    h.update(np.ascontiguousarray(stats, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def _align(n):
+    return -(-n // LABEL_CACHE_ALIGN) * LABEL_CACHE_ALIGN
+
+
+def save_label_cache(path, arrays, **meta):
+    # Atomically writes {name: array} and JSON-serializable meta to path in the memory-mappable label cache layout
+    arrays = {k: np.ascontiguousarray(a) for k, a in arrays.items()}
+    header, offset = dict(meta, version=LABEL_CACHE_VERSION, arrays={}), 0
+    for k, a in arrays.items():
+        header['arrays'][k] = {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset}
+        offset += _align(a.nbytes)
+    header = json.dumps(header).encode('utf-8')
+    start = _align(len(LABEL_CACHE_MAGIC) + 8 + len(header))
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(LABEL_CACHE_MAGIC + len(header).to_bytes(8, 'little') + header)
+        for a in arrays.values():
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            f.write(a.tobytes())
+        f.write(b'\0' * (start + offset - f.tell()))
+    os.replace(tmp, path)  # readers still mapping the old cache keep a valid file
+
+
+def load_label_cache(path):
+    # Returns (meta, {name: array}) of a label cache, or None if path is missing or not a current label cache.
+    # Arrays are read-only views into one memory map, so DataLoader workers share its pages instead of copying them
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(LABEL_CACHE_MAGIC)) != LABEL_CACHE_MAGIC:
+                return None  # e.g. a torch.save() cache of an earlier version
+            n = int.from_bytes(f.read(8), 'little')
+            meta = json.loads(f.read(n))
+        if meta.get('version') != LABEL_CACHE_VERSION:
+            return None
+        start = _align(len(LABEL_CACHE_MAGIC) + 8 + n)
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+        arrays = {}
+        for k, v in meta.pop('arrays').items():
+            dtype, shape = np.dtype(v['dtype']), tuple(v['shape'])
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            a = buf[start + v['offset']:start + v['offset'] + nbytes]
+            arrays[k] = np.asarray(a).view(dtype).reshape(shape)
+        return meta, arrays
+    except Exception:
+        return None
+
+
+def load_label_index(label_files):
+    # Returns {label_file: labels} from '<labels dir>.index.npz' files written by the training pipeline's label
+    # index builder, for box-only entries whose size and mtime still match the label file on disk
+    index = {}
+    for d in {os.path.dirname(f) for f in label_files}:
+        p = d + '.index.npz'
+        if not os.path.isfile(p):
+            continue
+        try:
+            with np.load(p, allow_pickle=False) as x:
+                files, sizes, mtimes, flags, offsets, labels = \
+                    (x[k] for k in ('files', 'sizes', 'mtimes', 'flags', 'offsets', 'labels'))
+        except Exception:
+            continue
+        for j, name in enumerate(files.tolist()):
+            f = os.path.join(d, name)
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            if flags[j] == 0 and st.st_size == sizes[j] and st.st_mtime_ns == mtimes[j]:
+                index[f] = labels[offsets[j]:offsets[j + 1]]
+    return index
+
+
+def verify_image_label(im_file, lb_file, label_index=None):
+    # Verifies one image-label pair, returns (labels, shape, segments, status, error message)
+    segments = []  # instance segments
+    try:
+        # verify images
+        im = Image.open(im_file)
+        im.verify()  # PIL verify
+        shape = exif_size(im)  # image size
+        assert (shape[0] > 9) & (shape[1] > 9), f'image size {shape} <10 pixels'
+        assert im.format.lower() in img_formats, f'invalid image format {im.format}'
+
+        # verify labels
+        if label_index is not None and lb_file in label_index:
+            status = LABEL_FOUND  # label found
+            l = label_index[lb_file].copy()
+        elif os.path.isfile(lb_file):
+            status = LABEL_FOUND  # label found
+            with open(lb_file, 'r') as f:
+                l = [x.split() for x in f.read().strip().splitlines()]
+                if any([len(x) > 8 for x in l]):  # is segment
+                    classes = np.array([x[0] for x in l], dtype=np.float32)
+                    segments = [np.array(x[1:], dtype=np.float32).reshape(-1, 2) for x in l]  # (cls, xy1...)
+                    l = np.concatenate((classes.reshape(-1, 1), segments2boxes(segments)), 1)  # (cls, xywh)
+                l = np.array(l, dtype=np.float32)
+        else:
+            status = LABEL_MISSING  # label missing
+            l = np.zeros((0, 5), dtype=np.float32)
+        if len(l):
+            assert l.shape[1] == 5, 'labels require 5 columns each'
+            assert (l >= 0).all(), 'negative labels'
+            assert (l[:, 1:] <= 1).all(), 'non-normalized or out of bounds coordinate labels'
+            assert np.unique(l, axis=0).shape[0] == l.shape[0], 'duplicate labels'
+        else:
+            status = LABEL_EMPTY if status == LABEL_FOUND else status  # label empty
+            l = np.zeros((0, 5), dtype=np.float32)
+        return l, shape, segments, status, ''
+    except Exception as e:
+        return np.zeros((0, 5), dtype=np.float32), (0, 0), [], LABEL_CORRUPT, str(e)
+
+
 def exif_size(img):
     # Returns exif-corrected PIL size
     s = img.size  # (width, height)
@@ -63,7 +207,7 @@ def exif_size(img):
 
 
 def create_dataloader(path, imgsz, batch_size, stride, opt, hyp=None, augment=False, cache=False, pad=0.0, rect=False,
-                      rank=-1, world_size=1, workers=8, image_weights=False, quad=False, prefix=''):
+                      rank=-1, world_size=1, workers=8, image_weights=False, quad=False, prefix='', epoch=0):
     # Make sure only the first process in DDP process the dataset first, and the following others can use the cache
     with torch_distributed_zero_first(rank):
         dataset = LoadImagesAndLabels(path, imgsz, batch_size,
@@ -71,23 +215,30 @@ def create_dataloader(path, imgsz, batch_size, stride, opt, hyp=None, augment=Fa
                                       hyp=hyp,  # augmentation hyperparameters
                                       rect=rect,  # rectangular training
                                       cache_images=cache,
+                                      cache_codec=getattr(opt, 'cache_codec', 'none'),
+                                      decoder=getattr(opt, 'decoder', 'cv2'),
+                                      decode_threads=getattr(opt, 'decode_threads', 0),
                                       single_cls=opt.single_cls,
                                       stride=int(stride),
                                       pad=pad,
                                       image_weights=image_weights,
-                                      prefix=prefix)
+                                      prefix=prefix,
+                                      rect_bucket=getattr(opt, 'rect_bucket', 0) if augment else 0)
 
     batch_size = min(batch_size, len(dataset))
     nw = min([os.cpu_count() // world_size, batch_size if batch_size > 1 else 0, workers])  # number of workers
-    sampler = torch.utils.data.distributed.DistributedSampler(dataset) if rank != -1 else None
+    if dataset.rect and dataset.rect_bucket:  # shuffled batches of one aspect ratio bucket each
+        batching = {'batch_sampler': BucketBatchSampler(dataset.batch, batch_size, distributed=rank != -1, epoch=epoch)}
+    else:
+        sampler = torch.utils.data.distributed.DistributedSampler(dataset) if rank != -1 else None
+        batching = {'batch_size': batch_size, 'sampler': sampler}
     loader = torch.utils.data.DataLoader if image_weights else InfiniteDataLoader
     # Use torch.utils.data.DataLoader() if dataset.properties will update during training else InfiniteDataLoader()
     dataloader = loader(dataset,
-                        batch_size=batch_size,
                         num_workers=nw,
-                        sampler=sampler,
                         pin_memory=True,
-                        collate_fn=LoadImagesAndLabels.collate_fn4 if quad else LoadImagesAndLabels.collate_fn)
+                        collate_fn=LoadImagesAndLabels.collate_fn4 if quad else LoadImagesAndLabels.collate_fn,
+                        **batching)
     return dataloader, dataset
 
 
@@ -110,6 +261,115 @@ class InfiniteDataLoader(torch.utils.data.dataloader.DataLoader):
             yield next(self.iterator)
 
 
+class PrefetchLoader:
+    """ Loader wrapper that keeps up to depth batches in flight
+
+    A background thread takes the batches of loader, copies the images to device (non-blocking from pinned memory, on
+    a side CUDA stream), applies augment(imgs, targets) to the uint8 images and converts them to float 0.0-1.0. With
+    depth 0 this runs on the calling thread. stats() tells how long the training loop waited for data in the last epoch
+    """
+
+    def __init__(self, loader, device, depth=2, augment=None):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth = depth
+        self.augment = augment
+        self.stream = torch.cuda.Stream(self.device) if depth and self.device.type == 'cuda' else None
+        self.batches, self.wait, self.time, self.ready = 0, 0.0, 0.0, 0
+
+    def __getattr__(self, name):  # sampler, num_workers, dataset... of the wrapped loader
+        if name == 'loader':
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self.batches, self.wait, self.time, self.ready = 0, 0.0, 0.0, 0
+        t0 = time.time()
+        if not self.depth:
+            it = iter(self.loader)
+            while True:
+                t = time.time()
+                batch = next(it, None)
+                self.wait += time.time() - t  # prepare() is not waiting for data, as with depth > 0
+                if batch is None:
+                    break
+                batch = self.prepare(batch)
+                self.batches += 1
+                self.time = time.time() - t0
+                yield batch
+            return
+
+        queue, stop = Queue(self.depth), Event()
+        thread = Thread(target=self.produce, args=(queue, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                self.ready += queue.qsize()
+                t = time.time()
+                item = queue.get()
+                self.wait += time.time() - t
+                if item is None:  # end of epoch
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                batch, event = item
+                if event is not None:  # wait for the copy on the side stream, keep its memory until used here
+                    stream = torch.cuda.current_stream(self.device)
+                    stream.wait_event(event)
+                    batch[0].record_stream(stream)
+                self.batches += 1
+                self.time = time.time() - t0
+                yield batch
+        finally:
+            stop.set()
+            while thread.is_alive():  # unblock the producer
+                try:
+                    queue.get(timeout=0.1)
+                except Empty:
+                    pass
+
+    def prepare(self, batch):
+        imgs, targets, *other = batch
+        imgs = imgs.to(self.device, non_blocking=True)
+        if self.augment:
+            imgs, targets = self.augment(imgs, targets)
+        return (imgs.float() / 255.0, targets, *other)  # uint8 to float32, 0-255 to 0.0-1.0
+
+    def produce(self, queue, stop):
+        # Background thread: puts (batch, CUDA event or None) of every batch of loader, then None or the exception
+        def put(item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        try:
+            with torch.cuda.stream(self.stream) if self.stream is not None else nullcontext():
+                for batch in self.loader:
+                    batch = self.prepare(batch)
+                    event = None
+                    if self.stream is not None:
+                        event = torch.cuda.Event()
+                        event.record(self.stream)
+                    if not put((batch, event)):
+                        return
+            put(None)
+        except BaseException as e:
+            put(e)
+
+    def stats(self):
+        # Returns the batches of the last epoch, the seconds the loop waited for them (stall, data-bound when high)
+        # and the mean number of batches ready when one was requested (queue depth, compute-bound when close to depth)
+        return {'batches': self.batches, 'wait': self.wait, 'stall': self.wait / max(self.time, 1e-9),
+                'queue_depth': self.ready / max(self.batches, 1), 'depth': self.depth}
+
+
 class _RepeatSampler(object):
     """ Sampler that repeats forever
 
@@ -125,6 +385,53 @@ class _RepeatSampler(object):
             yield from iter(self.sampler)
 
 
+class BucketBatchSampler:
+    """ Batch sampler over aspect ratio buckets for rectangular training
+
+    Every epoch the images of each bucket are shuffled and split into batches, and the batches of all buckets are
+    shuffled together, so a batch holds images of one bucket (padded to its shape) but changes from epoch to epoch.
+    Distributed, each of num_replicas ranks takes every num_replicas-th batch of the same seed + epoch order (padded
+    by repeating batches to an equal count, as DistributedSampler does with samples)
+
+    Args:
+        buckets (array): bucket index of every image
+        epoch (int): epoch of the first __iter__, e.g. the start epoch of a resumed run
+    """
+
+    def __init__(self, buckets, batch_size, shuffle=True, distributed=False, num_replicas=None, rank=None, seed=0,
+                 epoch=0):
+        if distributed:
+            num_replicas = torch.distributed.get_world_size() if num_replicas is None else num_replicas
+            rank = torch.distributed.get_rank() if rank is None else rank
+        self.buckets = np.asarray(buckets)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.num_replicas = num_replicas or 1
+        self.rank = rank or 0
+        self.seed = seed
+        self.epoch = epoch  # advanced by every __iter__, in step on all ranks
+        nb = sum(math.ceil(n / batch_size) for n in np.bincount(self.buckets) if n)  # batches of all ranks
+        self.num_batches = math.ceil(nb / self.num_replicas)
+
+    def __len__(self):
+        return self.num_batches
+
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        batches = []
+        for b in np.unique(self.buckets):
+            i = np.flatnonzero(self.buckets == b)
+            if self.shuffle:
+                i = i[torch.randperm(len(i), generator=g).numpy()]
+            batches += [i[j:j + self.batch_size].tolist() for j in range(0, len(i), self.batch_size)]
+        if self.shuffle:
+            batches = [batches[j] for j in torch.randperm(len(batches), generator=g).tolist()]
+        batches += batches[:self.num_batches * self.num_replicas - len(batches)]  # pad to a multiple of num_replicas
+        yield from batches[self.rank::self.num_replicas]
+
+
 class LoadImages:  # for inference
     def __init__(self, path, img_size=640, stride=32):
         p = str(Path(path).absolute())  # os-agnostic absolute path
@@ -352,14 +659,21 @@ def img2label_paths(img_paths):
 
 class LoadImagesAndLabels(Dataset):  # for training/testing
     def __init__(self, path, img_size=640, batch_size=16, augment=False, hyp=None, rect=False, image_weights=False,
-                 cache_images=False, single_cls=False, stride=32, pad=0.0, prefix=''):
+                 cache_images=False, single_cls=False, stride=32, pad=0.0, prefix='', cache_codec='none', decoder='cv2',
+                 decode_threads=0, rect_bucket=0):
         self.img_size = img_size
         self.augment = augment
         self.hyp = hyp
         self.image_weights = image_weights
         self.rect = False if image_weights else rect
+        self.rect_bucket = rect_bucket  # batches per aspect ratio bucket (BucketBatchSampler), 0 for fixed rect batches
         self.mosaic = self.augment and not self.rect  # load 4 images at a time into a mosaic (only during training)
         self.mosaic_border = [-img_size // 2, -img_size // 2]
+        self.fused_resize = bool(hyp and hyp.get('fused_resize', 0))  # decode mosaic tiles straight into the canvas
+        self.fused_warp = augment and bool(hyp and hyp.get('fused_warp', 0))  # resize, letterbox and warp at once
+        self.batch_augment = augment and bool(hyp and hyp.get('batch_augment', 0))  # HSV and flips by BatchAugment
+        self.decoder = decoder  # utils.image_decode.DECODERS name
+        self.decode_threads = decode_threads  # threads decoding the images of a mosaic, 0 or 1 for none
         self.stride = stride
         self.path = path        
         #self.albumentations = Albumentations() if augment else None
@@ -388,34 +702,36 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
         # Check cache
         self.label_files = img2label_paths(self.img_files)  # labels
         cache_path = (p if p.is_file() else Path(self.label_files[0]).parent).with_suffix('.cache')  # cached labels
-        if cache_path.is_file():
-            cache, exists = torch.load(cache_path), True  # load
-            #if cache['hash'] != get_hash(self.label_files + self.img_files) or 'version' not in cache:  # changed
-            #    cache, exists = self.cache_labels(cache_path, prefix), False  # re-cache
-        else:
-            cache, exists = self.cache_labels(cache_path, prefix), False  # cache
+        stats = np.concatenate((file_stats(self.img_files), file_stats(self.label_files)), 1)
+        cache, exists = load_label_cache(cache_path), True  # memory-mapped, read-only
+        if cache is None or cache[0]['hash'] != stats_hash(self.img_files, stats):  # missing, old format or changed
+            cache, exists = self.cache_labels(cache_path, prefix, stats=stats, previous=cache), False  # re-cache
+        meta, cache = cache
 
         # Display cache
-        nf, nm, ne, nc, n = cache.pop('results')  # found, missing, empty, corrupted, total
+        nf, nm, ne, nc, n = meta['results']  # found, missing, empty, corrupted, total
         if exists:
             d = f"Scanning '{cache_path}' images and labels... {nf} found, {nm} missing, {ne} empty, {nc} corrupted"
             tqdm(None, desc=prefix + d, total=n, initial=n)  # display cache results
         assert nf > 0 or not augment, f'{prefix}No labels in {cache_path}. Can not train without labels. See {help_url}'
 
-        # Read cache
-        cache.pop('hash')  # remove hash
-        cache.pop('version')  # remove version
-        labels, shapes, self.segments = zip(*cache.values())
-        self.labels = list(labels)
-        self.shapes = np.array(shapes, dtype=np.float64)
-        self.img_files = list(cache.keys())  # update
-        self.label_files = img2label_paths(cache.keys())  # update
+        # Read cache: per image labels and segments are views into the flat memory-mapped arrays
+        keep = np.flatnonzero(cache['status'] != LABEL_CORRUPT)
+        labels, lo = cache['labels'], cache['label_offsets']
+        points, so, iso = cache['points'], cache['segment_offsets'], cache['image_segment_offsets']
         if single_cls:
-            for x in self.labels:
-                x[:, 0] = 0
+            labels = labels.copy()  # private, writable copy
+            labels[:, 0] = 0
+        self.labels = [labels[lo[i]:lo[i + 1]] for i in keep]
+        self.segments = [[points[so[j]:so[j + 1]] for j in range(iso[i], iso[i + 1])] for i in keep]
+        shapes = cache['shapes'][keep]
+        self.shapes = np.array(shapes, dtype=np.float64)
+        self.img_files = [meta['img_files'][i] for i in keep]  # update
+        self.label_files = img2label_paths(self.img_files)  # update
 
         n = len(shapes)  # number of images
-        bi = np.floor(np.arange(n) / batch_size).astype(int)  # batch index
+        bs = batch_size * rect_bucket if self.rect and rect_bucket else batch_size  # images per rect shape
+        bi = np.floor(np.arange(n) / bs).astype(int)  # batch (or aspect ratio bucket) index
         nb = bi[-1] + 1  # number of batches
         self.batch = bi  # batch index of image
         self.n = n
@@ -447,67 +763,72 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
 
         # Cache images into memory for faster training (WARNING: large datasets may exceed system RAM)
         self.imgs = [None] * n
-        if cache_images:
-            if cache_images == 'disk':
-                self.im_cache_dir = Path(Path(self.img_files[0]).parent.as_posix() + '_npy')
-                self.img_npy = [self.im_cache_dir / Path(f).with_suffix('.npy').name for f in self.img_files]
-                self.im_cache_dir.mkdir(parents=True, exist_ok=True)
-            gb = 0  # Gigabytes of cached images
-            self.img_hw0, self.img_hw = [None] * n, [None] * n
-            results = ThreadPool(8).imap(lambda x: load_image(*x), zip(repeat(self), range(n)))
-            pbar = tqdm(enumerate(results), total=n)
-            for i, x in pbar:
-                if cache_images == 'disk':
-                    if not self.img_npy[i].exists():
-                        np.save(self.img_npy[i].as_posix(), x[0])
-                    gb += self.img_npy[i].stat().st_size
-                else:
+        self.image_cache = None  # shared-memory RAM cache (one per node) or memory-mapped disk cache
+        settings = (img_size, augment) + ((decoder,) if decoder != 'cv2' else ())  # cached pixels depend on these
+        if cache_images == 'disk':
+            self.image_cache = DiskImageCache(Path(self.img_files[0]).parent.as_posix() + '_cache', self.img_files,
+                                              file_stats(self.img_files), settings, codec=cache_codec)
+            decoded = self.image_cache.build(lambda i: decode_image(self, i))
+            c = self.image_cache.stats()
+            logging.info(f"{prefix}Caching images ({c['bytes'] / 1E9:.1f}GB on disk in {c['shards']} shards, "
+                         f"{c['raw_bytes'] / max(c['bytes'], 1):.1f}x {cache_codec}, {decoded} decoded)")
+        elif cache_images:
+            hw0, hw = resized_shapes(self.shapes, img_size)
+            key = image_cache_key(self.img_files, file_stats(self.img_files), *settings)
+            try:
+                self.image_cache = SharedImageCache(key, hw0, hw)
+            except (MemoryError, OSError, ValueError) as e:
+                logging.info(f'{prefix}WARNING: Shared image cache unavailable, caching images per process: {e}')
+            if self.image_cache is not None:
+                decoded = self.image_cache.fill(lambda i: decode_image(self, i)[0])
+                logging.info(f'{prefix}Caching images ({self.image_cache.nbytes / 1E9:.1f}GB shared memory, '
+                             f'{decoded} decoded, {n - decoded} already cached on this node)')
+            else:
+                gb = 0  # Gigabytes of cached images
+                self.img_hw0, self.img_hw = [None] * n, [None] * n
+                results = ThreadPool(8).imap(lambda x: load_image(*x), zip(repeat(self), range(n)))
+                pbar = tqdm(enumerate(results), total=n)
+                for i, x in pbar:
                     self.imgs[i], self.img_hw0[i], self.img_hw[i] = x
                     gb += self.imgs[i].nbytes
-                pbar.desc = f'{prefix}Caching images ({gb / 1E9:.1f}GB)'
-            pbar.close()
-
-    def cache_labels(self, path=Path('./labels.cache'), prefix=''):
-        # Cache dataset labels, check images and read shapes
-        x = {}  # dict
-        nm, nf, ne, nc = 0, 0, 0, 0  # number missing, found, empty, duplicate
-        pbar = tqdm(zip(self.img_files, self.label_files), desc='Scanning images', total=len(self.img_files))
+                    pbar.desc = f'{prefix}Caching images ({gb / 1E9:.1f}GB)'
+                pbar.close()
+
+    def cache_labels(self, path=Path('./labels.cache'), prefix='', stats=None, previous=None):
+        # Cache dataset labels, check images and read shapes. Images whose image and label file stats are unchanged
+        # since the previous cache are taken from it, so only new or modified files are scanned again
+        if stats is None:
+            stats = np.concatenate((file_stats(self.img_files), file_stats(self.label_files)), 1)
+        reuse = {}
+        if previous is not None:
+            pmeta, parrays = previous
+            for j, (im_file, st) in enumerate(zip(pmeta['img_files'], parrays['stats'])):
+                reuse[im_file] = j, st
+
+        n = len(self.img_files)
+        status, shapes = np.zeros(n, dtype=np.uint8), np.zeros((n, 2), dtype=np.float64)
+        labels, segments, nsegments = [], [], np.zeros(n, dtype=np.int64)
+        nm, nf, ne, nc, nr = 0, 0, 0, 0, 0  # number missing, found, empty, corrupted, reused
+        label_index = load_label_index(self.label_files)  # labels already parsed by the pipeline
+        pbar = tqdm(zip(self.img_files, self.label_files), desc='Scanning images', total=n)
         for i, (im_file, lb_file) in enumerate(pbar):
-            try:
-                # verify images
-                im = Image.open(im_file)
-                im.verify()  # PIL verify
-                shape = exif_size(im)  # image size
-                segments = []  # instance segments
-                assert (shape[0] > 9) & (shape[1] > 9), f'image size {shape} <10 pixels'
-                assert im.format.lower() in img_formats, f'invalid image format {im.format}'
-
-                # verify labels
-                if os.path.isfile(lb_file):
-                    nf += 1  # label found
-                    with open(lb_file, 'r') as f:
-                        l = [x.split() for x in f.read().strip().splitlines()]
-                        if any([len(x) > 8 for x in l]):  # is segment
-                            classes = np.array([x[0] for x in l], dtype=np.float32)
-                            segments = [np.array(x[1:], dtype=np.float32).reshape(-1, 2) for x in l]  # (cls, xy1...)
-                            l = np.concatenate((classes.reshape(-1, 1), segments2boxes(segments)), 1)  # (cls, xywh)
-                        l = np.array(l, dtype=np.float32)
-                    if len(l):
-                        assert l.shape[1] == 5, 'labels require 5 columns each'
-                        assert (l >= 0).all(), 'negative labels'
-                        assert (l[:, 1:] <= 1).all(), 'non-normalized or out of bounds coordinate labels'
-                        assert np.unique(l, axis=0).shape[0] == l.shape[0], 'duplicate labels'
-                    else:
-                        ne += 1  # label empty
-                        l = np.zeros((0, 5), dtype=np.float32)
-                else:
-                    nm += 1  # label missing
-                    l = np.zeros((0, 5), dtype=np.float32)
-                x[im_file] = [l, shape, segments]
-            except Exception as e:
-                nc += 1
-                print(f'{prefix}WARNING: Ignoring corrupted image and/or label {im_file}: {e}')
-
+            j, st = reuse.get(im_file, (None, None))
+            if j is not None and (st == stats[i]).all():
+                lo, so, iso = parrays['label_offsets'], parrays['segment_offsets'], parrays['image_segment_offsets']
+                l, shape, s = parrays['labels'][lo[j]:lo[j + 1]], parrays['shapes'][j], int(parrays['status'][j])
+                segs = [parrays['points'][so[k]:so[k + 1]] for k in range(iso[j], iso[j + 1])]
+                nr += 1
+            else:
+                l, shape, segs, s, msg = verify_image_label(im_file, lb_file, label_index)
+                if msg:
+                    print(f'{prefix}WARNING: Ignoring corrupted image and/or label {im_file}: {msg}')
+            status[i], shapes[i], nsegments[i] = s, shape, len(segs)
+            labels.append(l)
+            segments += segs
+            nf += s in (LABEL_FOUND, LABEL_EMPTY)
+            ne += s == LABEL_EMPTY
+            nm += s == LABEL_MISSING
+            nc += s == LABEL_CORRUPT
             pbar.desc = f"{prefix}Scanning '{path.parent / path.stem}' images and labels... " \
                         f"{nf} found, {nm} missing, {ne} empty, {nc} corrupted"
         pbar.close()
@@ -515,12 +836,25 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
         if nf == 0:
             print(f'{prefix}WARNING: No labels found in {path}. See {help_url}')
 
-        x['hash'] = get_hash(self.label_files + self.img_files)
-        x['results'] = nf, nm, ne, nc, i + 1
-        x['version'] = 0.1  # cache version
-        torch.save(x, path)  # save for next time
-        logging.info(f'{prefix}New cache created: {path}')
-        return x
+        arrays = {
+            'status': status,
+            'stats': stats,
+            'shapes': shapes,
+            'labels': np.concatenate(labels, 0).astype(np.float32) if labels else np.zeros((0, 5), np.float32),
+            'label_offsets': np.concatenate(([0], np.cumsum([len(l) for l in labels], dtype=np.int64))),
+            'points': np.concatenate(segments, 0).astype(np.float32) if segments else np.zeros((0, 2), np.float32),
+            'segment_offsets': np.concatenate(([0], np.cumsum([len(x) for x in segments], dtype=np.int64))),
+            'image_segment_offsets': np.concatenate(([0], np.cumsum(nsegments))),
+        }
+        meta = {'hash': stats_hash(self.img_files, stats), 'results': [nf, nm, ne, nc, n], 'img_files': self.img_files}
+        try:
+            save_label_cache(path, arrays, **meta)  # save for next time
+            cache = load_label_cache(path)
+            logging.info(f'{prefix}New cache created: {path} ({nr} of {n} images unchanged)')
+        except Exception as e:
+            cache = None
+            logging.info(f'{prefix}WARNING: Cache directory {path.parent} is not writeable: {e}')  # not writeable
+        return cache or (meta, arrays)
 
     def __len__(self):
         return len(self.img_files)
@@ -554,6 +888,11 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
                 img = (img * r + img2 * (1 - r)).astype(np.uint8)
                 labels = np.concatenate((labels, labels2), 0)
 
+        elif self.fused_warp:
+            # Load, letterbox and random_perspective() image in one warp
+            shape = self.batch_shapes[self.batch[index]] if self.rect else self.img_size  # final letterboxed shape
+            img, labels, shapes = load_warped(self, index, shape)
+
         else:
             # Load image
             img, (h0, w0), (h, w) = load_image(self, index)
@@ -569,7 +908,7 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
 
         if self.augment:
             # Augment imagespace
-            if not mosaic:
+            if not mosaic and not self.fused_warp:
                 img, labels = random_perspective(img, labels,
                                                  degrees=hyp['degrees'],
                                                  translate=hyp['translate'],
@@ -581,7 +920,8 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
             #img, labels = self.albumentations(img, labels)
 
             # Augment colorspace
-            augment_hsv(img, hgain=hyp['hsv_h'], sgain=hyp['hsv_s'], vgain=hyp['hsv_v'])
+            if not self.batch_augment:
+                augment_hsv(img, hgain=hyp['hsv_h'], sgain=hyp['hsv_s'], vgain=hyp['hsv_v'])
 
             # Apply cutouts
             # if random.random() < 0.9:
@@ -605,7 +945,7 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
             labels[:, [2, 4]] /= img.shape[0]  # normalized height 0-1
             labels[:, [1, 3]] /= img.shape[1]  # normalized width 0-1
 
-        if self.augment:
+        if self.augment and not self.batch_augment:
             # flip up-down
             if random.random() < hyp['flipud']:
                 img = np.flipud(img)
@@ -665,21 +1005,37 @@ class LoadImagesAndLabels(Dataset):  # for training/testing
 # Ancillary functions --------------------------------------------------------------------------------------------------
 def load_image(self, index):
     # loads 1 image from dataset, returns img, original hw, resized hw
+    if self.image_cache is not None:
+        x = self.image_cache.get(index)
+        if x is not None:
+            return x  # img (read-only view), hw_original, hw_resized
     img = self.imgs[index]
     if img is None:  # not cached
-        path = self.img_files[index]
-        img = cv2.imread(path)  # BGR
-        assert img is not None, 'Image Not Found ' + path
-        h0, w0 = img.shape[:2]  # orig hw
-        r = self.img_size / max(h0, w0)  # resize image to img_size
-        if r != 1:  # always resize down, only resize up if training with augmentation
-            interp = cv2.INTER_AREA if r < 1 and not self.augment else cv2.INTER_LINEAR
-            img = cv2.resize(img, (int(w0 * r), int(h0 * r)), interpolation=interp)
-        return img, (h0, w0), img.shape[:2]  # img, hw_original, hw_resized
+        return decode_image(self, index)
     else:
         return self.imgs[index], self.img_hw0[index], self.img_hw[index]  # img, hw_original, hw_resized
 
 
+def decode_image(self, index):
+    # reads and resizes 1 image from disk, returns img, original hw, resized hw
+    img, (h0, w0) = read_image(self, index)
+    r = self.img_size / max(h0, w0)  # resize image to img_size
+    if img.shape[:2] != (int(h0 * r), int(w0 * r)):  # always resize down, only resize up if training with augmentation
+        interp = cv2.INTER_AREA if r < 1 and not self.augment else cv2.INTER_LINEAR
+        img = cv2.resize(img, (int(w0 * r), int(h0 * r)), interpolation=interp)
+    return img, (h0, w0), img.shape[:2]  # img, hw_original, hw_resized
+
+
+def read_image(self, index):
+    # reads 1 image from disk with the dataset decoder, which may downscale it by up to 8x while decoding as long as it
+    # stays at least img_size. Returns img (BGR) and the original hw
+    path = self.img_files[index]
+    w0, h0 = self.shapes[index]  # exif-corrected wh
+    img, k = DECODERS[self.decoder](path, reduction((w0, h0), self.img_size))
+    assert img is not None, 'Image Not Found ' + path
+    return img, img.shape[:2] if k == 1 else (int(h0), int(w0))
+
+
 def augment_hsv(img, hgain=0.5, sgain=0.5, vgain=0.5):
     r = np.random.uniform(-1, 1, 3) * [hgain, sgain, vgain] + 1  # random gains
     hue, sat, val = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
@@ -694,6 +1050,34 @@ def augment_hsv(img, hgain=0.5, sgain=0.5, vgain=0.5):
     cv2.cvtColor(img_hsv, cv2.COLOR_HSV2BGR, dst=img)  # no return needed
 
 
+def augment_hsv_batch(img, hgain=0.5, sgain=0.5, vgain=0.5):
+    # Approximates augment_hsv() on a uint8 (b, 3, h, w) RGB batch in place, with per-sample random gains, on the batch
+    # device. Uses OpenCV's 8-bit HSV ranges (h 0-179, s and v 0-255) and truncates the gains as augment_hsv()'s lookup
+    # tables do, but converts in float rather than with OpenCV's integer tables: for the same gains pixels differ from
+    # augment_hsv() by ~0.3 levels on average and up to ~17, and by up to ~9 even with unit gains
+    b = img.shape[0]
+    r = (torch.rand(b, 3) * 2 - 1) * torch.tensor([hgain, sgain, vgain]) + 1  # random gains
+    r = r.to(img.device).view(b, 3, 1, 1)
+
+    # RGB to HSV
+    x = img.float()
+    v, i = x.max(1, keepdim=True)  # value, index of the max channel
+    d = v - x.amin(1, keepdim=True)  # chroma
+    hue = (x.gather(1, (i + 1) % 3) - x.gather(1, (i + 2) % 3)) / d.clamp(min=1) + 2 * i  # sextant 0-6
+    hue = hue.mul_(30).round_().remainder_(180)
+    sat = (d * 255 / v.clamp(min=1)).round_()
+
+    # Gains, truncated to uint8 values as the lookup tables
+    hue = hue.mul_(r[:, :1]).remainder_(180).floor_()
+    sat = sat.mul_(r[:, 1:2]).clamp_(0, 255).floor_()
+    v = v.mul_(r[:, 2:]).clamp_(0, 255).floor_()
+
+    # HSV to RGB
+    k = (torch.tensor([5., 3., 1.], device=img.device).view(1, 3, 1, 1) + hue / 30) % 6
+    k = torch.minimum(k, 4 - k).clamp_(0, 1)
+    img.copy_((v - k.mul_(v * sat / 255)).round_())  # no return needed
+
+
 def hist_equalize(img, clahe=True, bgr=False):
     # Equalize histogram on BGR image 'img' with img.shape(n,m,3) and range 0-255
     yuv = cv2.cvtColor(img, cv2.COLOR_BGR2YUV if bgr else cv2.COLOR_RGB2YUV)
@@ -705,20 +1089,176 @@ def hist_equalize(img, clahe=True, bgr=False):
     return cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR if bgr else cv2.COLOR_YUV2RGB)  # convert YUV image to RGB
 
 
+def mosaic_canvas(self, shape):
+    # Returns this worker's reusable canvas of shape, filled with the 114 padding value
+    canvases = self.__dict__.setdefault('mosaic_canvases', {})
+    if shape not in canvases:
+        canvases[shape] = np.empty(shape, dtype=np.uint8)
+    canvas = canvases[shape]
+    canvas.fill(114)
+    return canvas
+
+
+def tile_shape(self, index):
+    # Returns the resized hw of image index without decoding it
+    w0, h0 = self.shapes[index]  # exif-corrected wh
+    r = self.img_size / max(h0, w0)
+    return (int(h0 * r), int(w0 * r)) if r != 1 else (int(h0), int(w0))
+
+
+def paste_tile(self, canvas, index, img, hw, a, b):
+    # Pastes region b (x1, y1, x2, y2) of image index resized to hw into region a of canvas. An img of another size
+    # (the decoded image, or None to decode it here) is resized straight into the canvas by one warpAffine (fused
+    # resize+paste) instead of resize + copy
+    x1a, y1a, x2a, y2a = a
+    x1b, y1b, x2b, y2b = b
+    if x2a <= x1a or y2a <= y1a:
+        return
+    if img is None:
+        img = read_image(self, index)[0]
+    if img.shape[:2] == tuple(hw):
+        canvas[y1a:y2a, x1a:x2a] = img[y1b:y2b, x1b:x2b]
+        return
+    sy, sx = hw[0] / img.shape[0], hw[1] / img.shape[1]  # per axis scale and pixel centers as cv2.resize
+    M = np.array([[sx, 0, 0.5 * sx - 0.5 - x1b], [0, sy, 0.5 * sy - 0.5 - y1b]])
+    roi = canvas[y1a:y2a, x1a:x2a]
+    out = cv2.warpAffine(img, M, (x2a - x1a, y2a - y1a), dst=roi, flags=cv2.INTER_LINEAR,
+                         borderMode=cv2.BORDER_REPLICATE)
+    if not np.shares_memory(out, canvas):  # OpenCV allocated a new output
+        roi[:] = out
+
+
+def warp_tile(self, out, index, img, hw, a, b, M, perspective=0.0):
+    # Warps image index by M of random_perspective() into out, limited to the output pixels that come from region a of
+    # the mosaic canvas. Replaces paste_tile + random_perspective with a single warp from the tile source img of any
+    # size, decoded here when None (pixel centers as cv2.resize, the tile being the image resized to hw)
+    x1a, y1a, x2a, y2a = a
+    x1b, y1b = b[:2]
+    if x2a <= x1a or y2a <= y1a:
+        return
+    if img is None:
+        img = read_image(self, index)[0]
+    sy, sx = hw[0] / img.shape[0], hw[1] / img.shape[1]
+    A = np.array([[sx, 0, 0.5 * sx - 0.5 + x1a - x1b], [0, sy, 0.5 * sy - 0.5 + y1a - y1b], [0, 0, 1]])  # to canvas
+
+    # Output region of canvas region a, whose pixels span [x1a - 0.5, x2a - 0.5) x [y1a - 0.5, y2a - 0.5)
+    xy = np.array([[x1a, y1a, 1], [x2a, y1a, 1], [x2a, y2a, 1], [x1a, y2a, 1]]) - [0.5, 0.5, 0]
+    xy = xy @ M.T
+    xy = xy[:, :2] / xy[:, 2:3]
+    height, width = out.shape[:2]
+    axis_aligned = not perspective and M[0, 1] == 0 and M[1, 0] == 0  # region a maps to a rectangle
+    lo = np.ceil(xy.min(0)) if axis_aligned else np.floor(xy.min(0))
+    x1, y1 = lo.clip(0, [width, height]).astype(int)
+    x2, y2 = np.ceil(xy.max(0) + (0 if axis_aligned else 1)).clip(0, [width, height]).astype(int)
+    if x2 <= x1 or y2 <= y1:
+        return
+
+    K = np.array([[1, 0, -x1], [0, 1, -y1], [0, 0, 1]]) @ M @ A  # source to output roi
+    roi = out[y1:y2, x1:x2]
+    if axis_aligned:
+        warped = cv2.warpAffine(img, K[:2], (x2 - x1, y2 - y1), dst=roi, flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_REPLICATE)
+        if not np.shares_memory(warped, out):  # OpenCV allocated a new output
+            roi[:] = warped
+        return
+    if perspective:
+        warped = cv2.warpPerspective(img, K, (x2 - x1, y2 - y1), borderMode=cv2.BORDER_REPLICATE)
+    else:  # affine
+        warped = cv2.warpAffine(img, K[:2], (x2 - x1, y2 - y1), borderMode=cv2.BORDER_REPLICATE)
+    mask = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+    cv2.fillConvexPoly(mask, np.round((xy - [x1, y1]) * 256).astype(np.int32), 1, shift=8)  # 8 fractional bits
+    np.copyto(roi, warped, where=mask[..., None].astype(bool))
+
+
+def load_tiles(self, indices):
+    # Returns [(img, h, w)] of mosaic tiles, the uncached images decoded on decode_threads threads. With fused_resize
+    # or fused_warp these are returned as decoded, to be resized by the paste or warp
+    fused = self.fused_resize or self.fused_warp
+    todo = [i for i in indices if self.image_cache is None and self.imgs[i] is None]  # not cached
+
+    def load(i):
+        if i in todo:
+            if fused:
+                return (read_image(self, i)[0], *tile_shape(self, i))
+            img, _, (h, w) = decode_image(self, i)
+        else:
+            img, _, (h, w) = load_image(self, i)
+        return img, h, w
+
+    if self.decode_threads > 1 and len(todo) > 1:
+        return decode_pool(self.decode_threads).map(load, indices)
+    return [load(i) for i in indices]
+
+
+def load_warped(self, index, shape):
+    # Loads image index letterboxed to shape and augmented by random_perspective() in one warp from its source (the
+    # cached resized image or the decoded image) instead of resize, letterbox and warp. Returns img, labels, shapes
+    hyp = self.hyp
+    if self.image_cache is None and self.imgs[index] is None:
+        img, (h0, w0) = read_image(self, index)
+        r = self.img_size / max(h0, w0)
+        h, w = (int(h0 * r), int(w0 * r)) if r != 1 else (h0, w0)  # load_image() size
+    else:
+        img, (h0, w0), (h, w) = load_image(self, index)
+
+    # Letterbox geometry, as letterbox(auto=False)
+    new_shape = (shape, shape) if isinstance(shape, int) else shape
+    r = min(new_shape[0] / h, new_shape[1] / w)
+    if not self.augment:
+        r = min(r, 1.0)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    dw, dh = (new_shape[1] - nw) / 2, (new_shape[0] - nh) / 2
+    sy, sx = nh / img.shape[0], nw / img.shape[1]
+    A = np.array([[sx, 0, 0.5 * sx - 0.5 + int(round(dw - 0.1))],
+                  [0, sy, 0.5 * sy - 0.5 + int(round(dh - 0.1))],
+                  [0, 0, 1]])  # source to letterboxed image
+
+    M, s, (height, width) = random_perspective_matrix(new_shape, hyp['degrees'], hyp['translate'], hyp['scale'],
+                                                      hyp['shear'], hyp['perspective'])
+    if hyp['perspective']:
+        img = cv2.warpPerspective(img, M @ A, dsize=(width, height), borderValue=(114, 114, 114))
+    else:  # affine
+        img = cv2.warpAffine(img, (M @ A)[:2], dsize=(width, height), borderValue=(114, 114, 114))
+
+    labels = self.labels[index].copy()
+    if labels.size:  # normalized xywh to pixel xyxy format
+        labels[:, 1:] = xywhn2xyxy(labels[:, 1:], r * w, r * h, padw=dw, padh=dh)
+    labels = warp_targets(labels, (), M, s, width, height, hyp['perspective'])
+    return img, labels, ((h0, w0), ((h / h0, w / w0), (dw, dh)))  # img, labels, shapes for COCO mAP rescaling
+
+
+def mosaic_labels(self, indices, w, h, padw, padh):
+    # Returns the labels (n, 5) and segments of all tiles in mosaic pixel coordinates, transformed in one batch from
+    # normalized xywh with the per tile size w, h and offset padw, padh
+    labels = [self.labels[i] for i in indices]
+    segments = [x for i in indices for x in self.segments[i]]
+    p = np.array([w, h, padw, padh], dtype=np.float32).T  # (tiles, 4)
+    out = np.concatenate(labels, 0) if labels else np.zeros((0, 5), dtype=np.float32)
+    if len(out):
+        lp = np.repeat(p, [len(x) for x in labels], 0)
+        out[:, 1:] = xywhn2xyxy(out[:, 1:], lp[:, 0], lp[:, 1], lp[:, 2], lp[:, 3])  # normalized xywh to pixel xyxy
+    if segments:
+        n = [len(x) for x in segments]
+        sp = np.repeat(np.repeat(p, [len(self.segments[i]) for i in indices], 0), n, 0)
+        xy = xyn2xy(np.concatenate(segments, 0), sp[:, 0], sp[:, 1], sp[:, 2], sp[:, 3])
+        segments = np.split(xy, np.cumsum(n)[:-1])  # views into xy
+    return out, segments
+
+
 def load_mosaic(self, index):
     # loads images in a 4-mosaic
 
-    labels4, segments4 = [], []
     s = self.img_size
     yc, xc = [int(random.uniform(-x, 2 * s + x)) for x in self.mosaic_border]  # mosaic center x, y
     indices = [index] + random.choices(self.indices, k=3)  # 3 additional image indices
+    images = load_tiles(self, indices)
+    tiles = []
     for i, index in enumerate(indices):
         # Load image
-        img, _, (h, w) = load_image(self, index)
+        img, h, w = images[i]
 
         # place img in img4
         if i == 0:  # top left
-            img4 = np.full((s * 2, s * 2, img.shape[2]), 114, dtype=np.uint8)  # base image with 4 tiles
             x1a, y1a, x2a, y2a = max(xc - w, 0), max(yc - h, 0), xc, yc  # xmin, ymin, xmax, ymax (large image)
             x1b, y1b, x2b, y2b = w - (x2a - x1a), h - (y2a - y1a), w, h  # xmin, ymin, xmax, ymax (small image)
         elif i == 1:  # top right
@@ -731,52 +1271,26 @@ def load_mosaic(self, index):
             x1a, y1a, x2a, y2a = xc, yc, min(xc + w, s * 2), min(s * 2, yc + h)
             x1b, y1b, x2b, y2b = 0, 0, min(w, x2a - x1a), min(y2a - y1a, h)
 
-        img4[y1a:y2a, x1a:x2a] = img[y1b:y2b, x1b:x2b]  # img4[ymin:ymax, xmin:xmax]
-        padw = x1a - x1b
-        padh = y1a - y1b
-
-        # Labels
-        labels, segments = self.labels[index].copy(), self.segments[index].copy()
-        if labels.size:
-            labels[:, 1:] = xywhn2xyxy(labels[:, 1:], w, h, padw, padh)  # normalized xywh to pixel xyxy format
-            segments = [xyn2xy(x, w, h, padw, padh) for x in segments]
-        labels4.append(labels)
-        segments4.extend(segments)
-
-    # Concat/clip labels
-    labels4 = np.concatenate(labels4, 0)
-    for x in (labels4[:, 1:], *segments4):
-        np.clip(x, 0, 2 * s, out=x)  # clip when using random_perspective()
-    # img4, labels4 = replicate(img4, labels4)  # replicate
-
-    # Augment
-    #img4, labels4, segments4 = remove_background(img4, labels4, segments4)
-    #sample_segments(img4, labels4, segments4, probability=self.hyp['copy_paste'])
-    img4, labels4, segments4 = copy_paste(img4, labels4, segments4, probability=self.hyp['copy_paste'])
-    img4, labels4 = random_perspective(img4, labels4, segments4,
-                                       degrees=self.hyp['degrees'],
-                                       translate=self.hyp['translate'],
-                                       scale=self.hyp['scale'],
-                                       shear=self.hyp['shear'],
-                                       perspective=self.hyp['perspective'],
-                                       border=self.mosaic_border)  # border to remove
+        tiles.append((index, img, (h, w), (x1a, y1a, x2a, y2a), (x1b, y1b, x2b, y2b)))
 
-    return img4, labels4
+    # Assemble, augment
+    return build_mosaic(self, tiles)
 
 
 def load_mosaic9(self, index):
     # loads images in a 9-mosaic
 
-    labels9, segments9 = [], []
     s = self.img_size
     indices = [index] + random.choices(self.indices, k=8)  # 8 additional image indices
+    yc, xc = [int(random.uniform(0, s)) for _ in self.mosaic_border]  # mosaic center x, y
+    images = load_tiles(self, indices)
+    tiles = []
     for i, index in enumerate(indices):
         # Load image
-        img, _, (h, w) = load_image(self, index)
+        img, h, w = images[i]
 
-        # place img in img9
+        # place img in img9, which is cropped to img9[yc:yc + 2 * s, xc:xc + 2 * s] right away
         if i == 0:  # center
-            img9 = np.full((s * 3, s * 3, img.shape[2]), 114, dtype=np.uint8)  # base image with 4 tiles
             h0, w0 = h, w
             c = s, s, s + w, s + h  # xmin, ymin, xmax, ymax (base) coordinates
         elif i == 1:  # top
@@ -796,48 +1310,54 @@ def load_mosaic9(self, index):
         elif i == 8:  # top left
             c = s - w, s + h0 - hp - h, s, s + h0 - hp
 
-        padx, pady = c[:2]
-        x1, y1, x2, y2 = [max(x, 0) for x in c]  # allocate coords
-
-        # Labels
-        labels, segments = self.labels[index].copy(), self.segments[index].copy()
-        if labels.size:
-            labels[:, 1:] = xywhn2xyxy(labels[:, 1:], w, h, padx, pady)  # normalized xywh to pixel xyxy format
-            segments = [xyn2xy(x, w, h, padx, pady) for x in segments]
-        labels9.append(labels)
-        segments9.extend(segments)
+        padx, pady = c[0] - xc, c[1] - yc
+        x1, y1, x2, y2 = [min(max(x, 0), 2 * s) for x in (c[0] - xc, c[1] - yc, c[2] - xc, c[3] - yc)]  # allocate
 
         # Image
-        img9[y1:y2, x1:x2] = img[y1 - pady:, x1 - padx:]  # img9[ymin:ymax, xmin:xmax]
+        b = x1 - padx, y1 - pady, x2 - padx, y2 - pady  # tile region
+        tiles.append((index, img, (h, w), (x1, y1, x2, y2), b))
         hp, wp = h, w  # height, width previous
 
-    # Offset
-    yc, xc = [int(random.uniform(0, s)) for _ in self.mosaic_border]  # mosaic center x, y
-    img9 = img9[yc:yc + 2 * s, xc:xc + 2 * s]
+    # Assemble, augment
+    return build_mosaic(self, tiles)
 
-    # Concat/clip labels
-    labels9 = np.concatenate(labels9, 0)
-    labels9[:, [1, 3]] -= xc
-    labels9[:, [2, 4]] -= yc
-    c = np.array([xc, yc])  # centers
-    segments9 = [x - c for x in segments9]
 
-    for x in (labels9[:, 1:], *segments9):
-        np.clip(x, 0, 2 * s, out=x)  # clip when using random_perspective()
-    # img9, labels9 = replicate(img9, labels9)  # replicate
+def build_mosaic(self, tiles):
+    # Assembles the (2s, 2s) mosaic of tiles [(index, img, hw, a, b)], region b of each image pasted into region a, and
+    # augments it. With fused_warp every tile is warped from its source straight into the random_perspective() output
+    # instead of being pasted into a canvas that is warped afterwards (copy_paste needs the canvas and disables it)
+    s, hyp = self.img_size, self.hyp
+    indices, hw, a, b = zip(*[(t[0], t[2], t[3], t[4]) for t in tiles])
+    h, w = np.array(hw).T
+    pad = np.array(a)[:, :2] - np.array(b)[:, :2]
 
-    # Augment
-    #img9, labels9, segments9 = remove_background(img9, labels9, segments9)
-    img9, labels9, segments9 = copy_paste(img9, labels9, segments9, probability=self.hyp['copy_paste'])
-    img9, labels9 = random_perspective(img9, labels9, segments9,
-                                       degrees=self.hyp['degrees'],
-                                       translate=self.hyp['translate'],
-                                       scale=self.hyp['scale'],
-                                       shear=self.hyp['shear'],
-                                       perspective=self.hyp['perspective'],
-                                       border=self.mosaic_border)  # border to remove
+    # Labels, concat/clip
+    labels, segments = mosaic_labels(self, indices, w, h, pad[:, 0], pad[:, 1])
+    np.clip(labels[:, 1:], 0, 2 * s, out=labels[:, 1:])  # clip when using random_perspective()
+    for x in segments:
+        np.clip(x, 0, 2 * s, out=x)
+    # img4, labels4 = replicate(img4, labels4)  # replicate
 
-    return img9, labels9
+    # Augment
+    #img4, labels4, segments4 = remove_background(img4, labels4, segments4)
+    #sample_segments(img4, labels4, segments4, probability=self.hyp['copy_paste'])
+    warp = {k: hyp[k] for k in ('degrees', 'translate', 'scale', 'shear', 'perspective')}
+    c = 3 if tiles[0][1] is None else tiles[0][1].shape[2]  # channels
+    if self.fused_warp and not hyp['copy_paste']:
+        M, scale, (height, width) = random_perspective_matrix((s * 2, s * 2), **warp, border=self.mosaic_border)
+        img = np.full((height, width, c), 114, dtype=np.uint8)
+        for tile in tiles:
+            warp_tile(self, img, *tile, M, hyp['perspective'])
+        return img, warp_targets(labels, segments, M, scale, width, height, hyp['perspective'])
+
+    canvas = mosaic_canvas(self, (s * 2, s * 2, c))  # base image with all tiles
+    for tile in tiles:
+        paste_tile(self, canvas, *tile)
+    img, labels, segments = copy_paste(canvas, labels, segments, probability=hyp['copy_paste'])
+    img, labels = random_perspective(img, labels, segments, **warp, border=self.mosaic_border)  # border to remove
+    if img is canvas:  # not warped, the canvas is reused by the next mosaic
+        img = img.copy()
+    return img, labels
 
 
 def load_samples(self, index):
@@ -1019,13 +1539,33 @@ def random_perspective(img, targets=(), segments=(), degrees=10, translate=.1, s
     # torchvision.transforms.RandomAffine(degrees=(-10, 10), translate=(.1, .1), scale=(.9, 1.1), shear=(-10, 10))
     # targets = [cls, xyxy]
 
-    height = img.shape[0] + border[0] * 2  # shape(h,w,c)
-    width = img.shape[1] + border[1] * 2
+    M, s, (height, width) = random_perspective_matrix(img.shape[:2], degrees, translate, scale, shear, perspective,
+                                                      border)
+    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
+        if perspective:
+            img = cv2.warpPerspective(img, M, dsize=(width, height), borderValue=(114, 114, 114))
+        else:  # affine
+            img = cv2.warpAffine(img, M[:2], dsize=(width, height), borderValue=(114, 114, 114))
+
+    # Visualize
+    # import matplotlib.pyplot as plt
+    # ax = plt.subplots(1, 2, figsize=(12, 6))[1].ravel()
+    # ax[0].imshow(img[:, :, ::-1])  # base
+    # ax[1].imshow(img2[:, :, ::-1])  # warped
+
+    return img, warp_targets(targets, segments, M, s, width, height, perspective)
+
+
+def random_perspective_matrix(shape, degrees=10, translate=.1, scale=.1, shear=10, perspective=0.0, border=(0, 0)):
+    # Returns the random 3x3 transform M of random_perspective() for an image of shape (h, w), its scale and the
+    # (height, width) of the output
+    height = shape[0] + border[0] * 2  # shape(h,w,c)
+    width = shape[1] + border[1] * 2
 
     # Center
     C = np.eye(3)
-    C[0, 2] = -img.shape[1] / 2  # x translation (pixels)
-    C[1, 2] = -img.shape[0] / 2  # y translation (pixels)
+    C[0, 2] = -shape[1] / 2  # x translation (pixels)
+    C[1, 2] = -shape[0] / 2  # y translation (pixels)
 
     # Perspective
     P = np.eye(3)
@@ -1052,19 +1592,12 @@ def random_perspective(img, targets=(), segments=(), degrees=10, translate=.1, s
 
     # Combined rotation matrix
     M = T @ S @ R @ P @ C  # order of operations (right to left) is IMPORTANT
-    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
-        if perspective:
-            img = cv2.warpPerspective(img, M, dsize=(width, height), borderValue=(114, 114, 114))
-        else:  # affine
-            img = cv2.warpAffine(img, M[:2], dsize=(width, height), borderValue=(114, 114, 114))
+    return M, s, (height, width)
 
-    # Visualize
-    # import matplotlib.pyplot as plt
-    # ax = plt.subplots(1, 2, figsize=(12, 6))[1].ravel()
-    # ax[0].imshow(img[:, :, ::-1])  # base
-    # ax[1].imshow(img2[:, :, ::-1])  # warped
 
-    # Transform label coordinates
+def warp_targets(targets, segments, M, s, width, height, perspective=0.0):
+    # Transforms targets [cls, xyxy] (or their segments) by M of random_perspective() into an output of width x height
+    # and drops the boxes that became too small or too thin
     n = len(targets)
     if n:
         use_segments = any(x.any() for x in segments)
@@ -1100,7 +1633,7 @@ def random_perspective(img, targets=(), segments=(), degrees=10, translate=.1, s
         targets = targets[i]
         targets[:, 1:5] = new[i]
 
-    return img, targets
+    return targets
 
 
 def box_candidates(box1, box2, wh_thr=2, ar_thr=20, area_thr=0.1, eps=1e-16):  # box1(4,n), box2(4,n)
@@ -1156,7 +1689,48 @@ def cutout(image, labels):
             labels = labels[ioa < 0.60]  # remove >60% obscured labels
 
     return labels
-    
+
+
+def cutout_batch(img, targets, p=1.0):
+    # cutout() of a uint8 (b, c, h, w) batch in place, applied to each image with probability p. targets are
+    # [image, class, xywh] normalized; returns the targets that are not >60% obscured by a mask of scale > 0.03
+    b, c, h, w = img.shape
+    s = torch.tensor([0.5] * 1 + [0.25] * 2 + [0.125] * 4 + [0.0625] * 8 + [0.03125] * 16)  # image size fraction
+    n = len(s)
+    apply = torch.rand(b, 1) < p
+    if not apply.any():
+        return targets
+
+    # create random masks (b, n), empty for the images without cutout
+    mask_h = (torch.rand(b, n) * (h * s).long().clamp(min=1)).long() + 1
+    mask_w = (torch.rand(b, n) * (w * s).long().clamp(min=1)).long() + 1
+    xmin = ((torch.rand(b, n) * (w + 1)).long() - mask_w // 2).clamp(min=0)
+    ymin = ((torch.rand(b, n) * (h + 1)).long() - mask_h // 2).clamp(min=0)
+    xmax = torch.where(apply, (xmin + mask_w).clamp(max=w), xmin)
+    ymax = (ymin + mask_h).clamp(max=h)
+    colors = torch.randint(64, 192, (b, n + 1, c), dtype=torch.uint8)
+
+    # apply random color masks, later masks on top as in cutout()
+    device = img.device
+    y, x = torch.arange(h, device=device), torch.arange(w, device=device)
+    rows = (y >= ymin.to(device)[..., None]) & (y < ymax.to(device)[..., None])  # (b, n, h)
+    cols = (x >= xmin.to(device)[..., None]) & (x < xmax.to(device)[..., None])  # (b, n, w)
+    index = torch.zeros((b, h, w), dtype=torch.long, device=device)  # last mask covering each pixel, 0 for none
+    for j in range(n):
+        index.masked_fill_(rows[:, j, :, None] & cols[:, j, None, :], j + 1)
+    colors = colors.to(device).gather(1, index.view(b, -1, 1).expand(-1, -1, c)).view(b, h, w, c).permute(0, 3, 1, 2)
+    img.copy_(torch.where(index[:, None] > 0, colors, img))
+
+    # return unobscured labels
+    if len(targets):
+        boxes = torch.stack((xmin / w, ymin / h, xmax / w, ymax / h), 2)[:, s > 0.03]  # (b, m, 4) normalized
+        t = xywh2xyxy(targets[:, 2:6])
+        m = boxes[targets[:, 0].long()]  # masks of each target's image
+        inter = (torch.minimum(t[:, None, 2:], m[..., 2:]) - torch.maximum(t[:, None, :2], m[..., :2])).clamp(0).prod(2)
+        ioa = inter / ((t[:, 2:] - t[:, :2]).prod(1, keepdim=True) + 1e-16)  # intersection over target area
+        targets = targets[(ioa < 0.60).all(1)]  # remove >60% obscured labels
+    return targets
+
 
 def pastein(image, labels, sample_labels, sample_images, sample_masks):
     # Applies image cutout augmentation https://arxiv.org/abs/1708.04552
@@ -1240,6 +1814,35 @@ class Albumentations:
         return im, labels
 
 
+class BatchAugment:
+    # Batch-level augmentation of a collated uint8 (b, 3, h, w) RGB batch and its targets [image, class, xywh]
+    # normalized, replacing the per-sample HSV and flip augmentation of LoadImagesAndLabels (hyp batch_augment) and
+    # adding cutout (hyp cutout probability). Parameters are drawn per sample and applied to the whole batch with torch
+    # ops on the batch device, i.e. on the GPU after the host to device copy, which moves this work off the loader
+    # workers
+    def __init__(self, hyp):
+        self.hyp = hyp
+
+    def __call__(self, img, targets):
+        hyp = self.hyp
+        if hyp['hsv_h'] or hyp['hsv_s'] or hyp['hsv_v']:
+            augment_hsv_batch(img, hgain=hyp['hsv_h'], sgain=hyp['hsv_s'], vgain=hyp['hsv_v'])
+
+        # Apply cutouts
+        if hyp.get('cutout', 0.0):
+            targets = cutout_batch(img, targets, p=hyp['cutout'])
+
+        # flip up-down, left-right
+        for p, dim, col in (hyp['flipud'], 2, 3), (hyp['fliplr'], 3, 2):
+            i = torch.rand(img.shape[0]) < p
+            if i.any():
+                j = i.nonzero()[:, 0].to(img.device)
+                img[j] = img[j].flip(dim)
+                k = i[targets[:, 0].long()]
+                targets[k, col] = 1 - targets[k, col]
+        return img, targets
+
+
 def create_folder(path='./new'):
     # Create folder
     if os.path.exists(path):
@@ -606,14 +606,27 @@ def box_diou(box1, box2, eps: float = 1e-7):
 
 
 def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False,
-                        labels=()):
-    """Runs Non-Maximum Suppression (NMS) on inference results
+                        labels=(), batched=False, max_candidates=0, max_class_candidates=0):
+    """Runs Non-Maximum Suppression (NMS) on inference results, image by image or with batched=True on the whole batch
+    at once (non_max_suppression_batched)
+
+    conf_thres is a float or a list of per-class thresholds. Before boxes are converted and expanded to detections,
+    max_candidates limits the candidates of each image to those with the highest conf and max_class_candidates to
+    the highest of each class (prune_candidates)
 
     Returns:
          list of detections, on (n,6) tensor per image [xyxy, conf, cls]
     """
 
+    if batched:
+        return non_max_suppression_batched(prediction, conf_thres, iou_thres, classes, agnostic, multi_label, labels,
+                                           max_candidates, max_class_candidates)
+
     nc = prediction.shape[2] - 5  # number of classes
+    class_thres = isinstance(conf_thres, (list, tuple))  # per-class thresholds
+    prune_thres = torch.tensor(conf_thres, device=prediction.device) if class_thres else conf_thres
+    conf_thres = min(conf_thres) if class_thres else conf_thres
+    prune = class_thres or max_candidates or max_class_candidates
     xc = prediction[..., 4] > conf_thres  # candidates
 
     # Settings
@@ -631,6 +644,7 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
         # Apply constraints
         # x[((x[..., 2:4] < min_wh) | (x[..., 2:4] > max_wh)).any(1), 4] = 0  # width-height
         x = x[xc[xi]]  # confidence
+        n = x.shape[0]  # number of candidates
 
         # Cat apriori labels if autolabelling
         if labels and len(labels[xi]):
@@ -651,6 +665,8 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
                                  # so there is no need to multiplicate.
         else:
             x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+        if prune:  # per-class thresholds, top-k candidates
+            x[:n, 5:] = prune_candidates(x[:n, 5:], prune_thres, max_candidates, max_class_candidates)
 
         # Box (center x, center y, width, height) to (x1, y1, x2, y2)
         box = xywh2xyxy(x[:, :4])
@@ -700,6 +716,135 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
     return output
 
 
+def non_max_suppression_batched(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False,
+                                multi_label=False, labels=(), max_candidates=0, max_class_candidates=0):
+    """Runs Non-Maximum Suppression (NMS) on all images of a batch at once: candidates of all images are filtered,
+    scored, converted and limited in one vectorized pass and on CUDA go through a single torchvision.ops.nms() call
+    with boxes offset by class and image. Same detections as non_max_suppression(), without its time limit
+
+    Returns:
+         list of detections, on (n,6) tensor per image [xyxy, conf, cls]
+    """
+
+    bs, nc = prediction.shape[0], prediction.shape[2] - 5  # batch size, number of classes
+
+    # Settings
+    max_wh = 4096  # (pixels) maximum box width and height
+    max_det = 300  # maximum number of detections per image
+    max_nms = 30000  # maximum number of boxes per image into torchvision.ops.nms()
+    redundant = True  # require redundant detections
+    multi_label &= nc > 1  # multiple labels per box
+    merge = False  # use merge-NMS
+    class_thres = isinstance(conf_thres, (list, tuple))  # per-class thresholds
+    prune_thres = torch.tensor(conf_thres, device=prediction.device) if class_thres else conf_thres
+    conf_thres = min(conf_thres) if class_thres else conf_thres
+    prune = class_thres or max_candidates or max_class_candidates
+
+    b, a = (prediction[..., 4] > conf_thres).nonzero(as_tuple=True)  # image and anchor index of candidates
+    x = prediction[b, a]
+
+    # Compute conf, for models with one class cls_conf is always 0.5 and conf is obj_conf
+    conf = x[:, 4:5] if nc == 1 else x[:, 5:] * x[:, 4:5]  # conf = obj_conf * cls_conf
+    xywh = x[:, :4]
+    if prune:  # per-class thresholds, top-k candidates
+        conf = prune_candidates_per_image(b, conf, prune_thres, max_candidates, max_class_candidates)
+
+    # Cat apriori labels if autolabelling
+    if labels and sum(len(l) for l in labels):
+        l = torch.cat(tuple(labels), 0)
+        v = torch.zeros((len(l), conf.shape[1]), device=conf.device, dtype=conf.dtype)
+        v[range(len(l)), l[:, 0].long()] = 1.0  # conf
+        xywh, conf = torch.cat((xywh, l[:, 1:5].to(xywh.dtype)), 0), torch.cat((conf, v), 0)
+        lb = torch.arange(len(labels), device=b.device).repeat_interleave(
+            torch.tensor([len(l) for l in labels], device=b.device))
+        b = torch.cat((b, lb), 0)
+    box = xywh2xyxy(xywh)
+
+    # Detections (box, conf, cls, image) with conf > conf_thres
+    if multi_label:
+        i, j = (conf > conf_thres).nonzero(as_tuple=True)
+        box, conf, b = box[i], conf[i, j], b[i]
+    else:  # best class only
+        conf, j = conf.max(1)
+        i = conf > conf_thres
+        box, conf, j, b = box[i], conf[i], j[i], b[i]
+
+    # Filter by class
+    if classes is not None:
+        i = (j[:, None] == torch.tensor(classes, device=j.device)).any(1)
+        box, conf, j, b = box[i], conf[i], j[i], b[i]
+
+    # Check shape
+    n = conf.shape[0]  # number of boxes
+    if not n:  # no boxes
+        return [torch.zeros((0, 6), device=prediction.device)] * bs
+    i = top_k_per_image(b, conf, max_nms)  # sort by image and confidence, limit boxes per image
+    box, conf, j, b = box[i], conf[i], j[i], b[i]
+
+    # Batched NMS
+    c = j * (0 if agnostic else max_wh)  # classes
+    offset = torch.stack((c, c + b * max_wh), 1).repeat(1, 2)  # diagonal by class, along y by image
+    boxes, scores = box.float() + offset, conf.float()  # boxes (offset by class and image), scores
+    if boxes.is_cuda:
+        i = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS
+    else:  # the CPU kernel is quadratic in the number of boxes, run it on the boxes of each image
+        nb = torch.bincount(b).tolist()  # boxes per image
+        i = torch.cat([torchvision.ops.nms(x, s, iou_thres) + k for x, s, k in
+                       zip(boxes.split(nb), scores.split(nb), np.cumsum([0] + nb[:-1]).tolist())])
+    i = i[top_k_per_image(b[i], scores[i], max_det)]  # limit detections, sort by image
+    if merge and (1 < n < 3E3):  # Merge NMS (boxes merged using weighted mean)
+        # update boxes as boxes(i,4) = weights(i,n) * boxes(n,4)
+        iou = box_iou(boxes[i], boxes) > iou_thres  # iou matrix
+        weights = iou * scores[None]  # box weights
+        box[i] = (torch.mm(weights, box.float()) / weights.sum(1, keepdim=True)).to(box.dtype)  # merged boxes
+        if redundant:
+            i = i[iou.sum(1) > 1]  # require redundancy
+
+    x = torch.cat((box[i], conf[i, None], j[i, None].float()), 1)
+    return list(x.split(torch.bincount(b[i], minlength=bs).tolist()))
+
+
+def prune_candidates(conf, conf_thres, topk=0, class_topk=0):
+    # Zeroes the (..., n, nc) conf of candidates not above conf_thres (a float or per-class thresholds), outside the
+    # topk candidates of highest conf and outside the class_topk highest of their class, along dim -2 with torch.topk()
+    conf = conf * (conf > conf_thres)
+    if topk and conf.shape[-2] > topk:
+        i = conf.amax(-1).topk(topk, -1).indices
+        keep = torch.zeros(conf.shape[:-1], dtype=torch.bool, device=conf.device).scatter_(-1, i, True)
+        conf = conf * keep[..., None]
+    if class_topk and conf.shape[-2] > class_topk:
+        i = conf.topk(class_topk, -2).indices
+        conf = conf * torch.zeros_like(conf, dtype=torch.bool).scatter_(-2, i, True)
+    return conf
+
+
+def prune_candidates_per_image(b, conf, conf_thres, topk=0, class_topk=0):
+    # prune_candidates() of the (n, nc) conf of the candidates of all images, b the image index of each candidate,
+    # ranked within each image (and class) by top_k_per_image() instead of padding the images to one candidate count
+    conf = conf * (conf > conf_thres)
+    if topk:
+        keep = torch.zeros(len(b), dtype=torch.bool, device=b.device)
+        keep[top_k_per_image(b, conf.amax(1), topk)] = True
+        conf = conf * keep[:, None]
+    if class_topk:
+        i, j = conf.nonzero(as_tuple=True)  # the zeros stay zero either way
+        k = top_k_per_image(b[i] * conf.shape[1] + j, conf[i, j], class_topk)  # ranked within image and class
+        keep = torch.zeros_like(conf, dtype=torch.bool)
+        keep[i[k], j[k]] = True
+        conf = conf * keep
+    return conf
+
+
+def top_k_per_image(b, scores, k):
+    # Returns the indices of the k highest scores (in [0, 1]) of every image, b the image index of each score, ordered
+    # by image and then by descending score
+    i = (b.double() * 2 - scores.double()).argsort()
+    b = b[i]
+    n = torch.bincount(b)
+    rank = torch.arange(len(b), device=b.device) - (n.cumsum(0) - n)[b]  # rank within image
+    return i[rank < k]
+
+
 def non_max_suppression_kpt(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False,
                         labels=(), kpt_label=False, nc=None, nkpt=None):
     """Runs Non-Maximum Suppression (NMS) on inference results
@@ -9,6 +9,11 @@ from pathlib import Path
 import requests
 import torch
 
+try:  # shared content-addressed weights store of the training pipeline (optional)
+    from object.utils.weights_store import WeightsStore
+except ImportError:
+    WeightsStore = None
+
 
 def gsutil_getsize(url=''):
     # gs://bucket/file size https://cloud.google.com/storage/docs/gsutil/commands/du
@@ -20,6 +25,13 @@ def attempt_download(file, repo='WongKinYiu/yolov7'):
     # Attempt file download if does not exist
     file = Path(str(file).strip().replace("'", '').lower())
 
+    store = WeightsStore.from_env() if WeightsStore is not None else None
+    if not file.exists() and store is not None:  # verified copy already on this host, no network needed
+        blob = store.find(file.name)
+        if blob is not None:
+            store.materialize(blob, file)
+            return
+
     if not file.exists():
         try:
             response = requests.get(f'https://api.github.com/repos/{repo}/releases/latest').json()  # github api
@@ -37,7 +49,10 @@ def attempt_download(file, repo='WongKinYiu/yolov7'):
             try:  # GitHub
                 url = f'https://github.com/{repo}/releases/download/{tag}/{name}'
                 print(f'Downloading {url} to {file}...')
-                torch.hub.download_url_to_file(url, file)
+                if store is not None:
+                    store.fetch(url, file)
+                else:
+                    torch.hub.download_url_to_file(url, file)
                 assert file.exists() and file.stat().st_size > 1E6  # check
             except Exception as e:  # GCP
                 print(f'Download error: {e}')
@@ -0,0 +1,275 @@
+# Image caches shared between DataLoader workers and DDP ranks: RAM (shared memory) and disk (memory-mapped shards)
+
+import atexit
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+
+ARENA_ALIGN = 64  # bytes
+COUNTER_SLOTS = 1024  # (hits, misses) counters per process, slot = pid % COUNTER_SLOTS
+_created = set()  # names of the arenas created by this process, unlinked when it exits
+DISK_CACHE_VERSION = 1
+DISK_CACHE_SHARD_BYTES = 2 ** 30  # bytes per shard file
+CODECS = {}  # name: (encode, decode), decode None for images stored raw
+
+
+def register_codec(name, encode, decode=None):
+    # Adds a disk image cache codec: encode(buffer) -> bytes, decode(buffer) -> bytes; decode=None stores images raw
+    CODECS[name] = encode, decode
+
+
+register_codec('none', lambda b: b)  # read zero-copy from the mapped shard
+register_codec('zlib', lambda b: zlib.compress(b, 1), zlib.decompress)
+if lz4_frame is not None:
+    register_codec('lz4', lz4_frame.compress, lz4_frame.decompress)
+
+
+def resized_shapes(shapes, img_size):
+    # Returns the (n, 2) original and resized hw of images with (n, 2) wh shapes, as load_image resizes them
+    hw0 = np.asarray(shapes, dtype=np.int64)[:, ::-1]
+    hw = np.array([(int(h0 * r), int(w0 * r)) if r != 1 else (h0, w0)
+                   for h0, w0, r in ((h0, w0, img_size / max(h0, w0)) for h0, w0 in hw0.tolist())],
+                  dtype=np.int64).reshape(-1, 2)
+    return hw0, hw
+
+
+def image_cache_key(files, stats, *args):
+    # Returns a hash identifying a cache of files with (n, 2) size and mtime stats, loaded with settings args
+    h = hashlib.sha1('\n'.join(files).encode('utf-8'))
+    h.update(np.ascontiguousarray(stats, dtype=np.int64).tobytes())
+    h.update(repr(args).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _align(n):
+    return -(-n // ARENA_ALIGN) * ARENA_ALIGN
+
+
+class _SharedMemory(shared_memory.SharedMemory):
+    def close(self):
+        try:
+            super().close()
+        except BufferError:  # images handed out are still alive, the mapping is released together with them
+            pass
+
+
+class SharedImageCache:
+    # RAM image cache in one contiguous shared-memory arena: [filled flags | hit/miss counters | images at offsets].
+    # The arena is named after the dataset key, so every rank on a node attaches to the same segment and images are
+    # decoded once per node. Images are served as read-only views into the arena; DataLoader workers inherit the
+    # mapping (fork) or re-attach by name (spawn), and no per-image Python objects exist whose refcounts would
+    # trigger copy-on-write of the pixel data.
+
+    def __init__(self, key, hw0, hw, channels=3):
+        self.key, self.channels = key, channels
+        self.hw0, self.hw = np.asarray(hw0, dtype=np.int64), np.asarray(hw, dtype=np.int64)
+        self.n = len(self.hw)
+        self.offsets = np.concatenate(([0], np.cumsum(self.hw.prod(1) * channels))).astype(np.int64)
+        self.data_start = _align(self.n + COUNTER_SLOTS * 2 * 8)
+        self.counters_start = _align(self.n)
+        self.nbytes = int(self.offsets[-1])  # image bytes
+        self.size = self.data_start + self.nbytes
+        self.name = 'y7img_' + key[:24]
+        self.created = False
+        self.shm = None
+        self._attach()
+
+    def _attach(self):
+        try:
+            self.shm = _SharedMemory(name=self.name)
+            if sys.version_info < (3, 13) and not self.created and self.name not in _created:
+                # attaching from another rank must not unlink the segment when that rank exits
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        except FileNotFoundError:
+            shm_dir = '/dev/shm'
+            if os.path.isdir(shm_dir) and shutil.disk_usage(shm_dir).free < self.size:
+                raise MemoryError(f'{self.size / 1E9:.1f}GB image cache exceeds free space in {shm_dir}')
+            try:
+                self.shm, self.created = _SharedMemory(name=self.name, create=True, size=self.size), True
+                _created.add(self.name)
+                atexit.register(self.shm.unlink)
+            except FileExistsError:  # created concurrently by another rank
+                return self._attach()
+        if self.shm.size < self.size:
+            raise ValueError(f'Shared memory {self.name} is smaller than the image cache')
+        buf = self.shm.buf
+        self.filled = np.frombuffer(buf, dtype=np.uint8, count=self.n)
+        self.counters = np.frombuffer(buf, dtype=np.int64, count=COUNTER_SLOTS * 2,
+                                      offset=self.counters_start).reshape(COUNTER_SLOTS, 2)
+        self.data = np.frombuffer(buf, dtype=np.uint8, count=self.nbytes, offset=self.data_start)
+
+    def __getstate__(self):  # spawned workers re-attach by name, sharing the resource tracker of their parent
+        state = self.__dict__.copy()
+        for k in ('shm', 'filled', 'counters', 'data'):
+            state.pop(k, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = None
+        self._attach()
+
+    def put(self, index, img):
+        # Stores img (as decoded by load_image) at index, returns False if its shape differs from the index
+        h, w = self.hw[index]
+        if img is None or img.shape != (h, w, self.channels) or img.dtype != np.uint8:
+            return False
+        self.data[self.offsets[index]:self.offsets[index + 1]] = img.reshape(-1)
+        self.filled[index] = 1  # set after the copy, readers never see partial images
+        return True
+
+    def get(self, index):
+        # Returns (img, hw_original, hw_resized) of a cached image as a read-only view, or None on a miss
+        slot = os.getpid() % COUNTER_SLOTS
+        if not self.filled[index]:
+            self.counters[slot, 1] += 1
+            return None
+        self.counters[slot, 0] += 1
+        h, w = self.hw[index]
+        img = self.data[self.offsets[index]:self.offsets[index + 1]].reshape(h, w, self.channels)
+        img.flags.writeable = False
+        return img, tuple(self.hw0[index]), (h, w)
+
+    def fill(self, load, threads=8):
+        # Decodes and stores every image not cached yet with load(index) -> img, returns the number decoded
+        todo = np.flatnonzero(self.filled == 0)
+        if len(todo):
+            with ThreadPool(threads) as pool:
+                for i, img in pool.imap(lambda i: (i, load(i)), todo.tolist()):
+                    if not self.put(i, img):
+                        logger.warning(f'WARNING: image {i} has an unexpected shape and will not be cached')
+        return len(todo)
+
+    def stats(self):
+        # Returns cache occupancy and the hit rate of all processes using the cache
+        hits, misses = (int(x) for x in self.counters.sum(0))
+        return {'images': self.n, 'cached': int(self.filled.sum()), 'bytes': self.nbytes,
+                'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+
+    def close(self):
+        self.filled = self.counters = self.data = None  # release exported buffers before closing
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+
+class DiskImageCache:
+    # Pre-resized images packed into a few large shard files in cache_dir, with an index.npz of shard, offset, size and
+    # shapes per image. Shards are memory-mapped once per process: with the 'none' codec images are read-only views
+    # straight from the page cache, other codecs (see register_codec) decode from the mapped bytes. Rebuilding after
+    # the dataset changed re-decodes only new or modified images and swaps the index atomically.
+
+    def __init__(self, cache_dir, files, stats, settings=(), codec='none', shard_bytes=DISK_CACHE_SHARD_BYTES,
+                 channels=3):
+        if codec not in CODECS:
+            raise ValueError(f'Unknown image cache codec {codec}, available codecs are {sorted(CODECS)}')
+        self.cache_dir, self.files, self.file_stats = Path(cache_dir), list(files), np.asarray(stats, dtype=np.int64)
+        self.codec, self.shard_bytes, self.channels = codec, shard_bytes, channels
+        self.key = image_cache_key(self.files, self.file_stats, *settings, codec, channels)
+        self.index_path = self.cache_dir / 'index.npz'
+        self._shards = {}  # shard file name: memory map, opened lazily per process
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with np.load(self.index_path, allow_pickle=False) as x:
+                index = {k: x[k] for k in x.files}
+            assert int(index['version']) == DISK_CACHE_VERSION and str(index['codec']) == self.codec
+            return index
+        except Exception:
+            return None
+
+    @property
+    def valid(self):
+        return self.index is not None and str(self.index['key']) == self.key
+
+    def __getstate__(self):  # spawned workers map the shards themselves
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def _read(self, index, i):
+        name, o = str(index['shards'][index['shard'][i]]), int(index['offset'][i])
+        if name not in self._shards:
+            self._shards[name] = np.memmap(self.cache_dir / name, dtype=np.uint8, mode='r')
+        return self._shards[name][o:o + int(index['nbytes'][i])]
+
+    def build(self, load, threads=8):
+        # Writes the cache if it does not match the dataset, load(i) -> (img, hw_original, hw_resized) decodes image
+        # i. Images whose file is unchanged are copied over from the current cache. Returns the number decoded
+        if self.valid:
+            return 0
+        old, reuse = self.index, {}
+        if old is not None:
+            reuse = {f: j for j, (f, st) in enumerate(zip(old['files'].tolist(), old['stats'])) if st[0] >= 0}
+        encode = CODECS[self.codec][0]
+
+        def encoded(i):
+            j = reuse.get(self.files[i])
+            if j is not None and (old['stats'][j] == self.file_stats[i]).all():
+                return self._read(old, j), old['hw0'][j], old['hw'][j], False
+            img, hw0, hw = load(i)
+            return encode(np.ascontiguousarray(img).reshape(-1)), hw0, hw, True
+
+        n = len(self.files)
+        shard, offset, nbytes = np.zeros(n, dtype=np.int32), np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+        hw0, hw = np.zeros((n, 2), dtype=np.int64), np.zeros((n, 2), dtype=np.int64)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        shards, f, decoded = [], None, 0
+        try:
+            with ThreadPool(threads) as pool:
+                for i, (data, hw0_i, hw_i, d) in enumerate(pool.imap(encoded, range(n))):
+                    size = memoryview(data).nbytes
+                    if f is None or (f.tell() + size > self.shard_bytes and f.tell()):
+                        if f is not None:
+                            f.close()
+                        shards.append(f'shard_{self.key[:8]}_{len(shards):03d}.bin')
+                        f = open(self.cache_dir / (shards[-1] + '.tmp'), 'wb')
+                    f.write(b'\0' * (_align(f.tell()) - f.tell()))  # aligned, zero-copy views
+                    shard[i], offset[i], nbytes[i], hw0[i], hw[i] = len(shards) - 1, f.tell(), size, hw0_i, hw_i
+                    f.write(data)
+                    decoded += d
+        finally:
+            if f is not None:
+                f.close()
+        for name in shards:  # replaced files stay valid for processes still mapping them
+            os.replace(self.cache_dir / (name + '.tmp'), self.cache_dir / name)
+        tmp = self.cache_dir / f'index.{os.getpid()}.tmp.npz'
+        np.savez(tmp, version=DISK_CACHE_VERSION, key=self.key, codec=self.codec, files=np.array(self.files),
+                 stats=self.file_stats, shards=np.array(shards, dtype=str), shard=shard, offset=offset, nbytes=nbytes,
+                 hw0=hw0, hw=hw)
+        os.replace(tmp, self.index_path)
+        for p in self.cache_dir.glob('shard_*.bin'):  # shards of earlier versions of the cache
+            if p.name not in shards:
+                p.unlink()
+        self.index, self._shards = self._load_index(), {}
+        return decoded
+
+    def get(self, index):
+        # Returns (img, hw_original, hw_resized) of image index, a read-only view into the mapped shard for codec 'none'
+        x = self.index
+        h, w = (int(v) for v in x['hw'][index])
+        data, decode = self._read(x, index), CODECS[self.codec][1]
+        img = (np.frombuffer(decode(data), dtype=np.uint8) if decode else np.asarray(data)).reshape(h, w, self.channels)
+        return img, tuple(int(v) for v in x['hw0'][index]), (h, w)
+
+    def stats(self):
+        # Returns the number of cached images and their size on disk and in memory
+        x = self.index
+        return {'images': len(x['nbytes']), 'cached': len(x['nbytes']), 'bytes': int(x['nbytes'].sum()),
+                'raw_bytes': int((x['hw'].prod(1) * self.channels).sum()), 'shards': len(x['shards'])}
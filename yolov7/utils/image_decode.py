@@ -0,0 +1,69 @@
+# Image decoders of LoadImagesAndLabels, selectable per dataset. The reduced decoders use JPEG DCT-domain downscaling
+# to decode at the smallest 1/2, 1/4 or 1/8 scale whose longest side is still at least the training image size
+
+import math
+import os
+from multiprocessing.pool import ThreadPool
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+DECODERS = {}  # name: decode(path, reduction) -> (BGR img, reduction applied)
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}
+_pools = {}  # pid: (threads, decode thread pool) of that process
+
+
+def register_decoder(name, decode):
+    # Adds an image decoder: decode(path, reduction) -> (BGR img, reduction applied), reduction a power of 2 <= 8 the
+    # image may be downscaled by while decoding
+    DECODERS[name] = decode
+
+
+def reduction(shape, img_size):
+    # Returns the largest of 1, 2, 4, 8 that keeps the longest side of an image of shape (w, h) >= img_size
+    k = 1
+    while k < 8 and max(shape) / (k * 2) >= img_size:
+        k *= 2
+    return k
+
+
+def decode_cv2(path, reduction=1):
+    # Full resolution cv2.imread(), the reference decoder
+    return cv2.imread(path), 1  # BGR
+
+
+def decode_cv2_reduced(path, reduction=1):
+    # cv2.imread() with IMREAD_REDUCED_COLOR_<reduction>, libjpeg DCT scaling for JPEGs (resized after decoding for
+    # other formats)
+    return cv2.imread(path, REDUCED_FLAGS[reduction]), reduction  # BGR
+
+
+def decode_pil_draft(path, reduction=1):
+    # PIL with Image.draft() DCT scaling for JPEGs; other formats are decoded at full resolution
+    with Image.open(path) as im:
+        w, h = im.size
+        if reduction > 1:
+            im.draft('RGB', (math.ceil(w / reduction), math.ceil(h / reduction)))
+        k = round(w / im.size[0])  # reduction applied
+        im = ImageOps.exif_transpose(im).convert('RGB')
+        return np.ascontiguousarray(np.asarray(im)[..., ::-1]), k  # RGB to BGR
+
+
+register_decoder('cv2', decode_cv2)
+register_decoder('cv2-reduced', decode_cv2_reduced)
+register_decoder('pil-draft', decode_pil_draft)
+
+
+def decode_pool(threads):
+    # Returns this process' thread pool of >= threads threads for batch decoding (OpenCV and PIL release the GIL while
+    # decoding); pools are per pid as they do not survive the fork into DataLoader workers
+    n, pool = _pools.get(os.getpid(), (0, None))
+    if n < threads:
+        if pool is not None:
+            pool.close()
+        pool = ThreadPool(threads)
+        _pools[os.getpid()] = threads, pool
+    return pool
+
@@ -29,27 +29,33 @@ def ap_per_class(tp, conf, pred_cls, target_cls, v5_metric=False, plot=False, sa
         The average precision as computed in py-faster-rcnn.
     """
 
+    # Find unique classes
+    unique_classes, nt = np.unique(target_cls, return_counts=True)  # classes, number of labels
+    return pr_metrics(tp, 1 - tp, conf, pred_cls, unique_classes, nt, v5_metric, plot, save_dir, names)
+
+
+def pr_metrics(tp, fp, conf, pred_cls, unique_classes, nt, v5_metric=False, plot=False, save_dir='.', names=()):
+    # ap_per_class() of predictions with tp and fp counts (nparray, nx1 or nx10), single predictions (0 or 1) or groups
+    # of predictions of the same confidence and class, and nt labels of each of unique_classes
+
     # Sort by objectness
     i = np.argsort(-conf)
-    tp, conf, pred_cls = tp[i], conf[i], pred_cls[i]
-
-    # Find unique classes
-    unique_classes = np.unique(target_cls)
-    nc = unique_classes.shape[0]  # number of classes, number of detections
+    tp, fp, conf, pred_cls = tp[i], fp[i], conf[i], pred_cls[i]
+    nc = unique_classes.shape[0]  # number of classes
 
     # Create Precision-Recall curve and compute AP for each class
     px, py = np.linspace(0, 1, 1000), []  # for plotting
     ap, p, r = np.zeros((nc, tp.shape[1])), np.zeros((nc, 1000)), np.zeros((nc, 1000))
     for ci, c in enumerate(unique_classes):
         i = pred_cls == c
-        n_l = (target_cls == c).sum()  # number of labels
+        n_l = nt[ci]  # number of labels
         n_p = i.sum()  # number of predictions
 
         if n_p == 0 or n_l == 0:
             continue
         else:
             # Accumulate FPs and TPs
-            fpc = (1 - tp[i]).cumsum(0)
+            fpc = fp[i].cumsum(0)
             tpc = tp[i].cumsum(0)
 
             # Recall
@@ -60,11 +66,10 @@ def ap_per_class(tp, conf, pred_cls, target_cls, v5_metric=False, plot=False, sa
             precision = tpc / (tpc + fpc)  # precision curve
             p[ci] = np.interp(-px, -conf[i], precision[:, 0], left=1)  # p at pr_score
 
-            # AP from recall-precision curve
-            for j in range(tp.shape[1]):
-                ap[ci, j], mpre, mrec = compute_ap(recall[:, j], precision[:, j], v5_metric=v5_metric)
-                if plot and j == 0:
-                    py.append(np.interp(px, mrec, mpre))  # precision at mAP@0.5
+            # AP from recall-precision curves, all IoU thresholds at once
+            ap[ci], mpre, mrec = compute_ap(recall, precision, v5_metric=v5_metric)
+            if plot:
+                py.append(np.interp(px, mrec[:, 0], mpre[:, 0]))  # precision at mAP@0.5
 
     # Compute F1 (harmonic mean of precision and recall)
     f1 = 2 * p * r / (p + r + 1e-16)
@@ -81,33 +86,73 @@ def ap_per_class(tp, conf, pred_cls, target_cls, v5_metric=False, plot=False, sa
 def compute_ap(recall, precision, v5_metric=False):
     """ Compute the average precision, given the recall and precision curves
     # Arguments
-        recall:    The recall curve (list)
-        precision: The precision curve (list)
+        recall:    The recall curve (list), or one curve per column (nparray, nx1 or nx10)
+        precision: The precision curve (list), or one curve per column (nparray, nx1 or nx10)
         v5_metric: Assume maximum recall to be 1.0, as in YOLOv5, MMDetetion etc.
     # Returns
-        Average precision, precision curve, recall curve
+        Average precision (one per column for 2-D curves), precision curve, recall curve
     """
 
-    # Append sentinel values to beginning and end
+    # Append sentinel values to beginning and end, of every curve as a row
+    recall, precision = np.asarray(recall, dtype=np.float64), np.asarray(precision, dtype=np.float64)
+    r, p = recall.reshape(len(recall), -1).T, precision.reshape(len(precision), -1).T  # curves as rows
+    mrec, mpre = np.empty((len(r), r.shape[1] + 2)), np.empty((len(p), p.shape[1] + 2))
+    mrec[:, 0], mrec[:, 1:-1] = 0., r
     if v5_metric:  # New YOLOv5 metric, same as MMDetection and Detectron2 repositories
-        mrec = np.concatenate(([0.], recall, [1.0]))
+        mrec[:, -1] = 1.0
     else:  # Old YOLOv5 metric, i.e. default YOLOv7 metric
-        mrec = np.concatenate(([0.], recall, [recall[-1] + 0.01]))
-    mpre = np.concatenate(([1.], precision, [0.]))
+        mrec[:, -1] = r[:, -1] + 0.01
+    mpre[:, 0], mpre[:, 1:-1], mpre[:, -1] = 1., p, 0.
 
-    # Compute the precision envelope
-    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    # Compute the precision envelopes, in place
+    np.maximum.accumulate(mpre[:, ::-1], 1, out=mpre[:, ::-1])
 
     # Integrate area under curve
     method = 'interp'  # methods: 'continuous', 'interp'
     if method == 'interp':
         x = np.linspace(0, 1, 101)  # 101-point interp (COCO)
-        ap = np.trapz(np.interp(x, mrec, mpre), x)  # integrate
+        ap = np.trapz(np.stack([np.interp(x, r, p) for r, p in zip(mrec, mpre)]), x)  # integrate
     else:  # 'continuous'
-        i = np.where(mrec[1:] != mrec[:-1])[0]  # points where x axis (recall) changes
-        ap = np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])  # area under curve
+        i = mrec[:, 1:] != mrec[:, :-1]  # points where x axis (recall) changes
+        ap = np.where(i, (mrec[:, 1:] - mrec[:, :-1]) * mpre[:, 1:], 0).sum(1)  # area under curve
+
+    if recall.ndim == 1:
+        return ap[0], mpre[0], mrec[0]
+    return ap, mpre.T, mrec.T
 
-    return ap, mpre, mrec
+
+class APHistogram:
+    # Streaming ap_per_class(): true and false positives of the predictions of every class counted in bins of
+    # confidence, in constant O(classes x bins) memory; every non-empty bin acts as one group of predictions
+    def __init__(self, nc, niou=10, bins=1000):
+        self.n = np.zeros((nc, bins), dtype=np.int64)  # predictions
+        self.tp = np.zeros((nc, bins, niou), dtype=np.int64)  # true positives at each IoU threshold
+        self.nt = np.zeros(nc, dtype=np.int64)  # number of labels per class
+        self.nc = nc  # number of classes
+        self.bins = bins
+
+    def update(self, tp, conf, pred_cls, target_cls):
+        """
+        Adds the predictions and labels of an image or batch.
+        Arguments:
+            tp:  True positives (nparray, nx1 or nx10).
+            conf:  Objectness value from 0-1 (nparray).
+            pred_cls:  Predicted object classes (nparray).
+            target_cls:  True object classes (nparray).
+        """
+        c = np.asarray(pred_cls).astype(np.int64)  # classes
+        b = (np.asarray(conf) * self.bins).astype(np.int64).clip(0, self.bins - 1)  # confidence bins
+        np.add.at(self.n, (c, b), 1)
+        np.add.at(self.tp, (c, b), np.asarray(tp, dtype=np.int64))
+        self.nt += np.bincount(np.asarray(target_cls, dtype=np.int64), minlength=self.nc)
+
+    def ap_per_class(self, v5_metric=False, plot=False, save_dir='.', names=()):
+        # Returns ap_per_class() of all predictions added, each bin at its center confidence
+        c, b = self.n.nonzero()
+        unique_classes = self.nt.nonzero()[0]
+        tp = self.tp[c, b]
+        return pr_metrics(tp, self.n[c, b, None] - tp, (b + 0.5) / self.bins, c, unique_classes,
+                          self.nt[unique_classes], v5_metric, plot, save_dir, names)
 
 
 class ConfusionMatrix: